@@ -101,6 +101,7 @@ class Constants:
     BLACKLIST = "blacklist"
     LOG = "log"
     META = "meta"
+    JOB = "job"
     ENTITIES = (PUBLICATION, JOURNAL, ACCOUNT, LABEL, RESEARCHER)
 
     # Account roles
@@ -108,6 +109,12 @@ class Constants:
     CURATOR = "curator"
     ROLES = (ADMIN, CURATOR)
 
+    # Job statuses
+    PENDING = "pending"
+    RUNNING = "running"
+    FINISHED = "finished"
+    FAILED = "failed"
+
     LOGIN_URL = r"/login"
 
     # Boolean string values
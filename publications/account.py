@@ -9,6 +9,7 @@ from publications import settings
 from publications import utils
 from publications.requesthandler import CorsMixin, RequestHandler
 
+import publications.changes
 import publications.saver
 
 
@@ -174,6 +175,7 @@ class Account(AccountMixin, RequestHandler):
         for log in self.get_logs(account["_id"]):
             self.db.delete(log)
         self.db.delete(account)
+        publications.changes.notify_deleted(account)
         self.see_other("accounts")
 
 
@@ -14,7 +14,11 @@ from publications import utils
 from publications.requesthandler import RequestHandler
 
 import publications.database
+import publications.logwriter
+import publications.responsecache
 import publications.saver
+import publications.subset
+import publications.webservice
 
 
 DEFAULT_SETTINGS = dict(
@@ -26,6 +30,34 @@ DEFAULT_SETTINGS = dict(
     DATABASE_NAME="publications",
     DATABASE_ACCOUNT=None,  # Should probably be set to connect to CouchDB.
     DATABASE_PASSWORD=None,  # Should probably be set to connect to CouchDB.
+    DATABASE_POOL_SIZE=10,  # Max number of idle CouchDB connections kept.
+    DATABASE_POOL_IDLE_TIMEOUT=300,  # Seconds before idle connection discarded.
+    DATABASE_POOL_CHECK_INTERVAL=30,  # Seconds idle before check on reuse.
+    DATABASE_BULK_CHUNK_SIZE=200,  # Max number of documents per bulk fetch or save.
+    LOG_BATCH_SIZE=100,  # Max number of log entries written in one batch.
+    LOG_BATCH_INTERVAL=0.5,  # Max seconds before queued log entries are written.
+    CHANGES_POLL_TIMEOUT=60,  # Seconds for long-polling the changes feed.
+    SUBSET_INDEX=False,  # Use in-memory index for subset selection.
+    SEARCH_INDEX=False,  # Use in-memory inverted index for search.
+    SEARCH_LIMIT=100,  # Default max number of publications in a search result.
+    SEARCH_FIELD_WEIGHTS=dict(  # Relevance weights for fields; default 1.0.
+        title=3.0,
+        author=2.0,
+        researcher=2.0,
+        doi=3.0,
+        pmid=3.0,
+        label_parts=2.0,
+        notes=0.5,
+    ),
+    SUBSET_EXPRESSION_CACHE_SIZE=256,  # Number of parsed expressions cached.
+    SUBSET_RESULT_CACHE_SIZE=256,  # Number of subset selections cached; 0 disables.
+    ORCID_CACHE_SIZE=10000,  # Number of researcher ORCIDs cached.
+    YEAR_COUNTS_CACHE_TTL=300,  # Seconds before year counts refreshed; 0 disables.
+    ACCOUNT_CACHE_TTL=60,  # Seconds an account is cached for login; 0 disables.
+    ACCOUNT_CACHE_SIZE=1000,  # Number of Basic auth password hashes cached.
+    JSON_CHUNK_SIZE=100,  # Publications per flushed chunk of JSON output.
+    EXPORT_CHUNK_SIZE=100,  # Publications per flushed chunk of CSV or text output.
+    XLSX_CONSTANT_MEMORY_THRESHOLD=1000,  # Publications above which XLSX via file.
     COOKIE_SECRET=None,  # Must be set!
     PASSWORD_SALT=None,  # Must be set!
     SETTINGS_FILEPATH=None,  # This value is set on startup.
@@ -41,12 +73,17 @@ DEFAULT_SETTINGS = dict(
     MAIL_REPLY_TO=None,
     MIN_PASSWORD_LENGTH=6,
     LOGIN_MAX_AGE_DAYS=14,
-    PUBMED_DELAY=0.5,  # Delay before PubMed fetch, to avoid being blocked.
+    PUBMED_DELAY=0.5,  # Delay before PubMed fetch, if no RATE_LIMIT.
     PUBMED_TIMEOUT=5.0,  # Timeout limit for PubMed fetch.
     NCBI_API_KEY=None,  # NCBI account API key, if any.
-    CROSSREF_DELAY=0.5,  # Delay before Crossref fetch, to avoid being blocked.
+    CROSSREF_DELAY=0.5,  # Delay before Crossref fetch, if no RATE_LIMIT.
     CROSSREF_TIMEOUT=10.0,  # Timeout limit for Crossref fetch.
-    PUBLICATIONS_FETCHED_LIMIT=10,
+    RATE_LIMIT=True,  # Rate limit PubMed and Crossref fetches across processes.
+    RATE_LIMIT_FILEPATH=None,  # SQLite file for rate limits; default in tmp dir.
+    RESPONSE_CACHE_TTL=86400,  # Seconds PubMed/Crossref data is reused; 0 disables.
+    RESPONSE_CACHE_FILEPATH=None,  # SQLite file for the cache; default in site dir.
+    PUBLICATIONS_FETCHED_LIMIT=10,  # More than this are fetched by a job.
+    JOB_WORKERS=2,  # Number of threads processing fetch jobs.
     MAX_NUMBER_LABELS_PRECHECKED=6,
 )
 
@@ -129,6 +166,55 @@ def load_settings_from_file():
     for key in ["PUBMED_DELAY", "PUBMED_TIMEOUT", "CROSSREF_DELAY", "CROSSREF_TIMEOUT"]:
         if not isinstance(settings[key], (int, float)) or settings[key] <= 0.0:
             raise ValueError(f"Invalid '{key}' value: must be positive number.")
+    for key in [
+        "DATABASE_POOL_SIZE",
+        "DATABASE_POOL_IDLE_TIMEOUT",
+        "DATABASE_POOL_CHECK_INTERVAL",
+        "DATABASE_BULK_CHUNK_SIZE",
+        "LOG_BATCH_SIZE",
+        "LOG_BATCH_INTERVAL",
+        "CHANGES_POLL_TIMEOUT",
+        "SUBSET_EXPRESSION_CACHE_SIZE",
+        "SEARCH_LIMIT",
+        "ORCID_CACHE_SIZE",
+        "ACCOUNT_CACHE_SIZE",
+        "JSON_CHUNK_SIZE",
+        "EXPORT_CHUNK_SIZE",
+        "XLSX_CONSTANT_MEMORY_THRESHOLD",
+        "JOB_WORKERS",
+    ]:
+        if not isinstance(settings[key], (int, float)) or settings[key] <= 0:
+            raise ValueError(f"Invalid '{key}' value: must be positive number.")
+    if not isinstance(settings["SEARCH_FIELD_WEIGHTS"], dict):
+        raise ValueError("Invalid 'SEARCH_FIELD_WEIGHTS' value: must be dictionary.")
+    if (
+        not isinstance(settings["SUBSET_RESULT_CACHE_SIZE"], int)
+        or settings["SUBSET_RESULT_CACHE_SIZE"] < 0
+    ):
+        raise ValueError(
+            "Invalid 'SUBSET_RESULT_CACHE_SIZE' value: must be non-negative integer."
+        )
+    if (
+        not isinstance(settings["ACCOUNT_CACHE_TTL"], (int, float))
+        or settings["ACCOUNT_CACHE_TTL"] < 0
+    ):
+        raise ValueError(
+            "Invalid 'ACCOUNT_CACHE_TTL' value: must be non-negative number."
+        )
+    if (
+        not isinstance(settings["YEAR_COUNTS_CACHE_TTL"], (int, float))
+        or settings["YEAR_COUNTS_CACHE_TTL"] < 0
+    ):
+        raise ValueError(
+            "Invalid 'YEAR_COUNTS_CACHE_TTL' value: must be non-negative number."
+        )
+    if (
+        not isinstance(settings["RESPONSE_CACHE_TTL"], (int, float))
+        or settings["RESPONSE_CACHE_TTL"] < 0
+    ):
+        raise ValueError(
+            "Invalid 'RESPONSE_CACHE_TTL' value: must be non-negative number."
+        )
     if settings["MAIL_SERVER"] and not (
         settings["MAIL_DEFAULT_SENDER"] or settings["MAIL_USERNAME"]
     ):
@@ -316,7 +402,7 @@ class Database(RequestHandler):
     "Show data about the database."
 
     def get(self):
-        server = publications.database.get_server()
+        server = self.db.server
         identifier = self.get_argument("identifier", "")
         if identifier:
             try:
@@ -335,6 +421,15 @@ class Database(RequestHandler):
             databases=list(server),
             system_stats=server.get_node_system(),
             node_stats=server.get_node_stats(),
+            pool_stats=publications.database.get_pool().get_stats(),
+            expression_cache_stats=publications.subset.get_expression_cache_stats(),
+            result_cache_stats=publications.subset.get_result_cache_stats(),
+            year_counts_cache_stats=publications.database.get_year_counts_cache_stats(),
+            account_cache_stats=publications.database.get_account_cache_stats(),
+            journal_registry_stats=publications.database.get_journal_registry_stats(),
+            services_stats=publications.webservice.get_services_stats(),
+            response_cache_stats=publications.responsecache.get_cache_stats(),
+            log_writer_stats=publications.logwriter.get_stats(),
         )
 
 
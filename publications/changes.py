@@ -0,0 +1,87 @@
+"Follow the CouchDB changes feed and notify listeners of changed documents."
+
+import logging
+import threading
+import time
+
+import couchdb2
+
+from publications import settings
+
+import publications.database
+
+_listeners = []
+_follower = None
+
+
+def add_listener(listener):
+    """Add a callable to be called with each changed document.
+    A deleted document is given as a dictionary with the items
+    '_id' and '_deleted'.
+    """
+    _listeners.append(listener)
+
+
+def notify(doc):
+    """Notify all listeners of the changed document.
+    Called by the changes feed follower, and directly after
+    a save or delete in this process, to avoid waiting for the feed.
+    """
+    for listener in list(_listeners):
+        try:
+            listener(doc)
+        except Exception:
+            logging.getLogger("publications").exception(
+                f"Changes listener failed for document {doc.get('_id')}"
+            )
+
+
+def notify_deleted(doc):
+    "Notify all listeners that the document has been deleted."
+    notify({"_id": doc["_id"], "_deleted": True})
+
+
+def start(since):
+    """Start following the changes feed in a background thread,
+    from the given update sequence. Do nothing if already started,
+    or if there are no listeners.
+    """
+    global _follower
+    if _follower is not None or not _listeners:
+        return
+    _follower = Follower(since)
+    _follower.start()
+
+
+class Follower(threading.Thread):
+    "Thread following the CouchDB changes feed using long-polling."
+
+    def __init__(self, since):
+        super().__init__(name="changes", daemon=True)
+        self.since = since
+
+    def run(self):
+        logger = logging.getLogger("publications")
+        db = publications.database.connect_db()
+        while True:
+            try:
+                result = db.changes(
+                    feed="longpoll",
+                    since=self.since,
+                    include_docs=True,
+                    timeout=settings["CHANGES_POLL_TIMEOUT"] * 1000,
+                )
+            except (IOError, couchdb2.ServerError) as error:
+                logger.warning(f"Changes feed: {error}")
+                time.sleep(settings["CHANGES_POLL_TIMEOUT"])
+                try:
+                    db = publications.database.connect_db()
+                except (IOError, KeyError, couchdb2.ServerError):
+                    pass
+                continue
+            for item in result.get("results", []):
+                if item.get("deleted"):
+                    notify({"_id": item["id"], "_deleted": True})
+                elif item.get("doc"):
+                    notify(item["doc"])
+            self.since = result.get("last_seq", self.since)
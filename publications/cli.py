@@ -1,5 +1,7 @@
 "Command line interface to the Publications database."
 
+import codecs
+import concurrent.futures
 import csv
 import functools
 import json
@@ -9,6 +11,7 @@ import sys
 
 import click
 import couchdb2
+import tqdm
 
 from publications import constants
 from publications import crossref
@@ -17,17 +20,25 @@ from publications import settings
 from publications import utils
 from publications.account import AccountSaver
 from publications.publication import PublicationSaver, fetch_publication
-from publications.subset import Subset, get_parser
+from publications.saver import BulkSaver
+from publications.subset import Subset, get_plan
 
 import publications.admin
 import publications.main
 import publications.database
+import publications.job
+import publications.logwriter
+import publications.ratelimit
+import publications.responsecache
 import publications.writer
 
 
 @click.group()
 def cli():
     publications.admin.load_settings_from_file()
+    publications.ratelimit.configure()
+    publications.responsecache.create_cache()
+    publications.logwriter.start()
 
 
 @cli.command()
@@ -266,6 +277,12 @@ def _normalized(value):
     " If any other selection options are given, the expression"
     " is evaluated for that subset.",
 )
+@click.option(
+    "--explain",
+    is_flag=True,
+    default=False,
+    help="Output the evaluation plan of the selection expression to stderr.",
+)
 @click.option(
     "--format",
     help="Format of the output. Default CSV.",
@@ -316,6 +333,7 @@ def select(
     authors,
     orcids,
     expression,
+    explain,
     format,
     filepath,
     all_authors,
@@ -357,71 +375,96 @@ def select(
         result = Subset(db)
 
     if expression:
-        parser = get_parser()
         try:
             with open(expression) as infile:
-                parsed = parser.parseString(infile.read(), parseAll=True)
+                plan = get_plan(db, infile.read(), explain=explain)
         except IOError as error:
             raise click.ClickException(str(error))
-        except pp.ParseException as error:
+        except ValueError as error:
             raise click.ClickException(f"Expression invalid: {error}")
         try:
-            subset = parsed[0].evaluate(db)
+            subset = plan.evaluate(db, {})
         except Exception as error:
             raise click.ClickException(f"Evaluating selection expression: {error}")
+        if explain:
+            for step in plan.explain():
+                line = "  " * step["depth"] + step["step"]
+                line += f"  estimated: {step['estimated']}, actual: {step['actual']}"
+                if step["note"]:
+                    line += f"  ({step['note']})"
+                click.echo(line, err=True)
         if subsets:  # Were any previous subset(s) defined?
             result = result & subset
         else:
             result = subset
 
-    if format == "CSV":
-        writer = publications.writer.CsvWriter(
-            db,
-            app,
-            all_authors=all_authors,
-            single_label=single_label,
-            issn=issn,
-            encoding=encoding,
-            quoting=quoting,
-            delimiter=delimiter,
-        )
-        writer.write(result)
-        filepath = filepath or "publications.csv"
-
-    elif format == "XLSX":
-        if filepath == "-":
-            raise click.ClickException("Cannot output XLSX to stdout.")
-        writer = publications.writer.XlsxWriter(
-            db,
-            app,
-            all_authors=all_authors,
-            single_label=single_label,
-            issn=issn,
-            encoding=encoding,
-        )
-        writer.write(result)
-        filepath = filepath or "publications.xlsx"
-
-    elif format == "TXT":
-        writer = publications.writer.TextWriter(
-            db,
-            app,
-            all_authors=all_authors,
-            issn=issn,
-            encoding=encoding,
-            numbered=numbered,
-            maxline=maxline,
-            doi_url=doi_url,
-            pmid_url=pmid_url,
-        )
-        writer.write(result)
-        filepath = filepath or "publications.txt"
-
+    # CSV and text output is streamed to the file, publication by publication.
+    # XLSX output is copied in chunks, from a temporary file if large.
+    if format == "XLSX" and filepath == "-":
+        raise click.ClickException("Cannot output XLSX to stdout.")
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        raise click.ClickException(f"Unknown encoding '{encoding}'.")
+    filepath = filepath or f"publications.{format.lower()}"
     if filepath == "-":
-        sys.stdout.write(writer.get_content().decode(encoding))
-    elif filepath:
-        with open(filepath, "wb") as outfile:
-            outfile.write(writer.get_content())
+        outfile = sys.stdout.buffer
+    else:
+        try:
+            outfile = open(filepath, "wb")
+        except IOError as error:
+            raise click.ClickException(str(error))
+    try:
+        if format == "CSV":
+            writer = publications.writer.CsvWriter(
+                db,
+                app,
+                outfile=outfile,
+                all_authors=all_authors,
+                single_label=single_label,
+                issn=issn,
+                encoding=encoding,
+                quoting=quoting,
+                delimiter=delimiter,
+            )
+            writer.write(result)
+
+        elif format == "XLSX":
+            writer = publications.writer.XlsxWriter(
+                db,
+                app,
+                all_authors=all_authors,
+                single_label=single_label,
+                issn=issn,
+                encoding=encoding,
+            )
+            try:
+                writer.write(result)
+                for chunk in writer.iter_content():
+                    outfile.write(chunk)
+            finally:
+                writer.close()
+
+        elif format == "TXT":
+            writer = publications.writer.TextWriter(
+                db,
+                app,
+                outfile=outfile,
+                all_authors=all_authors,
+                issn=issn,
+                encoding=encoding,
+                numbered=numbered,
+                maxline=maxline,
+                doi_url=doi_url,
+                pmid_url=pmid_url,
+            )
+            writer.write(result)
+    finally:
+        if filepath == "-":
+            outfile.flush()
+        else:
+            outfile.close()
+    if filepath != "-":
         click.echo(result)
 
 
@@ -438,7 +481,32 @@ def select(
     help="Optional label to add to the publications."
     " May contain a qualifier after slash '/' character.",
 )
-def fetch(filepath, label):
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Number of concurrent fetchers. The rate limits for PubMed"
+    " and Crossref apply to all of them together.",
+)
+@click.option(
+    "-c",
+    "--checkpoint",
+    help="Path of the checkpoint file recording the identifiers done."
+    " Default is the file path with '.checkpoint' appended.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Skip the identifiers done according to the checkpoint file."
+    " Those that failed are tried again.",
+)
+@click.option(
+    "--progressbar/--no-progressbar", default=True, help="Display a progressbar."
+)
+def fetch(filepath, label, workers, checkpoint, resume, progressbar):
     """Fetch publications given a file containing PMIDs and/or DOIs,
     one per line. If the publication is already in the database, the label,
     if given, is added. For a PMID, the publication is fetched from PubMed.
@@ -446,6 +514,8 @@ def fetch(filepath, label):
     If that does not work, Crossref is tried.
     Delay, timeout and API key for fetching is defined in the settings file.
     """
+    if workers < 1:
+        raise click.ClickException("Number of workers must be positive.")
     db = publications.database.get_db()
     identifiers = []
     try:
@@ -457,6 +527,7 @@ def fetch(filepath, label):
                     pass
     except IOError as error:
         raise click.ClickException(str(error))
+    identifiers = list(dict.fromkeys(identifiers))  # Remove duplicates.
     if label:
         parts = label.split("/", 1)
         if len(parts) == 2:
@@ -472,34 +543,122 @@ def fetch(filepath, label):
             raise click.ClickException(f"No such label qualifier {qualifier}.")
         labels = {label: qualifier}
     else:
+        qualifier = None
         labels = {}
     # All labels are allowed from the CLI; as if admin were logged in.
     allowed_labels = set(
         [l["value"] for l in publications.database.get_docs(db, "label", "value")]
     )
-    for identifier in identifiers:
-        try:
-            publ = publications.database.get_publication(db, identifier)
-        except KeyError:
+    publications.database.release_db(db)
+
+    checkpoint = checkpoint or f"{filepath}.checkpoint"
+    if resume:
+        done = read_checkpoint(checkpoint)
+        identifiers = [i for i in identifiers if i not in done]
+        click.echo(f"Skipping {len(done)} identifiers done according to checkpoint.")
+    try:
+        outfile = open(checkpoint, "a" if resume else "w")
+    except IOError as error:
+        raise click.ClickException(str(error))
+
+    if progressbar:
+        echo = tqdm.tqdm.write
+    else:
+        echo = click.echo
+    fetcher = functools.partial(
+        fetch_chunk,
+        labels=labels,
+        label=label,
+        qualifier=qualifier,
+        allowed_labels=allowed_labels,
+    )
+    chunks = [
+        identifiers[i : i + publications.job.CHUNK_SIZE]
+        for i in range(0, len(identifiers), publications.job.CHUNK_SIZE)
+    ]
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        with outfile, tqdm.tqdm(
+            total=len(identifiers), unit="id", disable=not progressbar
+        ) as bar:
+            futures = dict([(executor.submit(fetcher, c), c) for c in chunks])
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as error:
+                    result = [(i, "error", f"Error: {error}") for i in futures[future]]
+                for identifier, status, message in result:
+                    echo(message)
+                    outfile.write(f"{identifier}\t{status}\n")
+                outfile.flush()
+                bar.update(len(result))
+    finally:
+        # On interrupt, let the chunks in progress finish, but no others.
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def fetch_chunk(identifiers, labels, label, qualifier, allowed_labels):
+    """Fetch the publications for the identifiers, or update the label
+    for those already in the database. The data for the identifiers not
+    in the database is fetched in bulk to start with.
+    Return a list of tuples (identifier, status, message).
+    """
+    db = publications.database.get_db()
+    try:
+        missing = []
+        for identifier in identifiers:
             try:
-                publ = fetch_publication(
-                    db,
-                    identifier,
-                    labels=labels,
-                    account=get_account(),
-                    allowed_labels=allowed_labels,
-                )
-            except IOError as error:
-                click.echo(f"Error: {error}")
-            except KeyError as error:
-                click.echo(f"Warning: {error}")
-            else:
-                click.echo(f"Fetched {publ['title']}")
-        else:
-            if add_label_to_publication(db, publ, label, qualifier):
-                click.echo(f"{identifier} already in database; label updated.")
+                publications.database.get_publication(db, identifier)
+            except KeyError:
+                missing.append(identifier)
+        fetched = publications.job.prefetch(missing)
+        result = []
+        for identifier in identifiers:
+            try:
+                publ = publications.database.get_publication(db, identifier)
+            except KeyError:
+                try:
+                    publ = fetch_publication(
+                        db,
+                        identifier,
+                        labels=labels,
+                        account=get_account(),
+                        allowed_labels=allowed_labels,
+                        fetched=fetched,
+                    )
+                except IOError as error:
+                    result.append((identifier, "error", f"Error: {error}"))
+                except KeyError as error:
+                    result.append((identifier, "blacklisted", f"Warning: {error}"))
+                else:
+                    result.append((identifier, "fetched", f"Fetched {publ['title']}"))
             else:
-                click.echo(f"{identifier} already in database.")
+                if label and add_label_to_publication(db, publ, label, qualifier):
+                    message = f"{identifier} already in database; label updated."
+                else:
+                    message = f"{identifier} already in database."
+                result.append((identifier, "exists", message))
+        return result
+    finally:
+        publications.database.release_db(db)
+
+
+def read_checkpoint(filepath):
+    """Read the checkpoint file of the 'fetch' command. Return the set of
+    identifiers done, excluding those that failed with an error.
+    """
+    done = set()
+    try:
+        with open(filepath) as infile:
+            for line in infile:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] != "error":
+                    done.add(parts[0])
+    except FileNotFoundError:
+        pass
+    except IOError as error:
+        raise click.ClickException(str(error))
+    return done
 
 
 @cli.command()
@@ -532,16 +691,17 @@ def add_label(label, csvfilepath):
         raise click.ClickException(str(error))
     if qualifier and qualifier not in settings["SITE_LABEL_QUALIFIERS"]:
         raise click.ClickException(f"No such label qualifier {qualifier}.")
-    count = 0
-    for iuid in get_iuids_from_csv(csvfilepath):
-        try:
-            publ = db[iuid]
-        except KeyError:
-            click.echo(f"No such publication {iuid}; skipping.")
-        else:
-            if add_label_to_publication(db, publ, label, qualifier):
-                count += 1
-    click.echo(f"Added label to {count} publications.")
+
+    def add(saver):
+        labels = saver["labels"].copy()
+        labels[label] = qualifier
+        saver["labels"] = labels
+
+    bulk = BulkSaver(PublicationSaver, db=db, account=get_account())
+    saved = bulk.save(get_publications_from_csv(db, csvfilepath), add)
+    click.echo(f"Added label to {len(saved)} publications.")
+    if bulk.failed:
+        click.echo(f"Error: {bulk.get_failed_message()}")
 
 
 @cli.command()
@@ -562,21 +722,18 @@ def remove_label(label, csvfilepath):
         label = publications.database.get_label(db, label)["value"]
     except KeyError as error:
         raise click.ClickException(str(error))
-    count = 0
-    for iuid in get_iuids_from_csv(csvfilepath):
-        try:
-            publ = db[iuid]
-        except KeyError:
-            click.echo(f"No such publication {iuid}; skipping.")
-            continue
-        if label not in publ["labels"]:
-            continue
-        with PublicationSaver(doc=publ, db=db, account=get_account()) as saver:
-            labels = publ["labels"].copy()
+
+    def remove(saver):
+        if label in saver["labels"]:
+            labels = saver["labels"].copy()
             labels.pop(label)
             saver["labels"] = labels
-        count += 1
-    click.echo(f"Removed label from {count} publications.")
+
+    bulk = BulkSaver(PublicationSaver, db=db, account=get_account())
+    saved = bulk.save(get_publications_from_csv(db, csvfilepath), remove)
+    click.echo(f"Removed label from {len(saved)} publications.")
+    if bulk.failed:
+        click.echo(f"Error: {bulk.get_failed_message()}")
 
 
 @cli.command()
@@ -625,6 +782,7 @@ def update_pubmed(csvfilepath):
     """Use PubMed to update the publications in the CSV file.
     If a publication lacks PMID then that publication is skipped.
 
+    The PMIDs are fetched in chunks, one call to PubMed per chunk.
     Note that a delay is inserted between each call to PubMed to avoid
     bad behaviour towards the web service.
     """
@@ -632,31 +790,39 @@ def update_pubmed(csvfilepath):
     count = 0
     iuids = get_iuids_from_csv(csvfilepath)
     click.echo(f"{len(iuids)} publications in CSV input file.")
-    for iuid in iuids:
-        try:
-            publ = db[iuid]
-        except KeyError:
-            click.echo(f"No such publication {iuid}; skipping.")
-            continue
-        pmid = publ.get("pmid")
-        if not pmid:
-            continue
+    # Fetch from PubMed in chunks, one HTTP request per chunk.
+    for pos in range(0, len(iuids), pubmed.FETCH_CHUNK_SIZE):
+        publs = []
+        for iuid in iuids[pos : pos + pubmed.FETCH_CHUNK_SIZE]:
+            try:
+                publ = db[iuid]
+            except KeyError:
+                click.echo(f"No such publication {iuid}; skipping.")
+                continue
+            if publ.get("pmid"):
+                publs.append(publ)
         try:
-            new = pubmed.fetch(
-                pmid,
+            fetched, missing = pubmed.fetch_many(
+                [publ["pmid"] for publ in publs],
                 timeout=settings["PUBMED_TIMEOUT"],
                 delay=settings["PUBMED_DELAY"],
                 api_key=settings["NCBI_API_KEY"],
             )
         except (OSError, IOError):
-            click.echo(f"No response from PubMed for {pmid}.")
-        except ValueError as error:
-            click.echo(f"{pmid}, {error}")
-        else:
+            pmids = ", ".join([publ["pmid"] for publ in publs])
+            click.echo(f"No response from PubMed for {pmids}.")
+            continue
+        for pmid in missing:
+            click.echo(f"{pmid}, no article with the given PMID")
+        for publ in publs:
+            try:
+                new = fetched[publ["pmid"]]
+            except KeyError:
+                continue
             with PublicationSaver(doc=publ, db=db, account=get_account()) as saver:
                 saver.update(new)
                 saver.fix_journal()
-            click.echo(f"Updated {iuid} {publ['title'][:50]}...")
+            click.echo(f"Updated {publ['_id']} {publ['title'][:50]}...")
             count += 1
     click.echo(f"Updated {count} publications from PubMed.")
 
@@ -673,6 +839,7 @@ def update_crossref(csvfilepath):
     """Use Crossref to update the publications in the CSV file.
     If a publication lacks DOI then that publication is skipped.
 
+    The DOIs are fetched in chunks, one call to Crossref per chunk.
     Note that a delay is inserted between each call to Crossref to avoid
     bad behaviour towards the web service.
     """
@@ -680,30 +847,47 @@ def update_crossref(csvfilepath):
     count = 0
     iuids = get_iuids_from_csv(csvfilepath)
     click.echo(f"{len(iuids)} publications in CSV input file.")
-    for iuid in iuids:
-        try:
-            publ = db[iuid]
-        except KeyError:
-            click.echo(f"No such publication {iuid}; skipping.")
-            continue
-        doi = publ.get("doi")
-        if not doi:
-            continue
+    for pos in range(0, len(iuids), crossref.FETCH_CHUNK_SIZE):
+        publs = []
+        for iuid in iuids[pos : pos + crossref.FETCH_CHUNK_SIZE]:
+            try:
+                publ = db[iuid]
+            except KeyError:
+                click.echo(f"No such publication {iuid}; skipping.")
+                continue
+            if publ.get("doi"):
+                publs.append(publ)
         try:
-            new = crossref.fetch(
-                doi,
+            fetched, missing = crossref.fetch_many(
+                [publ["doi"] for publ in publs],
                 timeout=settings["CROSSREF_TIMEOUT"],
                 delay=settings["CROSSREF_DELAY"],
             )
         except (OSError, IOError):
-            click.echo(f"No response from Crossref for {doi}.")
-        except ValueError as error:
-            click.echo(f"{doi}, {error}")
-        else:
+            dois = ", ".join([publ["doi"] for publ in publs])
+            click.echo(f"No response from Crossref for {dois}.")
+            continue
+        for publ in publs:
+            try:
+                new = fetched[publ["doi"]]
+            except KeyError:
+                # Not found in bulk; try fetching it by itself.
+                try:
+                    new = crossref.fetch(
+                        publ["doi"],
+                        timeout=settings["CROSSREF_TIMEOUT"],
+                        delay=settings["CROSSREF_DELAY"],
+                    )
+                except (OSError, IOError):
+                    click.echo(f"No response from Crossref for {publ['doi']}.")
+                    continue
+                except ValueError as error:
+                    click.echo(f"{publ['doi']}, {error}")
+                    continue
             with PublicationSaver(doc=publ, db=db, account=get_account()) as saver:
                 saver.update(new)
                 saver.fix_journal()
-            click.echo(f"Updated {iuid} {publ['title'][:50]}...")
+            click.echo(f"Updated {publ['_id']} {publ['title'][:50]}...")
             count += 1
     click.echo(f"Updated {count} publications from Crossref.")
 
@@ -748,6 +932,26 @@ def find_pmid(csvfilepath):
     click.echo(f"Set PMID for {count} publications.")
 
 
+@cli.group()
+def cache():
+    "Manage the cache of responses from PubMed and Crossref."
+    if publications.responsecache.get_cache() is None:
+        raise click.ClickException("Response cache not in use; see settings.")
+
+
+@cache.command()
+def stats():
+    "Output the statistics for the response cache."
+    click.echo(json.dumps(publications.responsecache.get_cache_stats(), indent=2))
+
+
+@cache.command()
+def prune():
+    "Delete the stale entries in the response cache."
+    count = publications.responsecache.get_cache().prune()
+    click.echo(f"Deleted {count} stale entries from the response cache.")
+
+
 def add_label_to_publication(db, publication, label, qualifier):
     if publication["labels"].get(label, "dummy qualifier") == qualifier:
         return False
@@ -767,6 +971,23 @@ def get_iuids_from_csv(csvfilepath):
         raise click.ClickException(str(error))
 
 
+def get_publications_from_csv(db, csvfilepath):
+    """Get the publications for the IUIDs in the CSV file.
+    Report those not found.
+    """
+    iuids = get_iuids_from_csv(csvfilepath)
+    result = [
+        d
+        for d in publications.database.get_bulk(db, iuids)
+        if d.get(constants.DOCTYPE) == constants.PUBLICATION
+    ]
+    found = set([d["_id"] for d in result])
+    for iuid in iuids:
+        if iuid not in found:
+            click.echo(f"No such publication {iuid}; skipping.")
+    return result
+
+
 def get_account():
     "Get dict with current account info for logging purposes."
     try:
@@ -1,18 +1,32 @@
 "Crossref interface."
 
+import asyncio
 import json
 import os.path
 import re
 import sys
+import threading
 import time
 import unicodedata
+import urllib.parse
 
-import requests
+import tornado.ioloop
+
+import publications.responsecache
+import publications.webservice
 
 CROSSREF_FETCH_URL = "https://api.crossref.org/works/%s"
+CROSSREF_WORKS_URL = "https://api.crossref.org/works"
+
+SERVICE = "Crossref"
 
+RATE = 5.0  # Max requests per second for the Crossref public pool.
 DEFAULT_TIMEOUT = 5.0
 DEFAULT_DELAY = 0.5
+FETCH_CHUNK_SIZE = 50  # Max number of DOIs per works filter query.
+
+_last_request = 0.0  # Monotonic time at which the last request was made.
+_last_request_lock = threading.Lock()
 
 MARKUP_RX = re.compile(r"<(/?.{1,6})>")
 ORCID_RX = re.compile(r"^[0-9]{4}-[0-9]{4}-[0-9]{4}-[0-9]{3}[X0-9]$")
@@ -21,37 +35,310 @@ ORCID_RX = re.compile(r"^[0-9]{4}-[0-9]{4}-[0-9]{4}-[0-9]{3}[X0-9]$")
 def fetch(doi, dirname=None, timeout=DEFAULT_TIMEOUT, delay=DEFAULT_DELAY, debug=False):
     """Fetch publication JSON data from Crossref and parse into a dictionary.
     Raise IOError if no connection or timeout.
-    Use the file cache directory if given.
+    Use the file cache directory if given, and the response cache if in use.
     Delay the HTTP request if positive value (seconds).
     """
-    filename = doi.replace("/", "_") + ".json"
-    data = None
-    if dirname:
-        try:
-            with open(os.path.join(dirname, filename)) as infile:
-                data = json.load(infile)
-        except IOError:
-            pass
+    data = read_file(dirname, doi)
     if not data:
         url = CROSSREF_FETCH_URL % doi
-        if delay > 0.0:
-            time.sleep(delay)
-        if debug:
-            print("url>", url)
-        try:
-            response = requests.get(url, timeout=timeout)
-        except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectionError):
-            raise IOError("timeout")
-        if response.status_code != 200:
-            raise IOError(f"HTTP status {response.status_code} {url}")
-        data = response.json()
-        # Store the JSON file locally.
-        if dirname:
-            with open(os.path.join(dirname, filename), "w") as outfile:
-                outfile.write(json.dumps(data, indent=2, ensure_ascii=False))
+        data = get_data(url, timeout=timeout, delay=delay, debug=debug, key=doi)
+        write_file(dirname, doi, data)
+    return parse(data)
+
+
+async def fetch_async(
+    doi, dirname=None, timeout=DEFAULT_TIMEOUT, delay=DEFAULT_DELAY, debug=False
+):
+    """Asynchronous version of 'fetch', for use within the Tornado IOLoop.
+    The delay is the minimum interval between requests to Crossref.
+    """
+    data = read_file(dirname, doi)
+    if not data:
+        url = CROSSREF_FETCH_URL % doi
+        data = await get_data_async(
+            url, timeout=timeout, delay=delay, debug=debug, key=doi
+        )
+        write_file(dirname, doi, data)
     return parse(data)
 
 
+def fetch_many(
+    dois,
+    dirname=None,
+    chunk_size=FETCH_CHUNK_SIZE,
+    timeout=DEFAULT_TIMEOUT,
+    delay=DEFAULT_DELAY,
+    debug=False,
+):
+    """Fetch publication JSON data from Crossref for many DOIs, using
+    filter queries on the works endpoint for chunks of DOIs, with cursor
+    paging, and parse into dictionaries.
+    Return a tuple of a dictionary with DOI as key and publication
+    dictionary as value, and the list of DOIs for which no item was found.
+    Use the file cache directory if given, and the response cache if in use.
+    Delay each HTTP request if positive value (seconds); a longer delay
+    is used if required by the rate limit given in the response headers.
+    Raise IOError if no connection, timeout or bad HTTP status.
+    """
+    result, remaining = read_many(dirname, dois)
+    # A DOI containing a comma cannot be given in a filter query.
+    batched = [doi for doi in remaining if "," not in doi]
+    for pos in range(0, len(batched), chunk_size):
+        chunk = batched[pos : pos + chunk_size]
+        cursor = "*"
+        while cursor:
+            wait(delay)
+            url = get_works_url(chunk, cursor)
+            response = get_response(url, timeout=timeout, debug=debug)
+            delay = max(delay, get_rate_limit_delay(response.headers))
+            cursor = parse_works(response.json(), chunk, result, dirname=dirname)
+    return result, [doi for doi in remaining if doi not in result]
+
+
+async def fetch_many_async(
+    dois,
+    dirname=None,
+    chunk_size=FETCH_CHUNK_SIZE,
+    timeout=DEFAULT_TIMEOUT,
+    delay=DEFAULT_DELAY,
+    debug=False,
+):
+    """Asynchronous version of 'fetch_many', for use within the Tornado IOLoop.
+    The delay is the minimum interval between requests to Crossref.
+    The caches are read and written in the executor, not on the IOLoop thread.
+    """
+    ioloop = tornado.ioloop.IOLoop.current()
+    result, remaining = await ioloop.run_in_executor(None, read_many, dirname, dois)
+    # A DOI containing a comma cannot be given in a filter query.
+    batched = [doi for doi in remaining if "," not in doi]
+    for pos in range(0, len(batched), chunk_size):
+        chunk = batched[pos : pos + chunk_size]
+        cursor = "*"
+        while cursor:
+            await wait_async(delay)
+            url = get_works_url(chunk, cursor)
+            response = await get_response_async(url, timeout=timeout, debug=debug)
+            delay = max(delay, get_rate_limit_delay(response.headers))
+            cursor = await ioloop.run_in_executor(
+                None, parse_works, response.json(), chunk, result, dirname
+            )
+    return result, [doi for doi in remaining if doi not in result]
+
+
+def get_data(url, timeout=DEFAULT_TIMEOUT, delay=DEFAULT_DELAY, debug=False, key=None):
+    """Get the JSON data of the response for the URL, after the delay.
+    If the key (DOI) is given and the response cache is in use, then
+    a fresh cached response is used instead, and a stale one is revalidated.
+    Raise IOError if no connection, timeout or bad HTTP status.
+    """
+    cache = publications.responsecache.get_cache() if key else None
+    entry = cache.get(SERVICE, key) if cache else None
+    if entry and entry["fresh"]:
+        return json.loads(entry["content"])
+    wait(delay)
+    if debug:
+        print("url>", url)
+    response = publications.webservice.get_service(SERVICE).get(
+        url, timeout=timeout, headers=entry and entry["headers"]
+    )
+    return handle_response(url, response, cache, key, entry)
+
+
+async def get_data_async(
+    url, timeout=DEFAULT_TIMEOUT, delay=DEFAULT_DELAY, debug=False, key=None
+):
+    """Asynchronous version of 'get_data', for use within the Tornado IOLoop.
+    The response cache is read and written in the executor.
+    """
+    ioloop = tornado.ioloop.IOLoop.current()
+    cache = publications.responsecache.get_cache() if key else None
+    if cache:
+        entry = await ioloop.run_in_executor(None, cache.get, SERVICE, key)
+    else:
+        entry = None
+    if entry and entry["fresh"]:
+        return json.loads(entry["content"])
+    await wait_async(delay)
+    if debug:
+        print("url>", url)
+    response = await publications.webservice.get_service(SERVICE).get_async(
+        url, timeout=timeout, headers=entry and entry["headers"]
+    )
+    return await ioloop.run_in_executor(
+        None, handle_response, url, response, cache, key, entry
+    )
+
+
+def handle_response(url, response, cache=None, key=None, entry=None):
+    """Get the JSON data of the response, and update the response cache, if any.
+    Raise IOError if bad HTTP status.
+    """
+    if entry and response.status_code == 304:
+        cache.touch(SERVICE, key)
+        return json.loads(entry["content"])
+    if response.status_code != 200:
+        raise IOError(f"HTTP status {response.status_code} {url}")
+    if cache:
+        cache.put(
+            SERVICE,
+            key,
+            response.content,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+    return response.json()
+
+
+def get_response(url, timeout=DEFAULT_TIMEOUT, debug=False):
+    """Get the response for the URL.
+    Raise IOError if no connection, timeout or bad HTTP status.
+    """
+    if debug:
+        print("url>", url)
+    response = publications.webservice.get_service(SERVICE).get(url, timeout=timeout)
+    if response.status_code != 200:
+        raise IOError(f"HTTP status {response.status_code} {url}")
+    return response
+
+
+async def get_response_async(url, timeout=DEFAULT_TIMEOUT, debug=False):
+    "Asynchronous version of 'get_response', for use within the Tornado IOLoop."
+    if debug:
+        print("url>", url)
+    service = publications.webservice.get_service(SERVICE)
+    response = await service.get_async(url, timeout=timeout)
+    if response.status_code != 200:
+        raise IOError(f"HTTP status {response.status_code} {url}")
+    return response
+
+
+def get_works_url(dois, cursor="*"):
+    "Get the URL for the works filter query for the DOIs."
+    query = dict(
+        filter=",".join([f"doi:{doi}" for doi in dois]),
+        rows=len(dois),
+        cursor=cursor,
+    )
+    return f"{CROSSREF_WORKS_URL}?{urllib.parse.urlencode(query)}"
+
+
+def get_rate_limit_delay(headers):
+    """Get the minimum delay (seconds) between requests according to
+    the rate limit headers of the response. Return 0.0 if none given.
+    """
+    try:
+        limit = int(headers["X-Rate-Limit-Limit"])
+        interval = float(headers["X-Rate-Limit-Interval"].rstrip("s"))
+        return interval / limit
+    except (KeyError, ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def parse_works(data, dois, result, dirname=None):
+    """Parse the items in the JSON data from a works filter query for the DOIs,
+    and add to the result dictionary with DOI as key.
+    Items that cannot be parsed are skipped.
+    Store the JSON for each item in the file cache directory if given,
+    and in the response cache if in use.
+    Return the cursor for the next page, or None if no more items.
+    """
+    cache = publications.responsecache.get_cache()
+    lookup = dict([(doi.lower(), doi) for doi in dois])
+    items = data["message"].get("items") or []
+    for item in items:
+        try:
+            doi = lookup[item["DOI"].lower()]
+            result[doi] = parse({"message": item})
+        except (KeyError, ValueError, TypeError):
+            continue
+        write_file(dirname, doi, {"message": item})
+        if cache:
+            cache.put(SERVICE, doi, json.dumps({"message": item}))
+    if not items or all([doi in result for doi in dois]):
+        return None
+    return data["message"].get("next-cursor")
+
+
+def read_many(dirname, dois):
+    """Get the publications for the DOIs that are in the file cache,
+    or fresh in the response cache.
+    Return a tuple of a dictionary with DOI as key and publication
+    dictionary as value, and the list of unique DOIs not cached,
+    or whose cached data could not be parsed.
+    """
+    cache = publications.responsecache.get_cache()
+    result = {}
+    remaining = []
+    for doi in dois:
+        if doi in result or doi in remaining:
+            continue
+        try:
+            data = read_file(dirname, doi)
+            if not data and cache:
+                entry = cache.get(SERVICE, doi)
+                if entry and entry["fresh"]:
+                    data = json.loads(entry["content"])
+            if not data:
+                raise ValueError
+            result[doi] = parse(data)
+        except (KeyError, ValueError, TypeError):  # Fetch anew if unparsable.
+            remaining.append(doi)
+    return result, remaining
+
+
+def wait(delay):
+    """Wait until at least 'delay' seconds have passed since the previous
+    request to Crossref from this process, also when several threads make
+    requests, unless the service has a rate limiter, which then is used
+    instead; see 'publications.ratelimit'.
+    """
+    if delay <= 0.0 or publications.webservice.get_service(SERVICE).limiter:
+        return
+    time.sleep(get_wait(delay))
+
+
+def get_wait(delay):
+    "Get the time (seconds) to wait before the next request, and reserve it."
+    global _last_request
+    with _last_request_lock:
+        now = time.monotonic()
+        start = max(now, _last_request + delay)
+        _last_request = start
+    return start - now
+
+
+async def wait_async(delay):
+    """Wait, without blocking the IOLoop, until at least 'delay' seconds
+    have passed since the previous request from this process, unless
+    the service has a rate limiter, which then is used instead.
+    """
+    if publications.webservice.get_service(SERVICE).limiter:
+        return
+    wait = get_wait(delay)
+    if wait > 0.0:
+        await asyncio.sleep(wait)
+
+
+def read_file(dirname, doi):
+    "Get the locally stored JSON file if the directory is given and it exists."
+    if not dirname:
+        return None
+    filename = doi.replace("/", "_") + ".json"
+    try:
+        with open(os.path.join(dirname, filename)) as infile:
+            return json.load(infile)
+    except IOError:
+        return None
+
+
+def write_file(dirname, doi, data):
+    "Store the JSON file locally, if the directory is given."
+    if dirname:
+        filename = doi.replace("/", "_") + ".json"
+        with open(os.path.join(dirname, filename), "w") as outfile:
+            outfile.write(json.dumps(data, indent=2, ensure_ascii=False))
+
+
 def parse(data):
     "Parse JSON data for a publication into a dictionary."
     result = dict()
@@ -1,6 +1,12 @@
 "CouchDB operations."
 
+import copy
+import hashlib
+import hmac
 import logging
+import os
+import threading
+import time
 
 import couchdb2
 
@@ -8,6 +14,8 @@ from publications import constants
 from publications import settings
 from publications import utils
 
+import publications.changes
+
 
 def get_server():
     "Return the CouchDB2 handle for the CouchDB server."
@@ -18,9 +26,9 @@ def get_server():
     return couchdb2.Server(**kwargs)
 
 
-def get_db():
-    """Return the CouchDB2 handle for the CouchDB database.
-    The named database must exist.
+def connect_db():
+    """Return a new CouchDB2 handle for the CouchDB database,
+    using a new server connection. The named database must exist.
     """
     server = get_server()
     name = settings["DATABASE_NAME"]
@@ -30,6 +38,106 @@ def get_db():
         raise KeyError(f"CouchDB database '{name}' does not exist.")
 
 
+def get_db():
+    """Return a CouchDB2 handle for the CouchDB database from the pool.
+    The named database must exist.
+    The handle should be returned to the pool using 'release_db'.
+    """
+    return get_pool().acquire()
+
+
+def release_db(db):
+    "Return the CouchDB2 database handle to the pool."
+    get_pool().release(db)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def create_pool():
+    "Create the process-wide pool of database handles, replacing any previous."
+    global _pool
+    with _pool_lock:
+        _pool = Pool(
+            size=settings["DATABASE_POOL_SIZE"],
+            idle_timeout=settings["DATABASE_POOL_IDLE_TIMEOUT"],
+            check_interval=settings["DATABASE_POOL_CHECK_INTERVAL"],
+        )
+    return _pool
+
+
+def get_pool():
+    "Return the process-wide pool of database handles; create it if needed."
+    if _pool is None:
+        return create_pool()
+    return _pool
+
+
+class Pool:
+    """Thread-safe pool of keep-alive CouchDB2 database handles.
+    Each handle has its own server connection, i.e. HTTP session.
+    """
+
+    def __init__(self, size=10, idle_timeout=300, check_interval=30):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.idle = []  # List of tuples (db, time when released).
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+
+    def acquire(self):
+        """Get a database handle from the pool, or create a new one.
+        Handles idle for too long are discarded. Handles idle for longer
+        than the check interval are checked before being reused.
+        """
+        while True:
+            with self.lock:
+                try:
+                    db, released = self.idle.pop()
+                except IndexError:
+                    self.misses += 1
+                    break
+            idle = time.monotonic() - released
+            if idle > self.idle_timeout:
+                continue
+            if idle > self.check_interval and not self.is_healthy(db):
+                with self.lock:
+                    self.reconnects += 1
+                break
+            with self.lock:
+                self.hits += 1
+            return db
+        return connect_db()
+
+    def release(self, db):
+        "Return the database handle to the pool, unless the pool is full."
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((db, time.monotonic()))
+
+    def is_healthy(self, db):
+        "Is the connection of the database handle still usable?"
+        try:
+            return db.exists()
+        except (IOError, couchdb2.ServerError):
+            return False
+
+    def get_stats(self):
+        "Return a dictionary of the current counters for the pool."
+        with self.lock:
+            return dict(
+                size=self.size,
+                idle=len(self.idle),
+                hits=self.hits,
+                misses=self.misses,
+                reconnects=self.reconnects,
+            )
+
+
 def update_design_documents(db=None):
     "Ensure that all CouchDB design documents are up to date."
     if db is None:
@@ -39,6 +147,8 @@ def update_design_documents(db=None):
         logger.info("Updated 'account' CouchDB design document.")
     if db.put_design("blacklist", BLACKLIST_DESIGN_DOC):
         logger.info("Updated 'blacklist' CouchDB design document.")
+    if db.put_design("job", JOB_DESIGN_DOC):
+        logger.info("Updated 'job' CouchDB design document.")
     if db.put_design("journal", JOURNAL_DESIGN_DOC):
         logger.info("Updated 'journal' CouchDB design document.")
     if db.put_design("label", LABEL_DESIGN_DOC):
@@ -78,12 +188,42 @@ def get_docs(db, designname, viewname, key=None, last=None, **kwargs):
     return [i.doc for i in view]
 
 
-def get_count(db, designname, viewname, key=None):
-    "Get the reduce value for the name view and the given key."
+def get_iuids(db, designname, viewname, key=None, last=None, **kwargs):
+    """Get the list of unique document IUIDs using the given design view
+    and the given key or interval, in the order of the view.
+    """
     if key is None:
-        view = db.view(designname, viewname, reduce=True)
+        pass
+    elif last is None:
+        kwargs["key"] = key
     else:
+        kwargs["startkey"] = key
+        kwargs["endkey"] = last
+    view = db.view(designname, viewname, reduce=False, **kwargs)
+    return list(dict.fromkeys([i.id for i in view]))
+
+
+def get_bulk(db, iuids, chunk_size=None):
+    """Get the documents for the IUIDs, in the given order, using
+    '_bulk_get' for chunks of at most DATABASE_BULK_CHUNK_SIZE IUIDs.
+    Duplicate IUIDs are fetched once. Documents not found are skipped.
+    """
+    chunk_size = chunk_size or settings["DATABASE_BULK_CHUNK_SIZE"]
+    iuids = list(dict.fromkeys(iuids))
+    result = []
+    for pos in range(0, len(iuids), chunk_size):
+        result.extend([d for d in db.get_bulk(iuids[pos : pos + chunk_size]) if d])
+    return result
+
+
+def get_count(db, designname, viewname, key=None, last=None):
+    "Get the reduce value for the name view and the given key or interval."
+    if key is None:
+        view = db.view(designname, viewname, reduce=True)
+    elif last is None:
         view = db.view(designname, viewname, key=key, reduce=True)
+    else:
+        view = db.view(designname, viewname, startkey=key, endkey=last, reduce=True)
     try:
         return list(view)[0].value
     except IndexError:
@@ -93,7 +233,7 @@ def get_count(db, designname, viewname, key=None):
 def get_counts(db):
     "Get the counts for the most important entities in the database."
     return dict(
-        n_publications=get_count(db, "publication", "year"),
+        n_publications=sum([c for y, c in get_year_counts(db)]),
         n_labels=get_count(db, "label", "value"),
         n_researchers=get_count(db, "researcher", "name"),
         n_accounts=get_count(db, "account", "email"),
@@ -112,6 +252,157 @@ def get_account(db, email):
     return doc
 
 
+_account_cache = None
+
+
+def create_account_cache():
+    """Create the process-wide cache of accounts for authentication,
+    and keep it up to date from the changes feed.
+    """
+    global _account_cache
+    _account_cache = AccountCache(
+        settings["ACCOUNT_CACHE_TTL"], settings["ACCOUNT_CACHE_SIZE"]
+    )
+    publications.changes.add_listener(_account_cache.update)
+    return _account_cache
+
+
+def get_cached_account(db, email=None, api_key=None):
+    """Get the account identified by the email address or the API key,
+    using the process-wide cache, if any. The account returned is a copy,
+    so it may be modified. Raise KeyError if not found.
+    """
+    if _account_cache is not None:
+        generation = _account_cache.generation
+        try:
+            return _account_cache.get(email=email, api_key=api_key)
+        except KeyError:
+            pass
+    if api_key:
+        try:
+            account = get_doc(db, "account", "api_key", api_key)
+        except KeyError:
+            raise KeyError("no such API key")
+    else:
+        account = get_account(db, email)
+    if _account_cache is not None:
+        _account_cache.put(account, generation=generation)
+    return account
+
+
+def get_hashed_password(credentials, password):
+    """Return the password in hashed form. The hash for the credentials,
+    i.e. the HTTP Basic authentication value, is cached if possible.
+    The cache key is a keyed digest, so the credentials are not kept.
+    """
+    if _account_cache is None:
+        return utils.hashed_password(password)
+    key = _account_cache.get_digest(credentials)
+    try:
+        return _account_cache.hashed.get(key)
+    except KeyError:
+        hashed = utils.hashed_password(password)
+        _account_cache.hashed.put(key, hashed)
+        return hashed
+
+
+def get_account_cache_stats():
+    "Return the statistics for the account cache, or None if not in use."
+    if _account_cache is None:
+        return None
+    return _account_cache.get_stats()
+
+
+class AccountCache:
+    """Thread-safe cache of accounts by email and by API key. An entry
+    expires after the time to live (seconds), and is removed when the
+    account is changed or deleted. Also caches the password hashes
+    for HTTP Basic authentication values, keyed by their digests.
+    """
+
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.accounts = {}  # Key: email, value: tuple (account, time cached).
+        self.api_keys = {}  # Key: API key, value: email.
+        self.emails = {}  # Key: account IUID, value: email.
+        self.hashed = utils.LruCache(size)  # Key: digest of credentials.
+        self.digest_key = os.urandom(32)  # Secret for this process only.
+        self.generation = 0  # Incremented for every account change.
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, email=None, api_key=None):
+        "Return a copy of the cached account. Raise KeyError if not cached."
+        with self.lock:
+            try:
+                if api_key:
+                    email = self.api_keys[api_key]
+                account, cached = self.accounts[email]
+                if time.monotonic() - cached >= self.ttl:
+                    self.remove(account["_id"])
+                    raise KeyError
+            except KeyError:
+                self.misses += 1
+                raise
+            self.hits += 1
+            return copy.deepcopy(account)
+
+    def put(self, account, generation=None):
+        """Cache a copy of the account. If the generation is given, and any
+        account has been changed since then, the account read may be stale,
+        so it is not cached.
+        """
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.remove(account["_id"])
+            self.accounts[account["email"]] = (copy.deepcopy(account), time.monotonic())
+            self.emails[account["_id"]] = account["email"]
+            if account.get("api_key"):
+                self.api_keys[account["api_key"]] = account["email"]
+
+    def update(self, doc):
+        "Remove the cached account if it has been changed or deleted."
+        if doc.get("_deleted") or doc.get(constants.DOCTYPE) == constants.ACCOUNT:
+            with self.lock:
+                self.generation += 1
+                if self.remove(doc["_id"]):
+                    self.invalidations += 1
+
+    def remove(self, iuid):
+        """Remove the account with the given IUID, if cached. Return True
+        if it was. The lock must be held by the caller.
+        """
+        try:
+            email = self.emails.pop(iuid)
+        except KeyError:
+            return False
+        account, cached = self.accounts.pop(email)
+        if account.get("api_key"):
+            self.api_keys.pop(account["api_key"], None)
+        return True
+
+    def get_digest(self, credentials):
+        "Return the keyed digest of the credentials."
+        return hmac.new(
+            self.digest_key, credentials.encode("utf-8"), hashlib.sha256
+        ).hexdigest()
+
+    def get_stats(self):
+        "Return a dictionary of the current counters for the cache."
+        with self.lock:
+            return dict(
+                ttl=self.ttl,
+                accounts=len(self.accounts),
+                hits=self.hits,
+                misses=self.misses,
+                invalidations=self.invalidations,
+                hashed=len(self.hashed),
+            )
+
+
 def get_publication(db, identifier):
     """Get the publication given its IUID, DOI or PMID.
     Raise KeyError if not found.
@@ -134,6 +425,358 @@ def get_publication(db, identifier):
     return doc
 
 
+_orcid_cache = None
+
+
+def create_orcid_cache():
+    """Create the process-wide cache of researcher ORCIDs, and keep it
+    up to date from the changes feed.
+    """
+    global _orcid_cache
+    _orcid_cache = utils.LruCache(settings["ORCID_CACHE_SIZE"])
+    publications.changes.add_listener(_update_orcid_cache)
+    return _orcid_cache
+
+
+def _update_orcid_cache(doc):
+    "Remove the cached ORCID for a changed or deleted researcher."
+    if doc.get("_deleted") or doc.get(constants.DOCTYPE) == constants.RESEARCHER:
+        _orcid_cache.pop(doc["_id"])
+
+
+def get_orcids(db, iuids):
+    """Return a dictionary with the given researcher IUIDs as keys and
+    their ORCIDs as values; None if the researcher has no ORCID or does
+    not exist. Use the process-wide cache, if any, and fetch the others
+    in bulk.
+    """
+    result = {}
+    missing = []
+    for iuid in iuids:
+        try:
+            if _orcid_cache is None:
+                raise KeyError
+            result[iuid] = _orcid_cache.get(iuid)
+        except KeyError:
+            missing.append(iuid)
+    for doc in get_bulk(db, missing):
+        if doc.get(constants.DOCTYPE) == constants.RESEARCHER:
+            result[doc["_id"]] = doc.get("orcid")
+    for iuid in missing:
+        result.setdefault(iuid, None)
+        if _orcid_cache is not None:
+            _orcid_cache.put(iuid, result[iuid])
+    return result
+
+
+_year_counts_cache = None
+
+
+def create_year_counts_cache(db):
+    """Create the process-wide cache of the publication counts per year,
+    and keep it up to date from the changes feed.
+    """
+    global _year_counts_cache
+    _year_counts_cache = YearCountsCache(settings["YEAR_COUNTS_CACHE_TTL"])
+    _year_counts_cache.refresh(db)
+    publications.changes.add_listener(_year_counts_cache.update)
+    return _year_counts_cache
+
+
+def get_year_counts(db):
+    """Return a list of tuples (year, count) for all years, latest first.
+    Use the process-wide cache, if any.
+    """
+    if _year_counts_cache is not None:
+        return _year_counts_cache.get()
+    return [
+        (r.key, r.value)
+        for r in db.view(
+            "publication", "year", descending=True, reduce=True, group_level=1
+        )
+    ]
+
+
+def get_year_counts_cache_stats():
+    "Return the statistics for the year counts cache, or None if not in use."
+    if _year_counts_cache is None:
+        return None
+    return _year_counts_cache.get_stats()
+
+
+class YearCountsCache:
+    """Thread-safe publication counts per year of the published date.
+    Kept up to date from the changes feed, using the year of each
+    publication, and refreshed from the database in the background
+    when the time to live (seconds) has expired.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.years = {}  # Key: publication IUID, value: year.
+        self.counts = []
+        self.refreshed = time.monotonic()
+        self.refreshing = False
+        self.pending = None  # Updates during a refresh; key: IUID, value: year.
+        self.refreshes = 0
+        self.updates = 0
+
+    def get(self):
+        "Return the list of tuples (year, count). Start a refresh if expired."
+        with self.lock:
+            if not self.refreshing and time.monotonic() - self.refreshed >= self.ttl:
+                self.refreshing = True
+                threading.Thread(
+                    target=self.refresh_background, name="year-counts", daemon=True
+                ).start()
+            return self.counts
+
+    def refresh(self, db):
+        """Get the year of each publication from the database.
+        The updates received while the view is being read are applied
+        afterwards, since the view may not include them.
+        """
+        with self.lock:
+            self.pending = {}
+        try:
+            view = db.view("publication", "year", reduce=False)
+            years = dict([(r.id, r.key) for r in view])
+        except Exception:
+            with self.lock:
+                self.pending = None
+            raise
+        with self.lock:
+            for iuid, year in self.pending.items():
+                if year is None:
+                    years.pop(iuid, None)
+                else:
+                    years[iuid] = year
+            self.pending = None
+            self.years = years
+            self.counts = self.get_counts()
+            self.refreshed = time.monotonic()
+            self.refreshing = False
+            self.refreshes += 1
+
+    def refresh_background(self):
+        "Refresh using a database handle from the pool; log any failure."
+        try:
+            db = get_db()
+            try:
+                self.refresh(db)
+            finally:
+                release_db(db)
+        except (IOError, couchdb2.ServerError) as error:
+            logging.getLogger("publications").warning(f"Year counts: {error}")
+            with self.lock:
+                self.refreshed = time.monotonic()  # Try again after TTL.
+                self.refreshing = False
+
+    def update(self, doc):
+        "Update the counts if the year of a publication changed or it was deleted."
+        if doc.get("_deleted"):
+            year = None
+        elif doc.get(constants.DOCTYPE) == constants.PUBLICATION:
+            year = doc["published"].split("-")[0] if doc.get("published") else None
+        else:
+            return
+        with self.lock:
+            if self.pending is not None:
+                self.pending[doc["_id"]] = year
+            if self.years.get(doc["_id"]) == year:
+                return
+            if year is None:
+                self.years.pop(doc["_id"], None)
+            else:
+                self.years[doc["_id"]] = year
+            self.counts = self.get_counts()
+            self.updates += 1
+
+    def get_counts(self):
+        "Compute the list of tuples (year, count) from the years."
+        counts = {}
+        for year in self.years.values():
+            counts[year] = counts.get(year, 0) + 1
+        return sorted(counts.items(), reverse=True)
+
+    def get_stats(self):
+        "Return a dictionary of the current counters for the cache."
+        with self.lock:
+            return dict(
+                ttl=self.ttl,
+                publications=len(self.years),
+                years=len(self.counts),
+                age=round(time.monotonic() - self.refreshed, 1),
+                refreshes=self.refreshes,
+                updates=self.updates,
+            )
+
+
+_journal_registry = None
+_journal_registry_lock = threading.Lock()
+
+
+def get_journal_registry(db):
+    """Return the process-wide journal registry. Create and load it,
+    if not already done, and keep it up to date from the changes feed.
+    """
+    global _journal_registry
+    with _journal_registry_lock:
+        if _journal_registry is None:
+            _journal_registry = JournalRegistry()
+            _journal_registry.load(db)
+            publications.changes.add_listener(_journal_registry.update)
+        return _journal_registry
+
+
+def get_journal_registry_stats():
+    "Return the statistics for the journal registry, or None if not in use."
+    if _journal_registry is None:
+        return None
+    return _journal_registry.get_stats()
+
+
+class JournalRegistry:
+    """Thread-safe in-memory lookup of journals by ISSN, ISSN-L and title.
+    Each journal is represented by a dictionary with the items '_id',
+    'title', 'issn' and 'issn-l'.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.journals = {}  # Key: journal IUID, value: journal dictionary.
+        self.issns = {}  # Key: ISSN, value: set of journal IUIDs.
+        self.issn_ls = {}  # Key: ISSN-L, value: set of journal IUIDs.
+        self.titles = {}  # Key: title, value: set of journal IUIDs.
+        self.updates = 0
+
+    def load(self, db):
+        "Load all journals from the views in the database."
+        journals = {}
+        for row in db.view("journal", "issn"):
+            journals[row.id] = {
+                "_id": row.id,
+                "title": row.value,
+                "issn": row.key,
+                "issn-l": None,
+            }
+        for row in db.view("journal", "issn_l"):
+            try:
+                journals[row.id]["issn-l"] = row.key
+            except KeyError:
+                pass
+        with self.lock:
+            self.journals = {}
+            self.issns = {}
+            self.issn_ls = {}
+            self.titles = {}
+            for journal in journals.values():
+                self.add(journal)
+
+    def update(self, doc):
+        "Update the registry for a changed or deleted journal."
+        if doc.get("_deleted"):
+            journal = None
+        elif doc.get(constants.DOCTYPE) == constants.JOURNAL:
+            journal = {
+                "_id": doc["_id"],
+                "title": doc.get("title"),
+                "issn": doc.get("issn"),
+                "issn-l": doc.get("issn-l") or None,
+            }
+        else:
+            return
+        with self.lock:
+            if self.journals.get(doc["_id"]) == journal:
+                return
+            self.remove(doc["_id"])
+            if journal:
+                self.add(journal)
+            self.updates += 1
+
+    def add(self, journal):
+        "Add the journal. The lock must be held by the caller."
+        self.journals[journal["_id"]] = journal
+        for index, key in [
+            (self.issns, journal["issn"]),
+            (self.issn_ls, journal["issn-l"]),
+            (self.titles, journal["title"]),
+        ]:
+            if key:
+                index.setdefault(key, set()).add(journal["_id"])
+
+    def remove(self, iuid):
+        "Remove the journal, if present. The lock must be held by the caller."
+        try:
+            journal = self.journals.pop(iuid)
+        except KeyError:
+            return
+        for index, key in [
+            (self.issns, journal["issn"]),
+            (self.issn_ls, journal["issn-l"]),
+            (self.titles, journal["title"]),
+        ]:
+            iuids = index.get(key)
+            if iuids:
+                iuids.discard(iuid)
+                if not iuids:
+                    del index[key]
+
+    def get_issn_l(self, issn):
+        "Get the ISSN-L for the ISSN. Return None if none found."
+        with self.lock:
+            for iuid in self.issns.get(issn, []):
+                issn_l = self.journals[iuid]["issn-l"]
+                if issn_l:
+                    return issn_l
+        return None
+
+    def get_issns(self, issn_l):
+        "Get the sorted list of ISSNs of the journals having the ISSN-L."
+        with self.lock:
+            return sorted(
+                [self.journals[iuid]["issn"] for iuid in self.issn_ls.get(issn_l, [])]
+            )
+
+    def get_by_issn(self, issn):
+        """Get the journal having the ISSN.
+        Raise KeyError if there is not exactly one such journal.
+        """
+        return self.get_journal(self.issns, issn)
+
+    def get_by_issn_l(self, issn_l):
+        """Get the journal having the ISSN-L.
+        Raise KeyError if there is not exactly one such journal.
+        """
+        return self.get_journal(self.issn_ls, issn_l)
+
+    def get_by_title(self, title):
+        """Get the journal having the title.
+        Raise KeyError if there is not exactly one such journal.
+        """
+        return self.get_journal(self.titles, title)
+
+    def get_journal(self, index, key):
+        "Get a copy of the single journal for the key in the given index."
+        with self.lock:
+            iuids = index.get(key, set())
+            if len(iuids) != 1:
+                raise KeyError(f"{len(iuids)} items found")
+            return self.journals[list(iuids)[0]].copy()
+
+    def get_stats(self):
+        "Return a dictionary of the current counters for the registry."
+        with self.lock:
+            return dict(
+                journals=len(self.journals),
+                issns=len(self.issns),
+                issn_ls=len(self.issn_ls),
+                titles=len(self.titles),
+                updates=self.updates,
+            )
+
+
 def get_researcher(db, identifier):
     """Get the researcher entity given its IUID or ORCID.
     Raise KeyError if not found.
@@ -247,6 +890,24 @@ BLACKLIST_DESIGN_DOC = {
 }
 
 
+JOB_DESIGN_DOC = {
+    "views": {
+        "owner": {
+            "map": """function (doc) {
+  if (doc.publications_doctype !== 'job') return;
+  emit([doc.owner, doc.created], doc.status);
+}"""
+        },
+        "status": {
+            "map": """function (doc) {
+  if (doc.publications_doctype !== 'job') return;
+  emit(doc.status, doc.created);
+}"""
+        },
+    }
+}
+
+
 JOURNAL_DESIGN_DOC = {
     "views": {
         "issn": {
@@ -329,6 +990,7 @@ PUBLICATION_IGNORE = ",".join(["'%s':1" % i for i in constants.SEARCH_IGNORE])
 PUBLICATION_DESIGN_DOC = {
     "views": {
         "author": {
+            "reduce": "_count",
             "map": """function (doc) {
   if (doc.publications_doctype !== 'publication') return;
   var au, name;
@@ -346,7 +1008,7 @@ PUBLICATION_DESIGN_DOC = {
       emit(name, null);
     }
   }
-}"""
+}""",
         },
         "researcher": {
             "reduce": "_count",
@@ -428,12 +1090,13 @@ function (doc) {
             % (PUBLICATION_REMOVE, PUBLICATION_IGNORE)
         },
         "issn": {
+            "reduce": "_count",
             "map": """function (doc) {
   if (doc.publications_doctype !== 'publication') return;
   if (!doc.journal) return;
   if (doc.journal.issn) emit(doc.journal.issn, null);
   if (doc.journal['issn-l']) emit(doc.journal['issn-l'], null);
-}"""
+}""",
         },
         "journal": {
             "reduce": "_count",
@@ -491,11 +1154,12 @@ function (doc) {
             % (PUBLICATION_REMOVE, PUBLICATION_IGNORE)
         },
         "published": {
+            "reduce": "_count",
             "map": """function (doc) {
   if (doc.publications_doctype !== 'publication') return;
   if (!doc.published) return;
   emit(doc.published, null);
-}"""
+}""",
         },
         "title": {
             "map": """var REMOVE = /[%s]/g;
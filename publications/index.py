@@ -0,0 +1,298 @@
+"""In-memory index of publications, for fast subset selection.
+
+Each publication is given a dense integer ordinal. A set of publications
+is a bitmap, stored as a Python integer having bit n set for ordinal n.
+Set operations on subsets are then integer bit operations.
+"""
+
+import bisect
+import logging
+import threading
+
+from publications import constants
+
+import publications.changes
+import publications.database
+
+FIELDS = ("year", "label", "author", "issn", "researcher")
+
+_index = None
+
+
+def create_index(db):
+    """Create and load the process-wide index, and keep it up to date
+    from the changes feed.
+    """
+    global _index
+    index = Index()
+    index.load(db)
+    publications.changes.add_listener(index.update)
+    _index = index
+    logging.getLogger("publications").info(
+        f"Subset index loaded; {len(index.ordinals)} publications."
+    )
+    return _index
+
+
+def get_index():
+    "Return the process-wide index, or None if not in use."
+    return _index
+
+
+def to_bits(ordinals):
+    "Return the bitmap for the given iterable of ordinals."
+    ordinals = list(ordinals)
+    if not ordinals:
+        return 0
+    buffer = bytearray(max(ordinals) // 8 + 1)
+    for ordinal in ordinals:
+        buffer[ordinal >> 3] |= 1 << (ordinal & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def to_ordinals(bits):
+    "Return a generator of the ordinals set in the bitmap."
+    buffer = bits.to_bytes((bits.bit_length() + 7) // 8, "little")
+    for position, byte in enumerate(buffer):
+        if not byte:
+            continue
+        base = position << 3
+        for bit in range(8):
+            if byte & (1 << bit):
+                yield base + bit
+
+
+def count(bits):
+    "Return the number of bits set in the bitmap."
+    return bin(bits).count("1")
+
+
+class Index:
+    """Postings of publications by year, label, author, ISSN, researcher
+    and published date. The keys are the same as those emitted by the
+    corresponding CouchDB views of the 'publication' design document.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.ordinals = {}  # Key: IUID, value: ordinal.
+        self.iuids = []  # Position: ordinal, value: IUID, or None if deleted.
+        self.all = 0
+        self.postings = dict([(field, {}) for field in FIELDS])
+        self.keys = {}  # Key: ordinal, value: dict of field to keys.
+        self.published = {}  # Key: ordinal, value: published date.
+        self._sorted_keys = {}  # Key: field, value: sorted list of keys.
+        self._sorted_published = None  # Sorted list of (published, ordinal).
+
+    def load(self, db):
+        "Load all publications from the database."
+        lists = dict([(field, {}) for field in FIELDS])
+        with self.lock:
+            for doc in publications.database.get_docs(db, "publication", "modified"):
+                ordinal = self._get_ordinal(doc["_id"])
+                keys = self._get_keys(doc)
+                self.keys[ordinal] = keys
+                for field in FIELDS:
+                    for key in keys[field]:
+                        lists[field].setdefault(key, []).append(ordinal)
+                if doc.get("published"):
+                    self.published[ordinal] = doc["published"]
+            for field in FIELDS:
+                self.postings[field] = dict(
+                    [(key, to_bits(o)) for key, o in lists[field].items()]
+                )
+            self.all = to_bits(self.ordinals.values())
+            self._sorted_keys = {}
+            self._sorted_published = None
+
+    def update(self, doc):
+        "Update the index for the changed or deleted document."
+        if doc.get(constants.DOCTYPE) != constants.PUBLICATION:
+            if not doc.get("_deleted"):
+                return
+        with self.lock:
+            ordinal = self.ordinals.get(doc["_id"])
+            if ordinal is not None:
+                self._remove(ordinal)
+            if doc.get("_deleted"):
+                if ordinal is not None:
+                    self.iuids[ordinal] = None
+                    self.ordinals.pop(doc["_id"])
+                return
+            if ordinal is None:
+                ordinal = self._get_ordinal(doc["_id"])
+            self._add(ordinal, doc)
+
+    def get(self, field, key):
+        "Return the bitmap for the key in the field."
+        with self.lock:
+            return self.postings[field].get(key, 0)
+
+    def get_prefix(self, field, prefix):
+        "Return the bitmap for all keys beginning with the prefix in the field."
+        with self.lock:
+            keys = self._get_sorted_keys(field)
+            result = 0
+            postings = self.postings[field]
+            for pos in range(bisect.bisect_left(keys, prefix), len(keys)):
+                if not keys[pos].startswith(prefix):
+                    break
+                result |= postings.get(keys[pos], 0)
+            return result
+
+    def get_count(self, field, key):
+        "Return the number of publications for the key in the field."
+        with self.lock:
+            return count(self.postings[field].get(key, 0))
+
+    def get_prefix_count(self, field, prefix):
+        """Return the sum of the number of publications for all keys beginning
+        with the prefix in the field. This is an upper bound, not an exact
+        count, since a publication may have several such keys.
+        """
+        with self.lock:
+            keys = self._get_sorted_keys(field)
+            postings = self.postings[field]
+            result = 0
+            for pos in range(bisect.bisect_left(keys, prefix), len(keys)):
+                if not keys[pos].startswith(prefix):
+                    break
+                result += count(postings.get(keys[pos], 0))
+            return result
+
+    def get_all(self):
+        "Return the bitmap for all publications."
+        with self.lock:
+            return self.all
+
+    def get_published(self, date, last=None):
+        """Return the bitmap for publications 'published' on or after the date,
+        and on or before the last date, if given.
+        """
+        with self.lock:
+            items = self._get_sorted_published()
+            pos = bisect.bisect_left(items, (date, -1))
+            if last is None:
+                end = len(items)
+            else:
+                end = bisect.bisect_right(items, (last, len(self.iuids)))
+            return to_bits([o for p, o in items[pos:end]])
+
+    def get_published_count(self, date, last=None):
+        """Return the number of publications 'published' on or after the date,
+        and on or before the last date, if given.
+        """
+        with self.lock:
+            items = self._get_sorted_published()
+            pos = bisect.bisect_left(items, (date, -1))
+            if last is None:
+                end = len(items)
+            else:
+                end = bisect.bisect_right(items, (last, len(self.iuids)))
+            return max(0, end - pos)
+
+    def get_published_dates(self, iuids):
+        """Return a dictionary of the 'published' date for the IUIDs.
+        Raise KeyError if any IUID is not in the index.
+        """
+        with self.lock:
+            return dict(
+                [(iuid, self.published.get(self.ordinals[iuid])) for iuid in iuids]
+            )
+
+    def get_bits(self, iuids):
+        """Return the bitmap for the IUIDs.
+        Raise KeyError if any IUID is not in the index.
+        """
+        with self.lock:
+            return to_bits([self.ordinals[iuid] for iuid in iuids])
+
+    def get_iuids(self, bits):
+        "Return the set of IUIDs for the bitmap."
+        with self.lock:
+            iuids = self.iuids
+            result = set([iuids[o] for o in to_ordinals(bits) if o < len(iuids)])
+        result.discard(None)
+        return result
+
+    def _get_ordinal(self, iuid):
+        "Get the ordinal for the IUID; allocate a new one if not already done."
+        try:
+            return self.ordinals[iuid]
+        except KeyError:
+            ordinal = len(self.iuids)
+            self.ordinals[iuid] = ordinal
+            self.iuids.append(iuid)
+            return ordinal
+
+    def _get_keys(self, doc):
+        "Get the keys for each field of the publication document."
+        result = dict([(field, set()) for field in FIELDS])
+        published = doc.get("published")
+        if published:
+            result["year"].add(published.split("-")[0])
+        for label in doc.get("labels") or {}:
+            result["label"].add(label.lower())
+        for author in doc.get("authors") or []:
+            if author.get("researcher"):
+                result["researcher"].add(author["researcher"])
+            family = author.get("family_normalized")
+            if not family:
+                continue
+            result["author"].add(family)
+            if author.get("initials_normalized"):
+                result["author"].add(f"{family} {author['initials_normalized']}")
+            if author.get("given_normalized"):
+                result["author"].add(f"{family} {author['given_normalized']}")
+        journal = doc.get("journal") or {}
+        if journal.get("issn"):
+            result["issn"].add(journal["issn"])
+        if journal.get("issn-l"):
+            result["issn"].add(journal["issn-l"])
+        return result
+
+    def _add(self, ordinal, doc):
+        "Add the postings for the publication document."
+        bit = 1 << ordinal
+        keys = self._get_keys(doc)
+        self.keys[ordinal] = keys
+        for field in FIELDS:
+            postings = self.postings[field]
+            for key in keys[field]:
+                if key not in postings:
+                    self._sorted_keys.pop(field, None)
+                postings[key] = postings.get(key, 0) | bit
+        if doc.get("published"):
+            self.published[ordinal] = doc["published"]
+        self._sorted_published = None
+        self.all |= bit
+
+    def _remove(self, ordinal):
+        "Remove the postings for the publication having the ordinal."
+        mask = ~(1 << ordinal)
+        for field, keys in self.keys.pop(ordinal, {}).items():
+            postings = self.postings[field]
+            for key in keys:
+                bits = postings.get(key, 0) & mask
+                if bits:
+                    postings[key] = bits
+                else:
+                    postings.pop(key, None)
+                    self._sorted_keys.pop(field, None)
+        self.published.pop(ordinal, None)
+        self._sorted_published = None
+        self.all &= mask
+
+    def _get_sorted_keys(self, field):
+        "Get the sorted list of keys for the field."
+        try:
+            return self._sorted_keys[field]
+        except KeyError:
+            self._sorted_keys[field] = sorted(self.postings[field])
+            return self._sorted_keys[field]
+
+    def _get_sorted_published(self):
+        "Get the sorted list of (published, ordinal)."
+        if self._sorted_published is None:
+            self._sorted_published = sorted([(p, o) for o, p in self.published.items()])
+        return self._sorted_published
@@ -0,0 +1,347 @@
+"""Background jobs for fetching publications in bulk.
+
+A job is stored as a CouchDB document, and is processed by a pool
+of worker threads using the ordinary fetch procedure. The progress
+is saved in the job document, so that an interrupted job is resumed
+when the server is restarted.
+
+A running job is claimed by the process working on it, for a lease time
+which is renewed whenever the progress is saved. Another process may
+take over the job only when the lease has expired.
+"""
+
+import logging
+import queue
+import threading
+import time
+import xml.etree.ElementTree
+
+import couchdb2
+import tornado.web
+
+from publications import constants
+from publications import settings
+from publications import utils
+from publications.requesthandler import RequestHandler
+
+import publications.crossref
+import publications.database
+import publications.publication
+import publications.pubmed
+import publications.saver
+
+CHUNK_SIZE = 20  # Number of identifiers processed between saves of progress.
+LEASE_TIME = 300.0  # Seconds a running job remains claimed after a save.
+
+# Per-identifier result statuses.
+FETCHED = "fetched"
+BLACKLISTED = "blacklisted"
+ERROR = "error"
+
+_queue = queue.Queue()
+_workers = []
+_process_id = utils.get_iuid()  # Identifies the jobs claimed by this process.
+
+
+def create_job(
+    db,
+    identifiers,
+    account,
+    override=False,
+    labels=None,
+    allowed_labels=None,
+    clean=True,
+):
+    """Create a job for fetching the publications given by the identifiers
+    (PMIDs or DOIs), and put it on the queue. Return the job document.
+    The arguments are as for 'fetch_publication'.
+    """
+    doc = {
+        constants.DOCTYPE: constants.JOB,
+        "_id": utils.get_iuid(),
+        "owner": account["email"],
+        "status": constants.PENDING,
+        "identifiers": list(identifiers),
+        "override": bool(override),
+        "labels": labels or {},
+        "allowed_labels": sorted(allowed_labels or []),
+        "clean": bool(clean),
+        "results": [],
+        "started": None,
+        "finished": None,
+        "created": utils.timestamp(),
+    }
+    doc["modified"] = doc["created"]
+    db.put(doc)
+    _queue.put(doc["_id"])
+    return doc
+
+
+def start_workers(db):
+    """Start the worker threads, and put all jobs that are pending
+    or running on the queue. A job that is running in another process
+    is skipped by the workers as long as that process holds its lease.
+    Do nothing if already started.
+    """
+    if _workers:
+        return
+    for number in range(settings["JOB_WORKERS"]):
+        worker = Worker(number + 1)
+        worker.start()
+        _workers.append(worker)
+    for status in [constants.RUNNING, constants.PENDING]:
+        for iuid in publications.database.get_iuids(db, "job", "status", key=status):
+            _queue.put(iuid)
+
+
+class Worker(threading.Thread):
+    "Thread processing the jobs on the queue."
+
+    def __init__(self, number):
+        super().__init__(name=f"job-{number}", daemon=True)
+
+    def run(self):
+        logger = logging.getLogger("publications")
+        while True:
+            iuid = _queue.get()
+            db = publications.database.get_db()
+            try:
+                process_job(db, iuid)
+            except Exception:
+                logger.exception(f"Job {iuid} failed.")
+            finally:
+                publications.database.release_db(db)
+                _queue.task_done()
+
+
+def process_job(db, iuid):
+    """Fetch the publications of the job, skipping the identifiers
+    already processed. The progress is saved after each chunk.
+    Return silently if the job has been claimed by another worker.
+    If the job is claimed by another process, check it again when
+    the lease has expired. If an unexpected error occurs, the job
+    is marked as failed.
+    """
+    try:
+        job = db[iuid]
+    except couchdb2.NotFoundError:
+        return
+    if job["status"] in (constants.FINISHED, constants.FAILED):
+        return
+    if job["status"] == constants.RUNNING and job.get("process") != _process_id:
+        remaining = job.get("lease", 0.0) - time.time()
+        if remaining > 0.0:
+            timer = threading.Timer(remaining, _queue.put, args=(iuid,))
+            timer.daemon = True
+            timer.start()
+            return
+    job["status"] = constants.RUNNING
+    job["process"] = _process_id
+    job["started"] = job["started"] or utils.timestamp()
+    if not save_job(db, job):
+        return
+    try:
+        if not process_chunks(db, job):
+            return
+    except Exception as error:
+        job["results"].extend(
+            [
+                dict(identifier=i, status=ERROR, message=str(error))
+                for i in get_remaining(job)
+            ]
+        )
+        job["status"] = constants.FAILED
+        raise
+    else:
+        job["status"] = constants.FINISHED
+    finally:
+        if job["status"] != constants.RUNNING:
+            job["finished"] = utils.timestamp()
+            save_job(db, job)
+
+
+def process_chunks(db, job):
+    """Fetch the publications of the job chunk by chunk, saving the progress
+    after each. Return False if the job has been claimed by another worker.
+    """
+    try:
+        account = publications.database.get_account(db, job["owner"])
+    except KeyError as error:
+        job["results"].extend(
+            [
+                dict(identifier=i, status=ERROR, message=str(error))
+                for i in get_remaining(job)
+            ]
+        )
+        return True
+    while True:
+        chunk = get_remaining(job)[:CHUNK_SIZE]
+        if not chunk:
+            return True
+        fetched = prefetch(chunk)
+        for identifier in chunk:
+            job["results"].append(fetch(db, job, identifier, account, fetched))
+        if not save_job(db, job):
+            return False
+
+
+def get_remaining(job):
+    "Return the list of identifiers not yet processed in the job."
+    done = set([r["identifier"] for r in job["results"]])
+    return [i for i in job["identifiers"] if i not in done]
+
+
+def prefetch(identifiers):
+    """Fetch in bulk the data for the identifiers; PMIDs from PubMed
+    and DOIs from Crossref. Return a dictionary with PMID or DOI as key.
+    Any identifier not obtained, for instance due to an error or a response
+    that could not be parsed, is fetched one by one later.
+    """
+    result = {}
+    try:
+        fetched, missing = publications.pubmed.fetch_many(
+            [i for i in identifiers if constants.PMID_RX.match(i)],
+            timeout=settings["PUBMED_TIMEOUT"],
+            delay=settings["PUBMED_DELAY"],
+            api_key=settings["NCBI_API_KEY"],
+        )
+    except (IOError, ValueError, xml.etree.ElementTree.ParseError):
+        pass
+    else:
+        result.update(fetched)
+    try:
+        fetched, missing = publications.crossref.fetch_many(
+            [i for i in identifiers if not constants.PMID_RX.match(i)],
+            timeout=settings["CROSSREF_TIMEOUT"],
+            delay=settings["CROSSREF_DELAY"],
+        )
+    except (IOError, ValueError):
+        pass
+    else:
+        result.update(fetched)
+    return result
+
+
+def fetch(db, job, identifier, account, fetched):
+    "Fetch the publication for the identifier. Return the result item."
+    result = dict(identifier=identifier)
+    try:
+        publ = publications.publication.fetch_publication(
+            db,
+            identifier,
+            override=job["override"],
+            labels=job["labels"],
+            allowed_labels=set(job["allowed_labels"]),
+            clean=job["clean"],
+            account=account,
+            fetched=fetched,
+        )
+    except (IOError, ValueError, xml.etree.ElementTree.ParseError) as error:
+        result["status"] = ERROR
+        result["message"] = str(error)
+    except KeyError as error:
+        result["status"] = BLACKLISTED
+        result["message"] = str(error)
+    except publications.saver.SaverError:
+        result["status"] = ERROR
+        result["message"] = f"{identifier} could not be saved; revision mismatch."
+    else:
+        result["status"] = FETCHED
+        result["iuid"] = publ["_id"]
+    return result
+
+
+def save_job(db, job):
+    """Save the job document. Return False if it has been modified
+    by another worker in the meantime, else True.
+    Renew the lease if the job is running.
+    """
+    job["modified"] = utils.timestamp()
+    if job["status"] == constants.RUNNING:
+        job["lease"] = time.time() + LEASE_TIME
+    try:
+        db.put(job)
+    except couchdb2.RevisionError:
+        return False
+    return True
+
+
+class JobMixin:
+    "Mixin for getting a job document."
+
+    def get_job(self, iuid):
+        """Get the job document, checking that the current user owns it.
+        Raise KeyError if no such job.
+        """
+        try:
+            job = self.db[iuid]
+        except couchdb2.NotFoundError:
+            raise KeyError(f"no such job '{iuid}'")
+        if job.get(constants.DOCTYPE) != constants.JOB:
+            raise KeyError(f"no such job '{iuid}'")
+        self.check_owner(job)
+        return job
+
+    def get_job_json(self, job):
+        "JSON representation of the job."
+        URL = self.absolute_reverse_url
+        results = []
+        for item in job["results"]:
+            item = item.copy()
+            if item.get("iuid"):
+                item["href"] = URL("publication_json", item["iuid"])
+            results.append(item)
+        return dict(
+            entity="job",
+            iuid=job["_id"],
+            timestamp=utils.timestamp(),
+            links=dict(
+                [
+                    ("self", {"href": URL("job_json", job["_id"])}),
+                    ("display", {"href": URL("job", job["_id"])}),
+                ]
+            ),
+            status=job["status"],
+            owner=job["owner"],
+            total=len(job["identifiers"]),
+            processed=len(job["results"]),
+            fetched=len([r for r in job["results"] if r["status"] == FETCHED]),
+            blacklisted=[
+                r["identifier"] for r in job["results"] if r["status"] == BLACKLISTED
+            ],
+            errors=[r["message"] for r in job["results"] if r["status"] == ERROR],
+            results=results,
+            created=job["created"],
+            started=job["started"],
+            finished=job["finished"],
+            modified=job["modified"],
+        )
+
+
+class Job(JobMixin, RequestHandler):
+    "Display the progress and results of a job."
+
+    @tornado.web.authenticated
+    def get(self, iuid):
+        try:
+            job = self.get_job(iuid)
+        except KeyError as error:
+            self.see_other("home", error=str(error))
+            return
+        self.render(
+            "job.html",
+            job=job,
+            fetched=len([r for r in job["results"] if r["status"] == FETCHED]),
+        )
+
+
+class JobJson(JobMixin, RequestHandler):
+    "Job progress and results JSON data."
+
+    @tornado.web.authenticated
+    def get(self, iuid):
+        try:
+            job = self.get_job(iuid)
+        except KeyError as error:
+            raise tornado.web.HTTPError(404, reason=str(error))
+        self.write(self.get_job_json(job))
@@ -91,7 +91,7 @@ class Journal(JournalMixin, RequestHandler):
                     publications[row.id] += 1
                 except KeyError:
                     publications[row.id] = 1
-        publications = [self.db[i] for i in publications]
+        publications = self.get_bulk(publications)
         publications.sort(key=lambda p: p["published"], reverse=True)
         self.render(
             "journal/display.html",
@@ -141,9 +141,7 @@ class JournalJson(CorsMixin, Journal):
         result["issn"] = journal.get("issn")
         result["issn-l"] = journal.get("issn-l")
         result["publications_count"] = len(publications)
-        result["publications"] = [
-            self.get_publication_json(publication) for publication in publications
-        ]
+        result["publications"] = self.get_publications_json(publications)
         result["created"] = journal["created"]
         result["modified"] = journal["modified"]
         self.write(result)
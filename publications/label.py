@@ -46,19 +46,17 @@ class LabelSaver(publications.saver.Saver):
 class Label(RequestHandler):
     "Label page, containing list of publications partitioned by year."
 
-    def get(self, identifier):
+    async def get(self, identifier):
         try:
             label = self.get_label(identifier)
         except KeyError as error:
             self.see_other("home", error=str(error))
             return
-        self.render(
+        await self.render(
             "label/display.html",
             label=label,
             accounts=self.get_docs("account", "label", key=label["value"].lower()),
-            publications=list(
-                publications.subset.Subset(self.db, label=label["value"])
-            ),
+            publications=publications.subset.Subset(self.db, label=label["value"]),
             escaped_label=tornado.escape.url_escape(label['value']),
         )
 
@@ -80,15 +78,22 @@ class Label(RequestHandler):
             self.see_other("labels", error=str(error))
             return
         value = label["value"]
+
+        def remove_label(saver):
+            labels = saver["labels"].copy()
+            labels.pop(value, None)
+            labels.pop(value.lower(), None)
+            saver["labels"] = labels
+
         # Do it in this order; safer if interrupted.
-        for publication in publications.subset.Subset(self.db, label=label["value"]):
-            with publications.publication.PublicationSaver(
-                publication, rqh=self
-            ) as saver:
-                labels = publication["labels"].copy()
-                labels.pop(value, None)
-                labels.pop(value.lower(), None)
-                saver["labels"] = labels
+        bulk = publications.saver.BulkSaver(
+            publications.publication.PublicationSaver, rqh=self
+        )
+        bulk.save(publications.subset.Subset(self.db, label=value), remove_label)
+        if bulk.failed:
+            self.set_error_flash(bulk.get_failed_message())
+            self.see_other("label", value)
+            return
         for account in self.get_docs("account", "label", key=value.lower()):
             with publications.account.AccountSaver(account, rqh=self) as saver:
                 labels = set(account["labels"])
@@ -101,14 +106,11 @@ class Label(RequestHandler):
 class LabelJson(CorsMixin, Label):
     "Label JSON output."
 
-    def render(self, template, **kwargs):
-        self.write(
-            self.get_label_json(
-                kwargs["label"],
-                publications=kwargs["publications"],
-                accounts=kwargs["accounts"],
-            )
-        )
+    async def render(self, template, **kwargs):
+        publications = kwargs["publications"]
+        result = self.get_label_json(kwargs["label"], accounts=kwargs["accounts"])
+        result["publications_count"] = len(publications)
+        await self.write_publications_json(result, publications)
 
 
 class LabelsList(RequestHandler):
@@ -244,14 +246,21 @@ class LabelEdit(RequestHandler):
                     labels.discard(old_value.lower())
                     labels.add(new_value)
                     saver["labels"] = sorted(labels)
-            for publication in publications.subset.Subset(self.db, label=old_value):
-                if old_value in publication["labels"]:
-                    with publications.publication.PublicationSaver(
-                        publication, rqh=self
-                    ) as saver:
-                        labels = publication["labels"].copy()
-                        labels[new_value] = labels.pop(old_value)
-                        saver["labels"] = labels
+
+            def rename_label(saver):
+                if old_value in saver["labels"]:
+                    labels = saver["labels"].copy()
+                    labels[new_value] = labels.pop(old_value)
+                    saver["labels"] = labels
+
+            bulk = publications.saver.BulkSaver(
+                publications.publication.PublicationSaver, rqh=self
+            )
+            bulk.save(
+                publications.subset.Subset(self.db, label=old_value), rename_label
+            )
+            if bulk.failed:
+                self.set_error_flash(bulk.get_failed_message())
         self.see_other("label", label["value"])
 
 
@@ -298,16 +307,19 @@ class LabelMerge(RequestHandler):
                 labels.discard(old_label.lower())
                 labels.add(new_label)
                 saver["labels"] = sorted(labels)
-        for publication in publications.subset.Subset(self.db, label=old_label):
-            with publications.publication.PublicationSaver(
-                publication, rqh=self
-            ) as saver:
-                labels = publication["labels"].copy()
-                qual = labels.pop(old_label, None) or labels.pop(
-                    old_label.lower(), None
-                )
-                labels[new_label] = labels.get(new_label) or qual
-                saver["labels"] = labels
+
+        def merge_label(saver):
+            labels = saver["labels"].copy()
+            qual = labels.pop(old_label, None) or labels.pop(old_label.lower(), None)
+            labels[new_label] = labels.get(new_label) or qual
+            saver["labels"] = labels
+
+        bulk = publications.saver.BulkSaver(
+            publications.publication.PublicationSaver, rqh=self
+        )
+        bulk.save(publications.subset.Subset(self.db, label=old_label), merge_label)
+        if bulk.failed:
+            self.set_error_flash(bulk.get_failed_message())
         self.see_other("label", new_label)
 
 
@@ -345,23 +357,27 @@ class LabelAdd(RequestHandler):
         qualifier = self.get_argument("qualifier", None)
         if qualifier not in settings["SITE_LABEL_QUALIFIERS"]:
             qualifier = None
-        count = 0
-        for iuid in iuids:
-            try:
-                publication = self.get_publication(iuid)
-                if label["value"] in publication["labels"]:
-                    raise KeyError
-            except KeyError:
-                pass
-            else:
-                with publications.publication.PublicationSaver(
-                    publication, rqh=self
-                ) as saver:
-                    labels = publication["labels"].copy()
-                    labels[label["value"]] = qualifier
-                    saver["labels"] = labels
-                count += 1
-        self.set_message_flash(f"Added label to {count} publications.")
+
+        def add_label(saver):
+            if label["value"] not in saver["labels"]:
+                labels = saver["labels"].copy()
+                labels[label["value"]] = qualifier
+                saver["labels"] = labels
+
+        bulk = publications.saver.BulkSaver(
+            publications.publication.PublicationSaver, rqh=self
+        )
+        saved = bulk.save(
+            [
+                p
+                for p in self.get_bulk([i.lower() for i in iuids])
+                if p.get(constants.DOCTYPE) == constants.PUBLICATION
+            ],
+            add_label,
+        )
+        self.set_message_flash(f"Added label to {len(saved)} publications.")
+        if bulk.failed:
+            self.set_error_flash(bulk.get_failed_message())
         self.see_other("label", label["value"])
 
 
@@ -396,21 +412,25 @@ class LabelRemove(RequestHandler):
         with io.StringIO(infile["body"].decode("utf-8")) as csvfile:
             reader = csv.DictReader(csvfile)
             iuids = [p["IUID"] for p in reader]
-        count = 0
-        for iuid in iuids:
-            try:
-                publication = self.get_publication(iuid)
-                if label["value"] not in publication["labels"]:
-                    raise KeyError
-            except KeyError:
-                pass
-            else:
-                with publications.publication.PublicationSaver(
-                    publication, rqh=self
-                ) as saver:
-                    labels = publication["labels"].copy()
-                    labels.pop(label["value"])
-                    saver["labels"] = labels
-                count += 1
-        self.set_message_flash(f"Removed label from {count} publications.")
+
+        def remove_label(saver):
+            if label["value"] in saver["labels"]:
+                labels = saver["labels"].copy()
+                labels.pop(label["value"])
+                saver["labels"] = labels
+
+        bulk = publications.saver.BulkSaver(
+            publications.publication.PublicationSaver, rqh=self
+        )
+        saved = bulk.save(
+            [
+                p
+                for p in self.get_bulk([i.lower() for i in iuids])
+                if p.get(constants.DOCTYPE) == constants.PUBLICATION
+            ],
+            remove_label,
+        )
+        self.set_message_flash(f"Removed label from {len(saved)} publications.")
+        if bulk.failed:
+            self.set_error_flash(bulk.get_failed_message())
         self.see_other("label", label["value"])
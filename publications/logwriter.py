@@ -0,0 +1,141 @@
+"""Asynchronous writer of the log entries for document changes.
+
+The log entries are queued, and written in batches using '_bulk_docs'
+by a background thread, when enough entries have accumulated, or when
+the time interval has passed. All queued entries are written when the
+writer is stopped, which is done at normal exit of the process.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+
+import couchdb2
+
+from publications import settings
+
+import publications.database
+
+_writer = None
+
+
+def start():
+    "Start the process-wide log writer. Do nothing if already started."
+    global _writer
+    if _writer is not None:
+        return
+    _writer = LogWriter(settings["LOG_BATCH_SIZE"], settings["LOG_BATCH_INTERVAL"])
+    _writer.start()
+    atexit.register(stop)
+
+
+def stop():
+    "Stop the log writer, after having written all queued log entries."
+    global _writer
+    if _writer is None:
+        return
+    writer = _writer
+    _writer = None  # Any log entries from now on are written directly.
+    writer.stop()
+
+
+def write(db, log):
+    """Write the log entry. If the log writer is running, it is queued
+    for writing in a batch, else it is written directly.
+    """
+    if _writer is None:
+        db.put(log)
+    else:
+        _writer.put(log)
+
+
+def get_stats():
+    "Return the statistics for the log writer, or None if not running."
+    if _writer is None:
+        return None
+    return _writer.get_stats()
+
+
+class LogWriter(threading.Thread):
+    """Thread writing queued log entries in batches of at most 'batch_size'
+    entries, at least every 'interval' seconds when there are any.
+    """
+
+    def __init__(self, batch_size, interval):
+        super().__init__(name="logwriter", daemon=True)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+
+    def put(self, log):
+        "Queue the log entry for writing."
+        self.queue.put(log)
+
+    def stop(self):
+        "Write all queued log entries, and then terminate the thread."
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        pending = []
+        stopping = False
+        while not stopping:
+            deadline = time.monotonic() + self.interval
+            while len(pending) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0.0:
+                    break
+                try:
+                    log = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if log is None:
+                    stopping = True
+                    break
+                pending.append(log)
+            while pending:
+                if not self.flush(pending[: self.batch_size]):
+                    if not stopping:
+                        time.sleep(self.interval)  # Database down; hold off.
+                    break
+                pending = pending[self.batch_size :]
+        if pending:
+            logging.getLogger("publications").error(
+                f"Log writer: {len(pending)} log entries could not be written."
+            )
+
+    def flush(self, logs):
+        "Write the log entries. Return False if the database failed."
+        try:
+            db = publications.database.get_db()
+            try:
+                db.update(logs)
+            finally:
+                publications.database.release_db(db)
+        except (IOError, couchdb2.ServerError) as error:
+            logging.getLogger("publications").warning(f"Log writer: {error}")
+            with self.lock:
+                self.errors += 1
+            return False
+        with self.lock:
+            self.written += len(logs)
+            self.batches += 1
+        return True
+
+    def get_stats(self):
+        "Return a dictionary of the current counters for the log writer."
+        with self.lock:
+            return dict(
+                batch_size=self.batch_size,
+                interval=self.interval,
+                queued=self.queue.qsize(),
+                written=self.written,
+                batches=self.batches,
+                errors=self.errors,
+            )
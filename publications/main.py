@@ -2,6 +2,8 @@
 
 import logging
 import os
+import signal
+import sys
 
 import tornado.web
 import tornado.ioloop
@@ -12,6 +14,10 @@ from publications import uimodules
 from publications import utils
 
 import publications.admin
+import publications.changes
+import publications.index
+import publications.job
+import publications.logwriter
 import publications.home
 import publications.account
 import publications.publication
@@ -19,6 +25,8 @@ import publications.blacklist
 import publications.journal
 import publications.label
 import publications.search
+import publications.ratelimit
+import publications.responsecache
 import publications.researcher
 import publications.subset
 
@@ -154,6 +162,8 @@ def get_handlers():
         ),
         url(r"/blacklist/([^/]+)", publications.blacklist.Blacklist, name="blacklist"),
         url(r"/blacklisted", publications.blacklist.Blacklisted, name="blacklisted"),
+        url(r"/job/([^/]{32,32})", publications.job.Job, name="job"),
+        url(r"/job/([^/]{32,32}).json", publications.job.JobJson, name="job_json"),
         url(
             r"/update/([^/]{32,32})/pmid",
             publications.publication.PublicationUpdatePmid,
@@ -304,9 +314,29 @@ def get_handlers():
 
 def main():
     publications.admin.load_settings_from_file()
+    publications.database.create_pool()
     db = publications.database.get_db()
     publications.database.update_design_documents(db)
     publications.admin.load_settings_from_database(db)
+    publications.ratelimit.configure()
+    publications.responsecache.create_cache()
+    since = db.get_info()["update_seq"]
+    if settings["SUBSET_INDEX"]:
+        publications.index.create_index(db)
+    publications.database.create_orcid_cache()
+    publications.database.get_journal_registry(db)
+    if settings["ACCOUNT_CACHE_TTL"]:
+        publications.database.create_account_cache()
+    if settings["YEAR_COUNTS_CACHE_TTL"]:
+        publications.database.create_year_counts_cache(db)
+    if settings["SEARCH_INDEX"]:
+        publications.search.create_search_index(db)
+    if settings["SUBSET_RESULT_CACHE_SIZE"]:
+        publications.subset.create_result_cache()
+    publications.changes.start(since)
+    publications.logwriter.start()
+    publications.job.start_workers(db)
+    publications.database.release_db(db)
     application = tornado.web.Application(
         handlers=get_handlers(),
         debug=settings.get("TORNADO_DEBUG", False),
@@ -319,6 +349,8 @@ def main():
     )
     application.listen(settings["PORT"], xheaders=True)
     logging.getLogger("publications").info(f"Web server at {settings['BASE_URL']}")
+    # Exit normally on SIGTERM, so that queued log entries are written.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     tornado.ioloop.IOLoop.instance().start()
 
 
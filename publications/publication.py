@@ -1,8 +1,9 @@
 "Publication pages."
 
+import copy
 import functools
+import threading
 
-import couchdb2
 import tornado.web
 
 from publications import constants
@@ -16,12 +17,18 @@ from publications.requesthandler import (
     DownloadParametersMixin,
 )
 
+import publications.changes
 import publications.crossref
 import publications.database
+import publications.job
 import publications.pubmed
 import publications.saver
 import publications.writer
 
+# Serializes the check for an existing entry and the save of a fetched
+# publication, so that concurrent fetches do not create duplicates.
+_save_lock = threading.Lock()
+
 
 class PublicationSaver(publications.saver.Saver):
     doctype = constants.PUBLICATION
@@ -120,7 +127,8 @@ class PublicationSaver(publications.saver.Saver):
     def set_researchers(self):
         "Set associations of researcher to author from form data."
         assert self.rqh, "requires http request context"
-        for pos, author in enumerate(self["authors"]):
+        authors = copy.deepcopy(self["authors"])
+        for pos, author in enumerate(authors):
             # Remove current association?
             if author.get("researcher"):
                 try:
@@ -138,6 +146,7 @@ class PublicationSaver(publications.saver.Saver):
                     pass
                 else:
                     author["researcher"] = researcher["_id"]
+        self["authors"] = authors
 
     def set_pmid_doi(self):
         "Set pmid and doi from form data. No validity checks are made."
@@ -194,19 +203,17 @@ class PublicationSaver(publications.saver.Saver):
         self["xrefs"] = other.get("xrefs") or self.get("xrefs") or []
 
         # Special case for journal field: copy each component field.
-        try:
-            journal = self["journal"]
-        except KeyError:
-            self["journal"] = journal = {}
+        journal = (self.get("journal") or {}).copy()
         for key, value in other.get("journal", {}).items():
             if value:
                 journal[key] = value
+        self["journal"] = journal
 
         # Authors: Transfer previously associated researchers.
         researchers = self.get_researchers()
-        self["authors"] = other["authors"]
+        authors = copy.deepcopy(other["authors"])
         # Transfer the researcher association, if any.
-        for author in self["authors"]:
+        for author in authors:
             key = "%s %s" % (author["family_normalized"], author["initials_normalized"])
             try:
                 # Previously associated researcher; just set it.
@@ -234,6 +241,7 @@ class PublicationSaver(publications.saver.Saver):
                             pass  # Just skip if any problem.
             # Don't save affiliations in publication itself.
             author.pop("affiliations", None)
+        self["authors"] = authors
 
     def fix_journal(self):
         """Set the appropriate journal title, ISSN and ISSN-L if not done.
@@ -251,21 +259,18 @@ class PublicationSaver(publications.saver.Saver):
         issn = journal.get("issn")
         issn_l = journal.get("issn-l")
         if issn:
+            registry = publications.database.get_journal_registry(self.db)
             try:
-                doc = publications.database.get_doc(self.db, "journal", "issn", issn)
+                doc = registry.get_by_issn(issn)
                 issn_l = doc.get("issn-l") or issn_l
             except KeyError:
                 try:
-                    doc = publications.database.get_doc(
-                        self.db, "journal", "issn_l", issn
-                    )
+                    doc = registry.get_by_issn_l(issn)
                     issn_l = issn
                 except KeyError:
                     if title:
                         try:
-                            doc = publications.database.get_doc(
-                                self.db, "journal", "title", title
-                            )
+                            doc = registry.get_by_title(title)
                         except KeyError:
                             doc = None
                         else:
@@ -291,17 +296,7 @@ class PublicationSaver(publications.saver.Saver):
         labels that are set in the existing publication entry.
         """
         if labels is None:
-            # Handle weird problem with non-ASCII characters in label...
-            values = {}
-            for key in self.rqh.request.arguments.keys():
-                values[utils.to_ascii(key)] = self.rqh.get_argument(key)
-            labels = {}
-            for label in self.rqh.get_arguments("label"):
-                qualifier = values.get(utils.to_ascii(f"{label}_qualifier"))
-                if qualifier in settings["SITE_LABEL_QUALIFIERS"]:
-                    labels[label] = qualifier
-                else:
-                    labels[label] = None
+            labels = get_form_labels(self.rqh)
         if allowed_labels is None:
             allowed_labels = self.rqh.get_allowed_labels()
         updated = self.get("labels", {}).copy()
@@ -385,6 +380,7 @@ class Publication(PublicationMixin, RequestHandler):
         for log in self.get_logs(publication["_id"]):
             self.db.delete(log)
         self.db.delete(publication)
+        publications.changes.notify_deleted(publication)
         self.see_other("home")
 
 
@@ -405,12 +401,12 @@ class Publications(RequestHandler):
 
     TEMPLATE = "publications/list.html"
 
-    def get(self, year=None):
+    async def get(self, year=None):
         if year:
             subset = Subset(self.db, year=year)
         else:
             subset = Subset(self.db, all=True)
-        self.render(self.TEMPLATE, publications=subset, year=year)
+        await self.render(self.TEMPLATE, publications=subset, year=year)
 
 
 class PublicationsTable(Publications):
@@ -422,7 +418,7 @@ class PublicationsTable(Publications):
 class PublicationsJson(CorsMixin, Publications):
     "Publications JSON output."
 
-    def render(self, template, **kwargs):
+    async def render(self, template, **kwargs):
         "Override; ignores template, and outputs JSON instead of HTML."
         URL = self.absolute_reverse_url
         publications = kwargs["publications"]
@@ -442,10 +438,7 @@ class PublicationsJson(CorsMixin, Publications):
         result["publications_count"] = len(publications)
         full = utils.to_bool(self.get_argument("full", True))
         result["full"] = full
-        result["publications"] = [
-            self.get_publication_json(publ, full=full) for publ in publications
-        ]
-        self.write(result)
+        await self.write_publications_json(result, publications, full=full)
 
 
 class PublicationsFile(DownloadParametersMixin, Publications):
@@ -503,16 +496,15 @@ class PublicationsCsv(PublicationsFile):
             cancel_url=self.get_argument("cancel_url", None),
         )
 
-    def post(self):
-        writer = publications.writer.CsvWriter(
-            self.db, self.application, **self.get_parameters()
-        )
-        writer.write(self.get_filtered_publications())
-        self.write(writer.get_content())
+    async def post(self):
         self.set_header("Content-Type", constants.CSV_MIME)
         self.set_header(
             "Content-Disposition", 'attachment; filename="publications.csv"'
         )
+        writer = publications.writer.CsvWriter(
+            self.db, self.application, outfile=self, **self.get_parameters()
+        )
+        await self.write_publications_file(writer, self.get_filtered_publications())
 
 
 class PublicationsXlsx(PublicationsFile):
@@ -531,17 +523,19 @@ class PublicationsXlsx(PublicationsFile):
         )
 
     # Authentication is *not* required!
-    def post(self):
+    async def post(self):
         "Produce XLSX output."
         writer = publications.writer.XlsxWriter(
             self.db, self.application, **self.get_parameters()
         )
-        writer.write(self.get_filtered_publications())
-        self.write(writer.get_content())
-        self.set_header("Content-Type", constants.XLSX_MIME)
-        self.set_header(
-            "Content-Disposition", 'attachment; filename="publications.xlsx"'
-        )
+        try:
+            self.set_header("Content-Type", constants.XLSX_MIME)
+            self.set_header(
+                "Content-Disposition", 'attachment; filename="publications.xlsx"'
+            )
+            await self.write_workbook(writer, self.get_filtered_publications())
+        finally:
+            writer.close()
 
 
 class PublicationsTxt(PublicationsFile):
@@ -560,17 +554,16 @@ class PublicationsTxt(PublicationsFile):
         )
 
     # Authentication is *not* required!
-    def post(self):
+    async def post(self):
         "Produce text output."
-        writer = publications.writer.TextWriter(
-            self.db, self.application, **self.get_parameters()
-        )
-        writer.write(self.get_filtered_publications())
-        self.write(writer.get_content())
         self.set_header("Content-Type", constants.TXT_MIME)
         self.set_header(
             "Content-Disposition", 'attachment; filename="publications.txt"'
         )
+        writer = publications.writer.TextWriter(
+            self.db, self.application, outfile=self, **self.get_parameters()
+        )
+        await self.write_publications_file(writer, self.get_filtered_publications())
 
 
 class PublicationsRecentJson(CorsMixin, RequestHandler):
@@ -588,9 +581,7 @@ class PublicationsRecentJson(CorsMixin, RequestHandler):
         result["publications_count"] = len(subset)
         full = utils.to_bool(self.get_argument("full", True))
         result["full"] = full
-        result["publications"] = [
-            self.get_publication_json(publ, full=full) for publ in subset
-        ]
+        result["publications"] = self.get_publications_json(subset, full=full)
         self.write(result)
 
 
@@ -646,9 +637,7 @@ class PublicationsNoPmidJson(CorsMixin, PublicationsNoPmid):
         links["self"] = {"href": URL("publications_no_pmid_json")}
         links["display"] = {"href": URL("publications_no_pmid")}
         result["publications_count"] = len(publications)
-        result["publications"] = [
-            self.get_publication_json(publ) for publ in publications
-        ]
+        result["publications"] = self.get_publications_json(publications)
         self.write(result)
 
 
@@ -677,9 +666,7 @@ class PublicationsNoDoiJson(CorsMixin, PublicationsNoDoi):
         links["self"] = {"href": URL("publications_no_doi_json")}
         links["display"] = {"href": URL("publications_no_doi")}
         result["publications_count"] = len(publications)
-        result["publications"] = [
-            self.get_publication_json(publ) for publ in publications
-        ]
+        result["publications"] = self.get_publications_json(publications)
         self.write(result)
 
 
@@ -708,9 +695,7 @@ class PublicationsNoLabelJson(CorsMixin, PublicationsNoLabel):
         result["publications_count"] = len(publications)
         full = utils.to_bool(self.get_argument("full", True))
         result["full"] = full
-        result["publications"] = [
-            self.get_publication_json(publ, full=full) for publ in publications
-        ]
+        result["publications"] = self.get_publications_json(publications, full=full)
         self.write(result)
 
 
@@ -790,11 +775,7 @@ class PublicationFetch(PublicationMixin, RequestHandler):
         self.clear_cookie("fetched")
         docs = []
         if fetched:
-            for iuid in fetched.split("_"):
-                try:
-                    docs.append(self.db[iuid])
-                except couchdb2.NotFoundError:
-                    pass
+            docs = self.get_bulk(fetched.split("_"))
         checked_labels = dict()
         labels_arg = self.get_argument("labels", "")
         if labels_arg:
@@ -822,29 +803,69 @@ class PublicationFetch(PublicationMixin, RequestHandler):
         )
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         self.check_curator()
         identifiers = self.get_argument("identifiers", "").split()
         identifiers = [utils.strip_prefix(i) for i in identifiers]
         identifiers = [i for i in identifiers if i]
         override = utils.to_bool(self.get_argument("override", False))
+        # Too many identifiers to fetch within the request: let a job do it.
+        if len(identifiers) > settings["PUBLICATIONS_FETCHED_LIMIT"]:
+            job = publications.job.create_job(
+                self.db,
+                identifiers,
+                self.current_user,
+                override=override,
+                labels=get_form_labels(self),
+                allowed_labels=self.get_allowed_labels(),
+                clean=not self.is_admin(),
+            )
+            self.see_other("job", job["_id"])
+            return
         errors = []
         blacklisted = []
         fetched = set()
         existing = set()
+        # Fetch the data for the PMIDs from PubMed and for the DOIs from
+        # Crossref in bulk, to start with. PubMed is still searched for
+        # each DOI below, and any identifier not obtained in bulk is
+        # tried again one by one.
+        limit = settings["PUBLICATIONS_FETCHED_LIMIT"]
+        pmids = [i for i in identifiers if constants.PMID_RX.match(i)]
+        dois = [i for i in identifiers if not constants.PMID_RX.match(i)]
+        try:
+            fetched_data, missing = await publications.pubmed.fetch_many_async(
+                pmids[:limit],
+                timeout=settings["PUBMED_TIMEOUT"],
+                delay=settings["PUBMED_DELAY"],
+                api_key=settings["NCBI_API_KEY"],
+            )
+        except IOError:
+            fetched_data = {}
+        try:
+            crossref_data, missing = await publications.crossref.fetch_many_async(
+                dois[:limit],
+                timeout=settings["CROSSREF_TIMEOUT"],
+                delay=settings["CROSSREF_DELAY"],
+            )
+        except IOError:
+            pass
+        else:
+            fetched_data.update(crossref_data)
         for identifier in identifiers:
             # Skip if number of loaded publications reached the limit
             if len(fetched) >= settings["PUBLICATIONS_FETCHED_LIMIT"]:
                 break
 
             try:
-                publ = fetch_publication(
+                publ = await fetch_publication_async(
                     self.db,
                     identifier,
                     override=override,
                     labels=None,  # Get from form fields.
                     clean=not self.is_admin(),
                     rqh=self,
+                    fetched=fetched_data,
                 )
             except IOError as error:
                 errors.append(str(error))
@@ -1016,7 +1037,7 @@ class PublicationUpdatePmid(PublicationMixin, RequestHandler):
     """
 
     @tornado.web.authenticated
-    def post(self, iuid):
+    async def post(self, iuid):
         try:
             publication = self.get_publication(iuid)
         except KeyError as error:
@@ -1031,7 +1052,7 @@ class PublicationUpdatePmid(PublicationMixin, RequestHandler):
             self.see_other("publication", publication["_id"], error=str(error))
             return
         try:
-            new = publications.pubmed.fetch(
+            new = await publications.pubmed.fetch_async(
                 identifier,
                 timeout=settings["PUBMED_TIMEOUT"],
                 delay=settings["PUBMED_DELAY"],
@@ -1061,7 +1082,7 @@ class PublicationFindPmid(PublicationMixin, RequestHandler):
     "If DOI is available, try to locate publication at PubMed and set PMID."
 
     @tornado.web.authenticated
-    def post(self, iuid):
+    async def post(self, iuid):
         try:
             publication = self.get_publication(iuid)
         except KeyError as error:
@@ -1077,7 +1098,7 @@ class PublicationFindPmid(PublicationMixin, RequestHandler):
             return
         try:
             try:
-                found = publications.pubmed.search(
+                found = await publications.pubmed.search_async(
                     doi=identifier,
                     timeout=settings["PUBMED_TIMEOUT"],
                     delay=settings["PUBMED_DELAY"],
@@ -1107,7 +1128,7 @@ class PublicationUpdateDoi(PublicationMixin, RequestHandler):
     """
 
     @tornado.web.authenticated
-    def post(self, iuid):
+    async def post(self, iuid):
         try:
             publication = self.get_publication(iuid)
         except KeyError as error:
@@ -1122,7 +1143,7 @@ class PublicationUpdateDoi(PublicationMixin, RequestHandler):
             self.see_other("publication", publication["_id"], error=str(error))
             return
         try:
-            new = publications.crossref.fetch(
+            new = await publications.crossref.fetch_async(
                 identifier,
                 timeout=settings["CROSSREF_TIMEOUT"],
                 delay=settings["CROSSREF_DELAY"],
@@ -1151,7 +1172,7 @@ class ApiPublicationFetch(PublicationMixin, ApiMixin, RequestHandler):
     "Fetch a publication given its PMID or DOI. Set its labels."
 
     @tornado.web.authenticated
-    def post(self):
+    async def post(self):
         self.check_curator()
         data = self.get_json_body()
         try:
@@ -1159,7 +1180,7 @@ class ApiPublicationFetch(PublicationMixin, ApiMixin, RequestHandler):
         except KeyError:
             raise tornado.web.HTTPError(400, reason="no identifier given")
         try:
-            publ = fetch_publication(
+            publ = await fetch_publication_async(
                 self.db,
                 identifier,
                 override=bool(data.get("override")),
@@ -1207,6 +1228,7 @@ def fetch_publication(
     clean=True,
     rqh=None,
     account=None,
+    fetched=None,
 ):
     """Fetch the publication given by identifier (PMID or DOI).
     If the publication is already in the database, the label,
@@ -1218,106 +1240,247 @@ def fetch_publication(
     labels: Dictionary of labels (key: label, value: qualifier) to set.
             Only allowed labels for the curator are updated.
     clean: Remove any allowed labels missing from an existing entry.
+    fetched: Dictionary of publications already fetched; from PubMed
+             with PMID as key, and from Crossref with DOI as key.
     Raise IOError if no such publication found, or other error.
     Raise KeyError if publication is in the blacklist (and not override).
     """
-    check_blacklisted(db, identifier, override=override)
-
-    # Does the publication already exist in the database?
+    current = get_current_publication(db, identifier, override=override)
+    steps = get_fetch_steps(identifier, current, fetched)
     try:
-        current = publications.database.get_publication(db, identifier)
-    except KeyError:
-        current = None
+        request = next(steps)
+        while True:
+            function, async_function, args, kwargs = request
+            try:
+                result = function(*args, **kwargs)
+            except (IOError, ValueError) as error:
+                request = steps.throw(error)
+            else:
+                request = steps.send(result)
+    except StopIteration as stop:
+        new = stop.value
+    return save_fetched_publication(
+        db,
+        identifier,
+        new,
+        current,
+        override=override,
+        labels=labels,
+        allowed_labels=allowed_labels,
+        clean=clean,
+        rqh=rqh,
+        account=account,
+    )
+
+
+async def fetch_publication_async(
+    db,
+    identifier,
+    override=False,
+    labels=None,
+    allowed_labels=None,
+    clean=True,
+    rqh=None,
+    account=None,
+    fetched=None,
+):
+    """Asynchronous version of 'fetch_publication', for use within
+    the Tornado IOLoop. Other requests are served while waiting
+    for the response from PubMed or Crossref.
+    """
+    current = get_current_publication(db, identifier, override=override)
+    steps = get_fetch_steps(identifier, current, fetched)
+    try:
+        request = next(steps)
+        while True:
+            function, async_function, args, kwargs = request
+            try:
+                result = await async_function(*args, **kwargs)
+            except (IOError, ValueError) as error:
+                request = steps.throw(error)
+            else:
+                request = steps.send(result)
+    except StopIteration as stop:
+        new = stop.value
+    return save_fetched_publication(
+        db,
+        identifier,
+        new,
+        current,
+        override=override,
+        labels=labels,
+        allowed_labels=allowed_labels,
+        clean=clean,
+        rqh=rqh,
+        account=account,
+    )
+
+
+def get_fetch_steps(identifier, current, fetched=None):
+    """Generator for the steps of fetching the publication data given by
+    the identifier, shared by 'fetch_publication' and its asynchronous
+    version. Each step yields a request tuple (function, async_function,
+    args, kwargs) for PubMed or Crossref. The caller performs it, and sends
+    back the result, or throws back any IOError or ValueError raised.
+    The fetched publication data is returned when done.
+    Raise IOError if no such publication found, or other error.
+    """
+    fetched = fetched or {}
 
     # Fetch from external source according to identifier type.
-    identifier_is_pmid = constants.PMID_RX.match(identifier)
-    if identifier_is_pmid:
-        try:
-            new = publications.pubmed.fetch(
-                identifier,
+    if constants.PMID_RX.match(identifier):
+        new = yield from get_fetch_step(
+            "PubMed", identifier, identifier, current, fetched
+        )
+
+    else:  # Not PMID: DOI identifier; search PubMed first.
+        pmids = yield (
+            publications.pubmed.search,
+            publications.pubmed.search_async,
+            (),
+            dict(
+                doi=identifier,
                 timeout=settings["PUBMED_TIMEOUT"],
                 delay=settings["PUBMED_DELAY"],
                 api_key=settings["NCBI_API_KEY"],
-            )
-        except IOError:
-            msg = f"No response from PubMed for {identifier}."
-            if current:
-                msg += " Publication exists, but could not be updated."
-            raise IOError(msg)
-        except ValueError as error:
-            raise IOError(f"{identifier} {str(error)}")
-
-    else:  # Not PMID: DOI identifier; search PubMed first.
-        pmids = publications.pubmed.search(
-            doi=identifier,
-            timeout=settings["PUBMED_TIMEOUT"],
-            delay=settings["PUBMED_DELAY"],
-            api_key=settings["NCBI_API_KEY"],
+            ),
         )
         if len(pmids) == 1:  # Unique result: use it.
-            try:
-                new = publications.pubmed.fetch(
-                    pmids[0],
-                    timeout=settings["PUBMED_TIMEOUT"],
-                    delay=settings["PUBMED_DELAY"],
-                    api_key=settings["NCBI_API_KEY"],
-                )
-            except IOError:
-                msg = f"No response from PubMed for {identifier}."
-                if current:
-                    msg += " Publication exists, but could not be updated."
-                raise IOError(msg)
-            except ValueError as error:
-                raise IOError(f"{identifier} {str(error)}")
+            new = yield from get_fetch_step(
+                "PubMed", pmids[0], identifier, current, fetched
+            )
         else:  # No result, or ambiguous. Try Crossref.
-            try:
-                new = publications.crossref.fetch(
-                    identifier,
-                    timeout=settings["CROSSREF_TIMEOUT"],
-                    delay=settings["CROSSREF_DELAY"],
+            new = yield from get_fetch_step(
+                "Crossref", identifier, identifier, current, fetched
+            )
+    return new
+
+
+def get_fetch_step(source, key, identifier, current, fetched):
+    """Generator for the step of fetching the publication data for the key
+    (PMID or DOI) from the source, unless already fetched.
+    See 'get_fetch_steps'.
+    """
+    try:
+        new = fetched.get(key)
+        if new is None:
+            if source == "PubMed":
+                new = yield (
+                    publications.pubmed.fetch,
+                    publications.pubmed.fetch_async,
+                    (key,),
+                    dict(
+                        timeout=settings["PUBMED_TIMEOUT"],
+                        delay=settings["PUBMED_DELAY"],
+                        api_key=settings["NCBI_API_KEY"],
+                    ),
                 )
-            except IOError:
-                msg = f"No response from Crossref for {identifier}."
-                if current:
-                    msg += " Publication exists, but could not be updated."
-                raise IOError(msg)
-            except ValueError as error:
-                raise IOError(f"{identifier} {str(error)}")
+            else:
+                new = yield (
+                    publications.crossref.fetch,
+                    publications.crossref.fetch_async,
+                    (key,),
+                    dict(
+                        timeout=settings["CROSSREF_TIMEOUT"],
+                        delay=settings["CROSSREF_DELAY"],
+                    ),
+                )
+    except IOError:
+        raise get_fetch_error(source, identifier, current)
+    except ValueError as error:
+        raise IOError(f"{identifier} {str(error)}")
+    return new
+
+
+def get_current_publication(db, identifier, override=False):
+    """Get the publication in the database given by the identifier.
+    Return None if not in the database.
+    Raise KeyError if publication is in the blacklist (and not override).
+    """
+    check_blacklisted(db, identifier, override=override)
+    try:
+        return publications.database.get_publication(db, identifier)
+    except KeyError:
+        return None
+
 
+def get_fetch_error(source, identifier, current):
+    "Get the IOError for no response from the external source."
+    msg = f"No response from {source} for {identifier}."
+    if current:
+        msg += " Publication exists, but could not be updated."
+    return IOError(msg)
+
+
+def save_fetched_publication(
+    db,
+    identifier,
+    new,
+    current,
+    override=False,
+    labels=None,
+    allowed_labels=None,
+    clean=True,
+    rqh=None,
+    account=None,
+):
+    """Update the current publication, if any, or create a new one,
+    from the data fetched from the external source.
+    The check for the current entry and the save are serialized within
+    the process, since the same publication may be fetched concurrently.
+    Raise KeyError if publication is in the blacklist (and not override).
+    """
     # Check blacklist registry again; other external id may be there.
     check_blacklisted(db, new.get("pmid"), override=override)
     check_blacklisted(db, new.get("doi"), override=override)
 
-    # Find the current entry again by the other identifier.
-    if current is None:
-        # Maybe the publication has been fetched using the other identifier?
-        if identifier_is_pmid:
-            try:
-                current = publications.database.get_publication(db, new.get("doi"))
-            except KeyError:
-                pass
+    with _save_lock:
+        # Find the current entry again by either identifier; it may have
+        # been fetched in the meantime, or using the other identifier.
+        if current is None:
+            for other in [new.get("pmid"), new.get("doi")]:
+                try:
+                    current = publications.database.get_publication(db, other)
+                    break
+                except KeyError:
+                    pass
+
+        # Update the current entry, if it exists.
+        if current:
+            with PublicationSaver(
+                doc=current, db=db, rqh=rqh, account=account
+            ) as saver:
+                saver.update(new)
+                saver.fix_journal()
+                saver.update_labels(
+                    labels=labels, clean=clean, allowed_labels=allowed_labels
+                )
+            return current
+        # Else create a new entry.
         else:
-            try:
-                current = publications.database.get_publication(db, new.get("pmid"))
-            except KeyError:
-                pass
+            with PublicationSaver(db=db, rqh=rqh, account=account) as saver:
+                saver.update(new)
+                saver.fix_journal()
+                saver.update_labels(labels=labels, allowed_labels=allowed_labels)
+            return saver.doc
 
-    # Update the current entry, if it exists.
-    if current:
-        with PublicationSaver(doc=current, db=db, rqh=rqh, account=account) as saver:
-            saver.update(new)
-            saver.fix_journal()
-            saver.update_labels(
-                labels=labels, clean=clean, allowed_labels=allowed_labels
-            )
-        return current
-    # Else create a new entry.
-    else:
-        with PublicationSaver(db=db, rqh=rqh, account=account) as saver:
-            saver.update(new)
-            saver.fix_journal()
-            saver.update_labels(labels=labels, allowed_labels=allowed_labels)
-        return saver.doc
+
+def get_form_labels(rqh):
+    """Get the labels dictionary (key: label, value: qualifier)
+    from the HTML form arguments of the request.
+    """
+    # Handle weird problem with non-ASCII characters in label...
+    values = {}
+    for key in rqh.request.arguments.keys():
+        values[utils.to_ascii(key)] = rqh.get_argument(key)
+    labels = {}
+    for label in rqh.get_arguments("label"):
+        qualifier = values.get(utils.to_ascii(f"{label}_qualifier"))
+        if qualifier in settings["SITE_LABEL_QUALIFIERS"]:
+            labels[label] = qualifier
+        else:
+            labels[label] = None
+    return labels
 
 
 def check_blacklisted(db, identifier, override=False):
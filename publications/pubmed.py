@@ -1,23 +1,36 @@
 "PubMed interface."
 
+import asyncio
 import json
 import os
 import os.path
 import re
 import string
 import sys
+import threading
 import time
 import unicodedata
 import xml.etree.ElementTree
 
-import requests
+import tornado.ioloop
+
+import publications.responsecache
+import publications.webservice
 
 PUBMED_FETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pubmed&rettype=abstract&id=%s&retmode=xml"
 
 PUBMED_SEARCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=pubmed&retmax=%s&term=%s&retmode=xml"
 
+SERVICE = "PubMed"
+
+RATE = 3.0  # Max requests per second allowed by NCBI.
+API_KEY_RATE = 10.0  # Max requests per second allowed by NCBI with an API key.
 DEFAULT_TIMEOUT = 5.0
 DEFAULT_DELAY = 1.0
+FETCH_CHUNK_SIZE = 200  # Max number of PMIDs per efetch request.
+
+_last_request = 0.0  # Monotonic time at which the last request was made.
+_last_request_lock = threading.Lock()
 
 MONTHS = dict(
     jan=1,
@@ -37,7 +50,7 @@ MONTHS = dict(
 ORCID_RX = re.compile(r"^[0-9]{4}-[0-9]{4}-[0-9]{4}-[0-9]{3}[X0-9]$")
 
 
-def search(
+def get_search_url(
     author=None,
     published=None,
     journal=None,
@@ -46,15 +59,9 @@ def search(
     title=None,
     exclude_title=None,
     retmax=20,
-    timeout=DEFAULT_TIMEOUT,
-    delay=DEFAULT_DELAY,
     api_key=None,
-    debug=False,
 ):
-    """Get list of PMIDs for PubMed hits given the data.
-    Delay the HTTP request if positive value (seconds).
-    The API key is the one set for your NCBI account, if any.
-    """
+    "Get the URL for a PubMed search given the data."
     parts = []
     if author:
         parts.append("%s[AU]" % to_ascii(str(author)))
@@ -74,20 +81,79 @@ def search(
     url = PUBMED_SEARCH_URL % (retmax, query)
     if api_key:
         url += f"&api_key={api_key}"
-    if delay > 0.0:
-        time.sleep(delay)
-    try:
-        if debug:
-            print("url>", url)
-        response = requests.get(url, timeout=timeout)
-    except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectionError):
-        raise IOError("timeout")
-    if response.status_code != 200:
-        raise IOError(f"HTTP status {response.status_code} {url}")
-    root = xml.etree.ElementTree.fromstring(response.content)
+    return url
+
+
+def parse_search(data):
+    "Parse the XML text data from a search into a list of PMIDs."
+    root = xml.etree.ElementTree.fromstring(data)
     return [e.text for e in root.findall("IdList/Id")]
 
 
+def search(
+    author=None,
+    published=None,
+    journal=None,
+    doi=None,
+    affiliation=None,
+    title=None,
+    exclude_title=None,
+    retmax=20,
+    timeout=DEFAULT_TIMEOUT,
+    delay=DEFAULT_DELAY,
+    api_key=None,
+    debug=False,
+):
+    """Get list of PMIDs for PubMed hits given the data.
+    Delay the HTTP request if positive value (seconds).
+    The API key is the one set for your NCBI account, if any.
+    """
+    url = get_search_url(
+        author=author,
+        published=published,
+        journal=journal,
+        doi=doi,
+        affiliation=affiliation,
+        title=title,
+        exclude_title=exclude_title,
+        retmax=retmax,
+        api_key=api_key,
+    )
+    return parse_search(get_content(url, timeout=timeout, delay=delay, debug=debug))
+
+
+async def search_async(
+    author=None,
+    published=None,
+    journal=None,
+    doi=None,
+    affiliation=None,
+    title=None,
+    exclude_title=None,
+    retmax=20,
+    timeout=DEFAULT_TIMEOUT,
+    delay=DEFAULT_DELAY,
+    api_key=None,
+    debug=False,
+):
+    """Asynchronous version of 'search', for use within the Tornado IOLoop.
+    The delay is the minimum interval between requests to PubMed.
+    """
+    url = get_search_url(
+        author=author,
+        published=published,
+        journal=journal,
+        doi=doi,
+        affiliation=affiliation,
+        title=title,
+        exclude_title=exclude_title,
+        retmax=retmax,
+        api_key=api_key,
+    )
+    content = await get_content_async(url, timeout=timeout, delay=delay, debug=debug)
+    return parse_search(content)
+
+
 def fetch(
     pmid,
     dirname=None,
@@ -102,37 +168,237 @@ def fetch(
     Delay the HTTP request if positive value (seconds).
     The API key is the one set for your NCBI account, if any.
     """
-    filename = pmid + ".xml"
-    content = None
-    # Get the locally stored XML file if it exists.
-    if dirname:
-        try:
-            with open(os.path.join(dirname, filename)) as infile:
-                content = infile.read()
-        except IOError:
-            pass
+    content = read_file(dirname, pmid)
     if not content:
-        url = PUBMED_FETCH_URL % pmid
-        if api_key:
-            url += f"&api_key={api_key}"
-        if delay > 0.0:
-            time.sleep(delay)
-        if debug:
-            print("url>", url)
-        try:
-            response = requests.get(url, timeout=timeout)
-        except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectionError):
-            raise IOError("timeout")
-        if response.status_code != 200:
-            raise IOError(f"HTTP status {response.status_code} {url}")
-        content = response.content
-        # Store the XML file locally.
-        if dirname:
-            with open(os.path.join(dirname, filename), "wb") as outfile:
-                outfile.write(content)
+        url = get_fetch_url(pmid, api_key)
+        content = get_content(url, timeout=timeout, delay=delay, debug=debug, key=pmid)
+        write_file(dirname, pmid, content)
+    return parse(content)
+
+
+async def fetch_async(
+    pmid,
+    dirname=None,
+    timeout=DEFAULT_TIMEOUT,
+    delay=DEFAULT_DELAY,
+    api_key=None,
+    debug=False,
+):
+    """Asynchronous version of 'fetch', for use within the Tornado IOLoop.
+    The delay is the minimum interval between requests to PubMed.
+    """
+    content = read_file(dirname, pmid)
+    if not content:
+        url = get_fetch_url(pmid, api_key)
+        content = await get_content_async(
+            url, timeout=timeout, delay=delay, debug=debug, key=pmid
+        )
+        write_file(dirname, pmid, content)
     return parse(content)
 
 
+def fetch_many(
+    pmids,
+    dirname=None,
+    chunk_size=FETCH_CHUNK_SIZE,
+    timeout=DEFAULT_TIMEOUT,
+    delay=DEFAULT_DELAY,
+    api_key=None,
+    debug=False,
+):
+    """Fetch the publications XML from PubMed for many PMIDs, using
+    one HTTP request per chunk of PMIDs, and parse into dictionaries.
+    Return a tuple of a dictionary with PMID as key and publication
+    dictionary as value, and the list of PMIDs for which no article was found.
+    Use the file cache directory if given, and the response cache if in use.
+    Delay each HTTP request if positive value (seconds).
+    Raise IOError if no connection, timeout or bad HTTP status.
+    """
+    result, remaining = read_many(dirname, pmids)
+    for pos in range(0, len(remaining), chunk_size):
+        chunk = remaining[pos : pos + chunk_size]
+        url = get_fetch_url(",".join(chunk), api_key)
+        content = get_content(url, timeout=timeout, delay=delay, debug=debug)
+        result.update(parse_many(content, dirname=dirname))
+    return result, [pmid for pmid in remaining if pmid not in result]
+
+
+async def fetch_many_async(
+    pmids,
+    dirname=None,
+    chunk_size=FETCH_CHUNK_SIZE,
+    timeout=DEFAULT_TIMEOUT,
+    delay=DEFAULT_DELAY,
+    api_key=None,
+    debug=False,
+):
+    """Asynchronous version of 'fetch_many', for use within the Tornado IOLoop.
+    The delay is the minimum interval between requests to PubMed.
+    The caches are read and written in the executor, not on the IOLoop thread.
+    """
+    ioloop = tornado.ioloop.IOLoop.current()
+    result, remaining = await ioloop.run_in_executor(None, read_many, dirname, pmids)
+    for pos in range(0, len(remaining), chunk_size):
+        chunk = remaining[pos : pos + chunk_size]
+        url = get_fetch_url(",".join(chunk), api_key)
+        content = await get_content_async(
+            url, timeout=timeout, delay=delay, debug=debug
+        )
+        result.update(await ioloop.run_in_executor(None, parse_many, content, dirname))
+    return result, [pmid for pmid in remaining if pmid not in result]
+
+
+def read_many(dirname, pmids):
+    """Get the publications for the PMIDs that are in the file cache,
+    or fresh in the response cache.
+    Return a tuple of a dictionary with PMID as key and publication
+    dictionary as value, and the list of unique PMIDs not cached.
+    """
+    cache = publications.responsecache.get_cache()
+    result = {}
+    remaining = []
+    for pmid in pmids:
+        if pmid in result or pmid in remaining:
+            continue
+        content = read_file(dirname, pmid)
+        if not content and cache:
+            entry = cache.get(SERVICE, pmid)
+            if entry and entry["fresh"]:
+                content = entry["content"]
+        try:
+            if not content:
+                raise ValueError
+            result[pmid] = parse(content)
+        except ValueError:
+            remaining.append(pmid)
+    return result, remaining
+
+
+def get_fetch_url(pmid, api_key=None):
+    "Get the URL for fetching the publication XML from PubMed."
+    url = PUBMED_FETCH_URL % pmid
+    if api_key:
+        url += f"&api_key={api_key}"
+    return url
+
+
+def read_file(dirname, pmid):
+    "Get the locally stored XML file if the directory is given and it exists."
+    if not dirname:
+        return None
+    try:
+        with open(os.path.join(dirname, pmid + ".xml")) as infile:
+            return infile.read()
+    except IOError:
+        return None
+
+
+def write_file(dirname, pmid, content):
+    "Store the XML file locally, if the directory is given."
+    if dirname:
+        with open(os.path.join(dirname, pmid + ".xml"), "wb") as outfile:
+            outfile.write(content)
+
+
+def get_content(
+    url, timeout=DEFAULT_TIMEOUT, delay=DEFAULT_DELAY, debug=False, key=None
+):
+    """Get the content of the response for the URL, after the delay.
+    If the key (PMID) is given and the response cache is in use, then
+    a fresh cached response is used instead, and a stale one is revalidated.
+    Raise IOError if no connection, timeout or bad HTTP status.
+    """
+    cache = publications.responsecache.get_cache() if key else None
+    entry = cache.get(SERVICE, key) if cache else None
+    if entry and entry["fresh"]:
+        return entry["content"]
+    wait(delay)
+    if debug:
+        print("url>", url)
+    response = publications.webservice.get_service(SERVICE).get(
+        url, timeout=timeout, headers=entry and entry["headers"]
+    )
+    return handle_response(url, response, cache, key, entry)
+
+
+async def get_content_async(
+    url, timeout=DEFAULT_TIMEOUT, delay=DEFAULT_DELAY, debug=False, key=None
+):
+    """Asynchronous version of 'get_content', for use within the Tornado IOLoop.
+    The response cache is read and written in the executor.
+    """
+    ioloop = tornado.ioloop.IOLoop.current()
+    cache = publications.responsecache.get_cache() if key else None
+    if cache:
+        entry = await ioloop.run_in_executor(None, cache.get, SERVICE, key)
+    else:
+        entry = None
+    if entry and entry["fresh"]:
+        return entry["content"]
+    await wait_async(delay)
+    if debug:
+        print("url>", url)
+    response = await publications.webservice.get_service(SERVICE).get_async(
+        url, timeout=timeout, headers=entry and entry["headers"]
+    )
+    return await ioloop.run_in_executor(
+        None, handle_response, url, response, cache, key, entry
+    )
+
+
+def handle_response(url, response, cache=None, key=None, entry=None):
+    """Get the content of the response, and update the response cache, if any.
+    Raise IOError if bad HTTP status.
+    """
+    if entry and response.status_code == 304:
+        cache.touch(SERVICE, key)
+        return entry["content"]
+    if response.status_code != 200:
+        raise IOError(f"HTTP status {response.status_code} {url}")
+    if cache:
+        cache.put(
+            SERVICE,
+            key,
+            response.content,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+    return response.content
+
+
+def wait(delay):
+    """Wait until at least 'delay' seconds have passed since the previous
+    request to PubMed from this process, also when several threads make
+    requests, unless the service has a rate limiter, which then is used
+    instead; see 'publications.ratelimit'.
+    """
+    if delay <= 0.0 or publications.webservice.get_service(SERVICE).limiter:
+        return
+    time.sleep(get_wait(delay))
+
+
+def get_wait(delay):
+    "Get the time (seconds) to wait before the next request, and reserve it."
+    global _last_request
+    with _last_request_lock:
+        now = time.monotonic()
+        start = max(now, _last_request + delay)
+        _last_request = start
+    return start - now
+
+
+async def wait_async(delay):
+    """Wait, without blocking the IOLoop, until at least 'delay' seconds
+    have passed since the previous request from this process, unless
+    the service has a rate limiter, which then is used instead.
+    """
+    if publications.webservice.get_service(SERVICE).limiter:
+        return
+    wait = get_wait(delay)
+    if wait > 0.0:
+        await asyncio.sleep(wait)
+
+
 def parse(data):
     "Parse XML text data for a publication into a dictionary."
     tree = xml.etree.ElementTree.fromstring(data)
@@ -140,6 +406,39 @@ def parse(data):
         article = get_element(tree, "PubmedArticle")
     except ValueError:
         raise ValueError("no article with the given PMID")
+    return parse_article(article)
+
+
+def parse_many(data, dirname=None):
+    """Parse XML text data for a set of publications into a dictionary
+    with PMID as key and publication dictionary as value.
+    Articles that cannot be parsed are skipped.
+    Store the XML for each article in the file cache directory if given,
+    and in the response cache if in use.
+    """
+    cache = publications.responsecache.get_cache()
+    result = {}
+    tree = xml.etree.ElementTree.fromstring(data)
+    for article in tree.findall("PubmedArticle"):
+        try:
+            publication = parse_article(article)
+        except ValueError:
+            continue
+        if not publication["pmid"]:
+            continue
+        result[publication["pmid"]] = publication
+        if dirname or cache:
+            articleset = xml.etree.ElementTree.Element("PubmedArticleSet")
+            articleset.append(article)
+            content = xml.etree.ElementTree.tostring(articleset, encoding="utf-8")
+            write_file(dirname, publication["pmid"], content)
+            if cache:
+                cache.put(SERVICE, publication["pmid"], content)
+    return result
+
+
+def parse_article(article):
+    "Parse the XML tree for a publication into a dictionary."
     result = dict()
     result["title"] = squish(get_title(article))
     result["pmid"] = get_pmid(article)
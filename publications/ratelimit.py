@@ -0,0 +1,133 @@
+"""Token-bucket rate limiters for the external web services, shared
+between all processes on the same host, i.e. web server instances and
+command-line runs, by keeping the bucket state in an SQLite file.
+"""
+
+import logging
+import os.path
+import sqlite3
+import tempfile
+import threading
+import time
+
+from publications import settings
+
+import publications.crossref
+import publications.pubmed
+import publications.webservice
+
+DEFAULT_FILENAME = "publications_ratelimit.sqlite3"
+
+
+def configure():
+    """Set the rate limiters of the external web services according to
+    the settings. PubMed allows a higher rate if an NCBI API key is used.
+    """
+    if not settings["RATE_LIMIT"]:
+        return
+    filepath = settings["RATE_LIMIT_FILEPATH"] or os.path.join(
+        tempfile.gettempdir(), DEFAULT_FILENAME
+    )
+    if settings["NCBI_API_KEY"]:
+        rate = publications.pubmed.API_KEY_RATE
+    else:
+        rate = publications.pubmed.RATE
+    service = publications.webservice.get_service(publications.pubmed.SERVICE)
+    service.limiter = TokenBucket(service.name, rate, filepath)
+    service = publications.webservice.get_service(publications.crossref.SERVICE)
+    service.limiter = TokenBucket(service.name, publications.crossref.RATE, filepath)
+
+
+class TokenBucket:
+    """Rate limiter allowing on average 'rate' requests per second,
+    with bursts of at most 'capacity' requests. The state is kept
+    in an SQLite file, so that it is shared between processes.
+    """
+
+    def __init__(self, name, rate, filepath, capacity=1.0):
+        self.name = name
+        self.rate = float(rate)
+        self.filepath = filepath
+        self.capacity = float(capacity)
+        self.lock = threading.Lock()
+        self.acquired = 0
+        self.waited = 0.0
+        self.errors = 0
+        cnx = self.connect()
+        try:
+            cnx.execute(
+                "CREATE TABLE IF NOT EXISTS buckets"
+                " (name TEXT PRIMARY KEY, tokens REAL, updated REAL)"
+            )
+        finally:
+            cnx.close()
+
+    def connect(self):
+        "Return a new connection to the SQLite file, in autocommit mode."
+        return sqlite3.connect(self.filepath, timeout=10.0, isolation_level=None)
+
+    def acquire(self):
+        "Wait until a token is available, and take it."
+        waited = 0.0
+        while True:
+            try:
+                wait = self.take()
+            except sqlite3.Error as error:
+                # Be conservative if the shared state is unusable.
+                logging.getLogger("publications").warning(
+                    f"Rate limiter {self.name}: {error}"
+                )
+                with self.lock:
+                    self.errors += 1
+                wait = 1.0 / self.rate
+                time.sleep(wait)
+                waited += wait
+                break
+            if wait <= 0.0:
+                break
+            time.sleep(wait)
+            waited += wait
+        with self.lock:
+            self.acquired += 1
+            self.waited += waited
+
+    def take(self):
+        """Take a token, if available. Return 0.0 if taken, else the time
+        (seconds) until a token should be available.
+        """
+        cnx = self.connect()
+        try:
+            cnx.execute("BEGIN IMMEDIATE")
+            row = cnx.execute(
+                "SELECT tokens, updated FROM buckets WHERE name=?", (self.name,)
+            ).fetchone()
+            now = time.time()
+            if row is None:
+                tokens = self.capacity
+            else:
+                elapsed = max(0.0, now - row[1])
+                tokens = min(self.capacity, row[0] + elapsed * self.rate)
+            if tokens >= 1.0:
+                tokens -= 1.0
+                wait = 0.0
+            else:
+                wait = (1.0 - tokens) / self.rate
+            cnx.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated)"
+                " VALUES (?, ?, ?)",
+                (self.name, tokens, now),
+            )
+            cnx.execute("COMMIT")
+            return wait
+        finally:
+            cnx.close()
+
+    def get_stats(self):
+        "Return a dictionary of the current counters for the rate limiter."
+        with self.lock:
+            return dict(
+                rate=self.rate,
+                acquired=self.acquired,
+                waited=round(self.waited, 3),
+                errors=self.errors,
+            )
@@ -1,6 +1,8 @@
 "RequestHandler subclass."
 
 import base64
+import codecs
+import itertools
 import json
 import logging
 import os.path
@@ -8,23 +10,44 @@ import urllib.request
 import urllib.parse
 import urllib.error
 
+import tornado.escape
+import tornado.ioloop
 import tornado.web
 
 from publications import constants
 from publications import settings
 from publications import utils
 
+import publications.changes
 import publications.database
 
 
+def iter_chunks(publications, chunk_size):
+    """Return an iterator over lists of about 'chunk_size' publications.
+    A Subset fetches the publication documents one chunk at a time.
+    """
+    try:
+        return publications.iter_chunks(chunk_size)
+    except AttributeError:
+        publications = iter(publications)
+        return iter(lambda: list(itertools.islice(publications, chunk_size)), [])
+
+
 class RequestHandler(tornado.web.RequestHandler):
     "Base request handler."
 
     def prepare(self):
-        "Get the database connection."
+        "Get the database connection from the pool."
         self.db = publications.database.get_db()
         self.logger = logging.getLogger("publications")
 
+    def on_finish(self):
+        "Return the database connection to the pool."
+        try:
+            publications.database.release_db(self.db)
+        except AttributeError:  # If 'prepare' was never called.
+            pass
+
     def get_template_namespace(self):
         "Set the variables accessible within the template."
         result = super(RequestHandler, self).get_template_namespace()
@@ -99,18 +122,27 @@ class RequestHandler(tornado.web.RequestHandler):
             self.db, designname, viewname, key=key, last=last, **kwargs
         )
 
+    def get_bulk(self, iuids):
+        """Get the documents for the IUIDs, in the given order, using
+        chunked bulk fetches. Documents not found are skipped.
+        """
+        return publications.database.get_bulk(self.db, iuids)
+
+    def get_iuids(self, designname, viewname, key=None, last=None, **kwargs):
+        """Get the list of unique document IUIDs using the named view
+        and the given key or interval.
+        """
+        return publications.database.get_iuids(
+            self.db, designname, viewname, key=key, last=last, **kwargs
+        )
+
     def get_count(self, designname, viewname, key=None):
         "Get the reduce value for the name view and the given key."
         return publications.database.get_count(self.db, designname, viewname, key=key)
 
     def get_year_counts(self):
         "Return a list of tuples (year, count) for all years."
-        return [
-            (r.key, r.value)
-            for r in self.db.view(
-                "publication", "year", descending=True, reduce=True, group_level=1
-            )
-        ]
+        return publications.database.get_year_counts(self.db)
 
     def get_publication(self, identifier):
         """Get the publication given its IUID, DOI or PMID.
@@ -184,7 +216,7 @@ class RequestHandler(tornado.web.RequestHandler):
         else:
             raise ValueError
         try:
-            account = self.get_doc("account", "api_key", api_key)
+            account = publications.database.get_cached_account(self.db, api_key=api_key)
         except KeyError:
             raise ValueError
         if account.get("disabled"):
@@ -205,7 +237,7 @@ class RequestHandler(tornado.web.RequestHandler):
             raise ValueError
         email = email.decode("utf-8")
         try:
-            account = self.get_account(email)
+            account = publications.database.get_cached_account(self.db, email=email)
         except KeyError:
             return None
         # Check if login session is invalidated.
@@ -231,12 +263,14 @@ class RequestHandler(tornado.web.RequestHandler):
             auth = auth.split()
             if auth[0].lower() != "basic":
                 raise ValueError
-            auth = base64.b64decode(auth[1])
+            credentials = auth[1]
+            auth = base64.b64decode(credentials).decode("utf-8")
             email, password = auth.split(":", 1)
-            account = self.get_account(email)
-            if utils.hashed_password(password) != account.get("password"):
+            account = publications.database.get_cached_account(self.db, email=email)
+            hashed = publications.database.get_hashed_password(credentials, password)
+            if hashed != account.get("password"):
                 raise ValueError
-        except (IndexError, ValueError, TypeError):
+        except (IndexError, KeyError, ValueError, TypeError):
             raise ValueError
         if account.get("disabled"):
             self.logger.info(f"Basic auth login: DISABLED {account['email']}")
@@ -298,6 +332,89 @@ class RequestHandler(tornado.web.RequestHandler):
         for log in self.get_logs(doc["_id"]):
             self.db.delete(log)
         self.db.delete(doc)
+        publications.changes.notify_deleted(doc)
+
+    def get_publications_json(self, publications, full=True):
+        """JSON representation of the publications.
+        The ORCIDs of the researchers for all of them are fetched at once.
+        """
+        publications = list(publications)
+        self.get_orcids(publications)
+        return [self.get_publication_json(p, full=full) for p in publications]
+
+    async def write_publications_json(self, result, publications, full=True):
+        """Write the JSON object, with the publications added as a list
+        under the key 'publications'. Each publication is serialized and
+        written separately, and the output is flushed for every chunk of
+        JSON_CHUNK_SIZE publications, waiting for the client to receive it.
+        Neither the whole JSON document, nor all publication documents
+        of a Subset, are thus ever held in memory.
+        """
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        head = tornado.escape.json_encode(result)[:-1]
+        if result:
+            head += ", "
+        self.write(head + '"publications": [')
+        separator = ""
+        for chunk in iter_chunks(publications, settings["JSON_CHUNK_SIZE"]):
+            self.get_orcids(chunk)
+            for publication in chunk:
+                data = self.get_publication_json(publication, full=full)
+                self.write(separator + tornado.escape.json_encode(data))
+                separator = ", "
+            await self.flush()
+        self.write("]}")
+
+    async def write_publications_file(self, writer, publications):
+        """Write the publications using the file writer, which must have been
+        created with this request handler as its output file. The output is
+        flushed for every chunk of EXPORT_CHUNK_SIZE publications, waiting
+        for the client to receive it.
+        """
+        writer.write_start()
+        for chunk in iter_chunks(publications, settings["EXPORT_CHUNK_SIZE"]):
+            for publication in chunk:
+                writer.write_publication(publication)
+            await self.flush()
+        writer.write_end()
+
+    async def write_workbook(self, writer, publications):
+        """Write the publications using the XLSX file writer, and then write
+        its contents. The workbook is built and serialized in the executor,
+        so that other requests are not blocked meanwhile.
+        """
+        await tornado.ioloop.IOLoop.current().run_in_executor(
+            None, writer.write, publications
+        )
+        await self.write_file_content(writer)
+
+    async def write_file_content(self, writer):
+        """Write the contents of the file writer, which must have written
+        the publications, flushing the output for every chunk of bytes
+        and waiting for the client to receive it.
+        """
+        for chunk in writer.iter_content():
+            self.write(chunk)
+            await self.flush()
+
+    def get_orcids(self, docs):
+        """Return a dictionary with the IUIDs of the researchers as keys
+        and their ORCIDs as values. Includes those for the authors of the
+        given publication documents, which are fetched in bulk if not
+        already cached.
+        """
+        try:
+            orcids = self._orcids
+        except AttributeError:
+            orcids = self._orcids = {}
+        iuids = set()
+        for doc in docs:
+            for author in doc.get("authors") or []:
+                if author.get("researcher") and author["researcher"] not in orcids:
+                    iuids.add(author["researcher"])
+        if iuids:
+            orcids.update(publications.database.get_orcids(self.db, iuids))
+        return orcids
 
     def get_publication_json(self, publication, full=True, single=False):
         "JSON representation of publication."
@@ -323,9 +440,9 @@ class RequestHandler(tornado.web.RequestHandler):
                 au["given"] = author.get("given")
                 au["initials"] = author.get("initials")
                 if author.get("researcher"):
-                    researcher = self.get_researcher(author["researcher"])
-                    if researcher.get("orcid"):
-                        au["orcid"] = researcher["orcid"]
+                    orcid = self.get_orcids([publication]).get(author["researcher"])
+                    if orcid:
+                        au["orcid"] = orcid
                     au["researcher"] = {
                         "href": URL("researcher_json", author["researcher"])
                     }
@@ -406,22 +523,12 @@ class RequestHandler(tornado.web.RequestHandler):
                 pass
         else:
             result["publications_count"] = len(publications)
-            result["publications"] = [
-                self.get_publication_json(publication) for publication in publications
-            ]
+            result["publications"] = self.get_publications_json(publications)
         return result
 
     def get_issn_l(self, issn):
-        """Get the ISSN-L for the ISSN. Returns None if none found.
-        Lazy evaluation; fetch the mapping only when actually requested.
-        """
-        try:
-            return self._issn_l_map.get(issn)
-        except AttributeError:
-            self._issn_l_map = dict(
-                [(r.value, r.key) for r in self.db.view("journal", "issn_l")]
-            )
-            return self._issn_l_map.get(issn)
+        "Get the ISSN-L for the ISSN. Returns None if none found."
+        return publications.database.get_journal_registry(self.db).get_issn_l(issn)
 
 
 class CorsMixin:
@@ -479,5 +586,9 @@ class DownloadParametersMixin:
             result["delimiter"] = "\t"
         encoding = self.get_argument("encoding", "").lower()
         if encoding:
+            try:
+                codecs.lookup(encoding)
+            except LookupError:
+                raise tornado.web.HTTPError(400, reason="unknown encoding")
             result["encoding"] = encoding
         return result
@@ -1,12 +1,16 @@
 "Researcher (person, but also possibly consortium or similar) pages."
 
+import copy
+
 import tornado.web
 
 from publications import constants
 from publications import settings
 from publications import utils
 from publications.requesthandler import CorsMixin, RequestHandler
+from publications.subset import Subset
 
+import publications.changes
 import publications.publication
 import publications.saver
 
@@ -111,7 +115,9 @@ class Researcher(ResearcherMixin, RequestHandler):
         except KeyError as error:
             self.see_other("home", error=str(error))
             return
-        publications = self.get_docs("publication", "researcher", key=researcher["_id"])
+        publications = self.get_bulk(
+            self.get_iuids("publication", "researcher", key=researcher["_id"])
+        )
         publications.sort(key=lambda i: i["published"], reverse=True)
         self.render(
             "researcher/display.html",
@@ -140,6 +146,7 @@ class Researcher(ResearcherMixin, RequestHandler):
         for log in self.get_logs(researcher["_id"]):
             self.db.delete(log)
         self.db.delete(researcher)
+        publications.changes.notify_deleted(researcher)
         self.see_other("home")
 
 
@@ -167,22 +174,21 @@ class JsonMixin:
 class ResearcherJson(CorsMixin, JsonMixin, Researcher):
     "Researcher JSON output."
 
-    def get(self, identifier):
+    async def get(self, identifier):
         "Display the researcher."
         try:
             researcher = self.get_researcher(identifier)
         except KeyError as error:
             raise tornado.web.HTTPError(404, reason="no such researcher")
-        publications = self.get_docs("publication", "researcher", key=researcher["_id"])
-        publications.sort(key=lambda i: i["published"], reverse=True)
+        subset = Subset(self.db)
+        subset.iuids = set(
+            self.get_iuids("publication", "researcher", key=researcher["_id"])
+        )
         result = dict()
         result["entity"] = "researcher"
         result["timestamp"] = utils.timestamp()
         result.update(self.get_json(researcher))
-        result["publications"] = [
-            self.get_publication_json(publ) for publ in publications
-        ]
-        self.write(result)
+        await self.write_publications_json(result, subset)
 
 
 class ResearcherAdd(ResearcherMixin, RequestHandler):
@@ -252,7 +258,9 @@ class ResearcherFilterMixin:
 
     def get_filtered_publications(self):
         "Overrides the method from PublicationsCsv; not really filtered."
-        result = self.get_docs("publication", "researcher", key=self.researcher["_id"])
+        result = self.get_bulk(
+            self.get_iuids("publication", "researcher", key=self.researcher["_id"])
+        )
         result.sort(key=lambda i: i["published"], reverse=True)
         return result
 
@@ -271,13 +279,13 @@ class ResearcherPublicationsCsv(
             return
         self.render("researcher/publications_csv.html", researcher=researcher)
 
-    def post(self, identifier):
+    async def post(self, identifier):
         try:
             self.researcher = self.get_researcher(identifier)
         except KeyError as error:
             self.see_other("home", error=str(error))
             return
-        super().post()
+        await super().post()
 
 
 class ResearcherPublicationsXlsx(
@@ -294,13 +302,13 @@ class ResearcherPublicationsXlsx(
             return
         self.render("researcher/publications_xlsx.html", researcher=researcher)
 
-    def post(self, identifier):
+    async def post(self, identifier):
         try:
             self.researcher = self.get_researcher(identifier)
         except KeyError as error:
             self.see_other("home", error=str(error))
             return
-        super().post()
+        await super().post()
 
 
 class ResearcherPublicationsTxt(
@@ -317,13 +325,13 @@ class ResearcherPublicationsTxt(
             return
         self.render("researcher/publications_txt.html", researcher=researcher)
 
-    def post(self, identifier):
+    async def post(self, identifier):
         try:
             self.researcher = self.get_researcher(identifier)
         except KeyError as error:
             self.see_other("home", error=str(error))
             return
-        super().post()
+        await super().post()
 
 
 class ResearcherPublicationsEdit(ResearcherMixin, RequestHandler):
@@ -363,14 +371,17 @@ class ResearcherPublicationsEdit(ResearcherMixin, RequestHandler):
                     if utils.to_bool(self.get_argument(publication["_id"])):
                         continue
                     with PublicationSaver(doc=publication, rqh=self) as saver:
-                        for author in saver["authors"]:
+                        authors = copy.deepcopy(saver["authors"])
+                        for author in authors:
                             if author.get("researcher") == researcher["_id"]:
                                 author.pop("researcher")
+                        saver["authors"] = authors
                 except tornado.web.MissingArgumentError:
                     if publication["_id"] not in add:
                         continue
                     with PublicationSaver(doc=publication, rqh=self) as saver:
-                        for author in saver["authors"]:
+                        authors = copy.deepcopy(saver["authors"])
+                        for author in authors:
                             if author.get("researcher"):
                                 continue
                             if (
@@ -389,6 +400,7 @@ class ResearcherPublicationsEdit(ResearcherMixin, RequestHandler):
                                 continue
                             author["researcher"] = researcher["_id"]
                             break
+                        saver["authors"] = authors
         except ValueError as error:
             self.set_error_flash(str(error))
         except publications.saver.SaverError:
@@ -0,0 +1,189 @@
+"""Cache of the responses from the external web services, i.e. PubMed
+and Crossref, keyed by service and identifier (PMID or DOI). The content
+is stored compressed in an SQLite file, so that it is shared between
+the web server and command-line runs, and it expires after a time to live.
+"""
+
+import os.path
+import sqlite3
+import threading
+import time
+import zlib
+
+from publications import constants
+from publications import settings
+
+DEFAULT_FILENAME = "response_cache.sqlite3"
+
+_cache = None
+
+
+def create_cache():
+    """Create the process-wide response cache according to the settings.
+    Return None if not enabled.
+    """
+    global _cache
+    if settings["RESPONSE_CACHE_TTL"]:
+        filepath = settings["RESPONSE_CACHE_FILEPATH"] or os.path.join(
+            constants.SITE_DIR, DEFAULT_FILENAME
+        )
+        _cache = ResponseCache(filepath, settings["RESPONSE_CACHE_TTL"])
+    else:
+        _cache = None
+    return _cache
+
+
+def get_cache():
+    "Return the process-wide response cache, or None if not in use."
+    return _cache
+
+
+def get_cache_stats():
+    "Return the statistics for the response cache, or None if not in use."
+    if _cache is None:
+        return None
+    return _cache.get_stats()
+
+
+class ResponseCache:
+    """Compressed response content by service and identifier, with
+    the validators (ETag, Last-Modified) for conditional requests.
+    An entry older than the time to live (seconds) is stale; it may be
+    revalidated by a conditional request, else it is fetched anew.
+    """
+
+    def __init__(self, filepath, ttl):
+        self.filepath = filepath
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.revalidated = 0
+        self.initialized = False
+
+    def connect(self):
+        """Return a new connection to the SQLite file, in autocommit mode.
+        The file and its table are created on first use, not when the
+        cache is set up, so that commands not using it do not touch it.
+        """
+        cnx = sqlite3.connect(self.filepath, timeout=10.0, isolation_level=None)
+        with self.lock:
+            if not self.initialized:
+                try:
+                    cnx.execute(
+                        "CREATE TABLE IF NOT EXISTS responses"
+                        " (service TEXT, identifier TEXT, content BLOB, etag TEXT,"
+                        " last_modified TEXT, fetched REAL,"
+                        " PRIMARY KEY (service, identifier))"
+                    )
+                except sqlite3.Error:
+                    cnx.close()
+                    raise
+                self.initialized = True
+        return cnx
+
+    def get(self, service, identifier):
+        """Get the cached response for the service and identifier.
+        Return a dictionary with the content, whether it is fresh, and
+        the headers for a conditional request. Return None if not cached.
+        """
+        cnx = self.connect()
+        try:
+            row = cnx.execute(
+                "SELECT content, etag, last_modified, fetched FROM responses"
+                " WHERE service=? AND identifier=?",
+                (service, identifier),
+            ).fetchone()
+        finally:
+            cnx.close()
+        if row is None:
+            with self.lock:
+                self.misses += 1
+            return None
+        fresh = time.time() - row[3] < self.ttl
+        with self.lock:
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale += 1
+        headers = {}
+        if row[1]:
+            headers["If-None-Match"] = row[1]
+        if row[2]:
+            headers["If-Modified-Since"] = row[2]
+        return dict(content=zlib.decompress(row[0]), fresh=fresh, headers=headers)
+
+    def put(self, service, identifier, content, etag=None, last_modified=None):
+        "Store the response content for the service and identifier."
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        cnx = self.connect()
+        try:
+            cnx.execute(
+                "INSERT OR REPLACE INTO responses"
+                " (service, identifier, content, etag, last_modified, fetched)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    service,
+                    identifier,
+                    zlib.compress(content),
+                    etag,
+                    last_modified,
+                    time.time(),
+                ),
+            )
+        finally:
+            cnx.close()
+
+    def touch(self, service, identifier):
+        "Mark the entry as fresh again, after a successful revalidation."
+        cnx = self.connect()
+        try:
+            cnx.execute(
+                "UPDATE responses SET fetched=? WHERE service=? AND identifier=?",
+                (time.time(), service, identifier),
+            )
+        finally:
+            cnx.close()
+        with self.lock:
+            self.revalidated += 1
+
+    def prune(self):
+        "Delete all stale entries. Return the number of entries deleted."
+        cnx = self.connect()
+        try:
+            cursor = cnx.execute(
+                "DELETE FROM responses WHERE fetched<?", (time.time() - self.ttl,)
+            )
+            count = cursor.rowcount
+            cnx.execute("VACUUM")
+        finally:
+            cnx.close()
+        return count
+
+    def get_stats(self):
+        "Return a dictionary of the current counters for the cache."
+        services = {}
+        # Do not create the file merely to report that it is empty.
+        if os.path.exists(self.filepath):
+            cnx = self.connect()
+            try:
+                for service, count, stale, size in cnx.execute(
+                    "SELECT service, COUNT(*), SUM(fetched<?), SUM(LENGTH(content))"
+                    " FROM responses GROUP BY service",
+                    (time.time() - self.ttl,),
+                ):
+                    services[service] = dict(entries=count, stale=stale, size=size)
+            finally:
+                cnx.close()
+        with self.lock:
+            return dict(
+                filepath=self.filepath,
+                ttl=self.ttl,
+                services=services,
+                hits=self.hits,
+                misses=self.misses,
+                stale=self.stale,
+                revalidated=self.revalidated,
+            )
@@ -4,8 +4,15 @@ import couchdb2
 import tornado.web
 
 from publications import constants
+from publications import settings
 from publications import utils
 
+import publications.changes
+import publications.database
+import publications.logwriter
+
+MAX_RETRIES = 3  # Number of retries for a document having a conflict.
+
 
 class SaverError(Exception):
     "Revision mismatch error."
@@ -45,11 +52,15 @@ class Saver:
     def __exit__(self, type, value, tb):
         if type is not None:
             return False  # No exceptions handled here.
+        # Nothing to save for an existing document that has not changed.
+        if not self.changed and "_rev" in self.doc:
+            return
         self.finalize()
         try:
             self.db.put(self.doc)
         except couchdb2.RevisionError:
             raise SaverError
+        publications.changes.notify(self.doc)
         self.post_process()
         self.write_log()
 
@@ -129,7 +140,13 @@ class Saver:
         pass
 
     def write_log(self):
-        "Write a log entry for the change."
+        """Write a log entry for the change. It is queued for writing
+        in a batch if the log writer is running.
+        """
+        publications.logwriter.write(self.db, self.get_log())
+
+    def get_log(self):
+        "Return a log entry for the change."
         log = dict(
             _id=utils.get_iuid(),
             doc=self.doc["_id"],
@@ -155,4 +172,98 @@ class Saver:
                 log["user_agent"] = self.account["user_agent"]
             except (TypeError, AttributeError, KeyError):
                 pass
-        self.db.put(log)
+        return log
+
+
+class BulkSaver:
+    """Save many documents of one doctype, and their log entries,
+    using chunked '_bulk_docs' requests. Each document is modified via
+    an instance of the given Saver class, so that its check and convert
+    methods are used, and the changes are recorded in the log entry.
+    """
+
+    def __init__(
+        self,
+        saver_class,
+        rqh=None,
+        db=None,
+        account=None,
+        chunk_size=None,
+        max_retries=MAX_RETRIES,
+    ):
+        self.saver_class = saver_class
+        self.rqh = rqh
+        self.db = db
+        if self.db is None and self.rqh is None:
+            raise AttributeError("neither db nor rqh given")
+        if self.db is None:
+            self.db = rqh.db
+        self.account = account
+        self.chunk_size = chunk_size or settings["DATABASE_BULK_CHUNK_SIZE"]
+        self.max_retries = max_retries
+        self.saved = []
+        self.failed = {}  # Key: IUID, value: reason.
+
+    def save(self, docs, modify):
+        """Modify each document by calling 'modify' with a saver for it,
+        and save the documents actually changed. A document having a
+        revision conflict is read again and modified anew, at most
+        'max_retries' times; after that it is recorded in 'failed'.
+        Return the list of saved documents.
+        """
+        docs = list(docs)
+        for pos in range(0, len(docs), self.chunk_size):
+            chunk = docs[pos : pos + self.chunk_size]
+            attempt = 0
+            while chunk:
+                conflicts = self.save_chunk(chunk, modify)
+                if not conflicts:
+                    break
+                if attempt == self.max_retries:
+                    for iuid in conflicts:
+                        self.failed[iuid] = "conflict"
+                    break
+                attempt += 1
+                chunk = publications.database.get_bulk(self.db, conflicts)
+        return self.saved
+
+    def save_chunk(self, docs, modify):
+        """Modify and save the documents, and then the log entries.
+        Return the list of IUIDs for the documents having a conflict.
+        """
+        savers = []
+        for doc in docs:
+            saver = self.saver_class(
+                doc=doc, rqh=self.rqh, db=self.db, account=self.account
+            )
+            modify(saver)
+            if saver.changed:
+                saver.finalize()
+                savers.append(saver)
+        if not savers:
+            return []
+        conflicts = []
+        logs = []
+        results = self.db.update([saver.doc for saver in savers])
+        for saver, result in zip(savers, results):
+            if result[0]:
+                saver.doc["_rev"] = result[2]
+                publications.changes.notify(saver.doc)
+                saver.post_process()
+                logs.append(saver.get_log())
+                self.saved.append(saver.doc)
+            elif result[2] == "conflict":
+                conflicts.append(result[1])
+            else:
+                self.failed[result[1]] = result[3]
+        if logs:
+            self.db.update(logs)
+        return conflicts
+
+    def get_failed_message(self):
+        "Return a message listing the documents not saved, or None if none."
+        if not self.failed:
+            return None
+        return f"{len(self.failed)} document(s) could not be saved: " + ", ".join(
+            [f"{iuid} ({reason})" for iuid, reason in self.failed.items()]
+        )
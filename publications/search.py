@@ -1,14 +1,55 @@
 "Search for terms in publications."
 
+import bisect
+import heapq
+import logging
+import math
+import threading
+
 from publications import constants
 from publications import settings
 from publications import utils
 from publications.requesthandler import CorsMixin, RequestHandler
 
+import publications.changes
+import publications.database
+
 
 SEARCH_REMOVE = set(constants.SEARCH_REMOVE)
 SEARCH_IGNORE = set(constants.SEARCH_IGNORE)
 
+# Fields searched using the lower-cased term, keeping all characters.
+RAW_FIELDS = ("author", "doi", "published", "epublished", "issn", "journal", "xref")
+# Fields searched using the lower-cased term, with characters removed.
+CLEAN_FIELDS = ("title", "notes", "pmid", "label_parts")
+FIELDS = RAW_FIELDS + CLEAN_FIELDS + ("researcher",)
+
+# Okapi BM25 parameters: term frequency saturation and length normalization.
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_search_index = None
+
+
+def create_search_index(db):
+    """Create and load the process-wide search index, and keep it
+    up to date from the changes feed.
+    """
+    global _search_index
+    search_index = SearchIndex()
+    search_index.load(db)
+    publications.changes.add_listener(search_index.update)
+    _search_index = search_index
+    logging.getLogger("publications").info(
+        f"Search index loaded; {len(search_index.terms)} publications."
+    )
+    return _search_index
+
+
+def get_search_index():
+    "Return the process-wide search index, or None if not in use."
+    return _search_index
+
 
 class Search(RequestHandler):
     """Search publications for terms in fields of publication docs:
@@ -16,7 +57,15 @@ class Search(RequestHandler):
     label_parts.
     """
 
-    def get(self):
+    async def get(self):
+        try:
+            offset = max(0, int(self.get_argument("offset", 0)))
+        except (ValueError, TypeError):
+            offset = 0
+        try:
+            limit = max(1, int(self.get_argument("limit", settings["SEARCH_LIMIT"])))
+        except (ValueError, TypeError):
+            limit = settings["SEARCH_LIMIT"]
         terms = self.get_argument("terms", "")
         # The search term is quoted; a single phrase using exact word.
         if terms.startswith('"') and terms.endswith('"'):
@@ -30,6 +79,22 @@ class Search(RequestHandler):
             ]
             exact = False
 
+        # Rank by relevance, and fetch only the publications to display.
+        search_index = get_search_index()
+        if search_index is not None:
+            total, iuids = search_index.rank(terms, exact, offset + limit)
+            iuids = iuids[offset:]
+            publications = self.get_bulk(iuids)
+            await self.render(
+                "search.html",
+                publications=publications,
+                terms=self.get_argument("terms", ""),
+                total=total,
+                offset=offset,
+                limit=limit,
+            )
+            return
+
         iuids = set()
 
         # If a term is an ORCID, find researcher and her publications.
@@ -67,25 +132,65 @@ class Search(RequestHandler):
         ]:
             iuids.update(self.search(viewname, terms, exact))
 
-        # Finally get the publication documents for IUIDs
-        publications = [self.get_publication(iuid) for iuid in iuids]
-        publications.sort(key=lambda p: p["published"], reverse=True)
-        self.render(
+        # Finally get the publication documents for the IUIDs in the page.
+        if len(iuids) <= settings["DATABASE_BULK_CHUNK_SIZE"]:
+            publications = self.get_bulk(iuids)
+            publications.sort(key=lambda p: p.get("published") or "", reverse=True)
+            publications = publications[offset : offset + limit]
+        else:
+            publications = self.get_bulk(self.get_page(iuids, offset, limit))
+        await self.render(
             "search.html",
             publications=publications,
             terms=self.get_argument("terms", ""),
+            total=len(iuids),
+            offset=offset,
+            limit=limit,
         )
 
+    def get_page(self, iuids, offset, limit):
+        """Return the list of IUIDs at the offset and limit of the IUIDs
+        sorted by reverse 'published' date. The 'published' view is read
+        in chunks, latest first, only until the page is complete, and no
+        publication documents are fetched. Those lacking a date are last.
+        """
+        end = offset + limit
+        chunk_size = settings["DATABASE_BULK_CHUNK_SIZE"]
+        remaining = set(iuids)
+        result = []
+        startkey = None
+        skip = 0
+        while remaining and len(result) < end:
+            kwargs = dict(descending=True, limit=chunk_size, reduce=False)
+            if startkey is not None:
+                kwargs["startkey"] = startkey
+            if skip:
+                kwargs["skip"] = skip
+            rows = list(self.db.view("publication", "published", **kwargs))
+            if not rows:
+                break
+            for row in rows:
+                if row.id in remaining:
+                    result.append(row.id)
+                    remaining.remove(row.id)
+            # Continue after the last row; skip those with the same key.
+            if rows[-1].key == startkey:
+                skip += len(rows)
+            else:
+                startkey = rows[-1].key
+                skip = len([r for r in rows if r.key == startkey])
+        if len(result) < end:
+            result.extend(sorted(remaining))
+        return result[offset:end]
+
     def search(self, designview, terms, exact):
         "Search the given view using the terms. Return set of IUIDs."
         result = set()
         if designview is None:
             # IUID of publication entry; check that it really is a publication.
-            for term in terms:
-                try:
-                    result.add(self.get_publication(term)["_id"])
-                except KeyError:
-                    pass
+            for doc in self.get_bulk(terms):
+                if doc.get(constants.DOCTYPE) == constants.PUBLICATION:
+                    result.add(doc["_id"])
         else:
             designname, viewname = designview.split("/")
             for term in terms:
@@ -106,19 +211,242 @@ class Search(RequestHandler):
 class SearchJson(CorsMixin, Search):
     "Search results JSON output."
 
-    def render(self, template, **kwargs):
+    async def render(self, template, **kwargs):
         URL = self.absolute_reverse_url
         publications = kwargs["publications"]
         terms = kwargs["terms"]
+        offset = kwargs["offset"]
+        limit = kwargs["limit"]
         result = dict()
         result["entity"] = "publications search"
         result["timestamp"] = utils.timestamp()
         result["terms"] = terms
+        result["offset"] = offset
+        result["limit"] = limit
         result["links"] = links = dict()
-        links["self"] = {"href": URL("search_json", terms=terms)}
-        links["display"] = {"href": URL("search", terms=terms)}
+        links["self"] = {
+            "href": URL("search_json", terms=terms, offset=offset, limit=limit)
+        }
+        links["display"] = {
+            "href": URL("search", terms=terms, offset=offset, limit=limit)
+        }
+        if offset > 0:
+            links["previous"] = {
+                "href": URL(
+                    "search_json",
+                    terms=terms,
+                    offset=max(0, offset - limit),
+                    limit=limit,
+                )
+            }
+        if offset + limit < kwargs["total"]:
+            links["next"] = {
+                "href": URL(
+                    "search_json", terms=terms, offset=offset + limit, limit=limit
+                )
+            }
+        result["total_count"] = kwargs["total"]
         result["publications_count"] = len(publications)
-        result["publications"] = [
-            self.get_publication_json(publication) for publication in publications
-        ]
-        self.write(result)
+        await self.write_publications_json(result, publications)
+
+
+class SearchIndex:
+    """In-memory inverted index of the publications, for the same fields
+    and with the same normalization of words as the views used by 'Search'.
+    For each field, the postings of a key is a dictionary with the IUIDs
+    of publications as keys, and the number of occurrences as values.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.postings = dict([(field, {}) for field in FIELDS])
+        self.keys = dict([(field, []) for field in FIELDS])  # Sorted keys.
+        self.terms = {}  # Key: IUID, value: dict of field to dict of key counts.
+        self.lengths = {}  # Key: IUID, value: dict of field to number of keys.
+        self.total_lengths = dict([(field, 0) for field in FIELDS])
+        self.orcids = {}  # Key: ORCID, value: researcher IUID.
+        self.researchers = {}  # Key: researcher IUID, value: ORCID.
+
+    def load(self, db):
+        "Load all publications and researchers from the database."
+        with self.lock:
+            for doc in publications.database.get_docs(db, "researcher", "orcid"):
+                self._set_researcher(doc)
+            for doc in publications.database.get_docs(db, "publication", "modified"):
+                self._add(doc)
+
+    def update(self, doc):
+        "Update the index for the changed or deleted document."
+        with self.lock:
+            if doc.get("_deleted"):
+                self._remove(doc["_id"])
+                self._remove_researcher(doc["_id"])
+            elif doc.get(constants.DOCTYPE) == constants.PUBLICATION:
+                self._remove(doc["_id"])
+                self._add(doc)
+            elif doc.get(constants.DOCTYPE) == constants.RESEARCHER:
+                self._remove_researcher(doc["_id"])
+                self._set_researcher(doc)
+
+    def search(self, terms, exact):
+        """Return the set of IUIDs of the publications matching any of the terms
+        in any field. Unless 'exact' is true, a term matches keys beginning
+        with it. The same rules as for the views are applied to the terms.
+        """
+        return set(self.get_scores(terms, exact))
+
+    def rank(self, terms, exact, limit):
+        """Return the total number of publications matching the terms,
+        and the list of IUIDs of at most 'limit' publications having
+        the highest relevance. Ties are ordered by reverse 'published'.
+        """
+        # Both under the same lock; a publication may be deleted in between.
+        with self.lock:
+            scores = self.get_scores(terms, exact)
+            published = dict(
+                [(iuid, max(self.terms[iuid]["published"] or [""])) for iuid in scores]
+            )
+        ranked = heapq.nlargest(
+            limit, scores, key=lambda iuid: (scores[iuid], published[iuid])
+        )
+        return len(scores), ranked
+
+    def get_scores(self, terms, exact):
+        """Return a dictionary with the IUIDs of the publications matching
+        the terms as keys, and the Okapi BM25 relevance scores as values.
+        The score of each field is weighted by SEARCH_FIELD_WEIGHTS.
+        """
+        scores = {}
+        with self.lock:
+            # ORCID must be looked up before the terms are lower-cased.
+            researchers = [self.orcids[t] for t in terms if t in self.orcids]
+            self._score(scores, "researcher", researchers, exact)
+            terms = [t.lower() for t in terms if t]
+            for iuid in [t for t in terms if t in self.terms]:
+                scores[iuid] = scores.get(iuid, 0.0) + self._idf(1)
+            terms = [t for t in terms if t not in SEARCH_IGNORE]
+            for field in RAW_FIELDS:
+                self._score(scores, field, terms, exact)
+            terms = ["".join([c for c in t if c not in SEARCH_REMOVE]) for t in terms]
+            terms = [t for t in terms if t and t not in SEARCH_IGNORE]
+            for field in CLEAN_FIELDS:
+                self._score(scores, field, terms, exact)
+        return scores
+
+    def _score(self, scores, field, terms, exact):
+        "Add the scores for the publications matching the terms in the field."
+        weight = settings["SEARCH_FIELD_WEIGHTS"].get(field, 1.0)
+        average = self.total_lengths[field] / max(1, len(self.terms)) or 1.0
+        for term in terms:
+            for postings in self._search(field, term, exact):
+                idf = self._idf(len(postings))
+                for iuid, count in postings.items():
+                    norm = 1 - BM25_B + BM25_B * self.lengths[iuid][field] / average
+                    tf = count * (BM25_K1 + 1) / (count + BM25_K1 * norm)
+                    scores[iuid] = scores.get(iuid, 0.0) + weight * idf * tf
+
+    def _idf(self, frequency):
+        "Return the inverse document frequency given the document frequency."
+        total = len(self.terms)
+        return math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+
+    def _search(self, field, term, exact):
+        "Return the list of postings for the keys matching the term in the field."
+        postings = self.postings[field]
+        if exact:
+            return [postings[term]] if term in postings else []
+        result = []
+        keys = self.keys[field]
+        for pos in range(bisect.bisect_left(keys, term), len(keys)):
+            if not keys[pos].startswith(term):
+                break
+            result.append(postings[keys[pos]])
+        return result
+
+    def _add(self, doc):
+        "Add the postings for the publication document."
+        iuid = doc["_id"]
+        terms = get_terms(doc)
+        self.terms[iuid] = terms
+        self.lengths[iuid] = lengths = {}
+        for field, counts in terms.items():
+            lengths[field] = sum(counts.values())
+            self.total_lengths[field] += lengths[field]
+            postings = self.postings[field]
+            for key, count in counts.items():
+                try:
+                    postings[key][iuid] = count
+                except KeyError:
+                    postings[key] = {iuid: count}
+                    bisect.insort(self.keys[field], key)
+
+    def _remove(self, iuid):
+        "Remove the postings for the publication, if any."
+        for field, length in self.lengths.pop(iuid, {}).items():
+            self.total_lengths[field] -= length
+        for field, counts in self.terms.pop(iuid, {}).items():
+            postings = self.postings[field]
+            for key in counts:
+                postings[key].pop(iuid, None)
+                if not postings[key]:
+                    del postings[key]
+                    keys = self.keys[field]
+                    del keys[bisect.bisect_left(keys, key)]
+
+    def _set_researcher(self, doc):
+        "Set the ORCID lookup for the researcher document."
+        if doc.get("orcid"):
+            self.orcids[doc["orcid"]] = doc["_id"]
+            self.researchers[doc["_id"]] = doc["orcid"]
+
+    def _remove_researcher(self, iuid):
+        "Remove the ORCID lookup for the researcher, if any."
+        orcid = self.researchers.pop(iuid, None)
+        if orcid is not None:
+            self.orcids.pop(orcid, None)
+
+
+def get_terms(doc):
+    """Return the keys for each field in the publication, with counts.
+    Must be kept consistent with the views used by 'Search'.
+    """
+    result = dict([(field, {}) for field in FIELDS])
+
+    def add(field, key):
+        if key:
+            result[field][key] = result[field].get(key, 0) + 1
+
+    def add_words(field, text):
+        for word in text.split():
+            word = "".join([c for c in word.lower() if c not in SEARCH_REMOVE])
+            if word not in SEARCH_IGNORE:
+                add(field, word)
+
+    for author in doc.get("authors") or []:
+        add("researcher", author.get("researcher"))
+        family = author.get("family_normalized")
+        if not family:
+            continue
+        add("author", family)
+        if author.get("initials_normalized"):
+            add("author", f"{family} {author['initials_normalized']}")
+        if author.get("given_normalized"):
+            add("author", f"{family} {author['given_normalized']}")
+    add("doi", (doc.get("doi") or "").lower())
+    add("published", doc.get("published"))
+    add("epublished", doc.get("epublished"))
+    journal = doc.get("journal") or {}
+    add("issn", journal.get("issn"))
+    add("issn", journal.get("issn-l"))
+    add("journal", (journal.get("title") or "").lower())
+    for xref in doc.get("xrefs") or []:
+        add("xref", (xref.get("key") or "").lower())
+    add_words("title", doc.get("title") or "")
+    add_words("notes", doc.get("notes") or "")
+    add("pmid", doc.get("pmid"))
+    for label in doc.get("labels") or {}:
+        label = "".join([" " if c in SEARCH_REMOVE else c for c in label.lower()])
+        for part in label.split():
+            if part not in SEARCH_IGNORE:
+                add("label_parts", part)
+    return result
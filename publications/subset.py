@@ -2,6 +2,7 @@
 
 import functools
 import logging
+import threading
 
 import pyparsing as pp
 
@@ -11,7 +12,9 @@ from publications import utils
 from publications.requesthandler import RequestHandler, DownloadParametersMixin
 
 import publications.admin
+import publications.changes
 import publications.database
+import publications.index
 import publications.writer
 
 
@@ -20,15 +23,20 @@ class SubsetDisplay(DownloadParametersMixin, RequestHandler):
 
     def get(self):
         "Display the initial subset definition page."
-        self.render("subset.html", expression=None, publications=None)
+        self.render(
+            "subset.html", expression=None, explain=False, publications=None, plan=None
+        )
 
     # Authentication is *not* required!
-    def post(self):
+    async def post(self):
         expression = self.get_argument("expression", "")
+        explain = utils.to_bool(self.get_argument("explain", False))
+        plan = None
         try:
             if not expression:
                 raise ValueError("No expression given.")
-            subset = get_subset(self.db, expression)
+            plan = get_plan(self.db, expression, explain=explain)
+            subset = plan.evaluate(self.db, {})
         except ValueError as error:
             subset = Subset(self.db)  # Empty subset.
             message = str(error)
@@ -38,42 +46,48 @@ class SubsetDisplay(DownloadParametersMixin, RequestHandler):
         if format and not message:
             parameters = self.get_parameters()
             if format == "CSV":
-                writer = publications.writer.CsvWriter(
-                    self.db, self.application, **parameters
-                )
-                writer.write(subset)
-                self.write(writer.get_content())
                 self.set_header("Content-Type", constants.CSV_MIME)
                 self.set_header(
                     "Content-Disposition", 'attachment; filename="publications.csv"'
                 )
+                writer = publications.writer.CsvWriter(
+                    self.db, self.application, outfile=self, **parameters
+                )
+                await self.write_publications_file(writer, subset)
                 return
             elif format == "XLSX":
                 writer = publications.writer.XlsxWriter(
                     self.db, self.application, **parameters
                 )
-                writer.write(subset)
-                self.write(writer.get_content())
-                self.set_header("Content-Type", constants.XLSX_MIME)
-                self.set_header(
-                    "Content-Disposition", 'attachment; filename="publications.xlsx"'
-                )
+                try:
+                    self.set_header("Content-Type", constants.XLSX_MIME)
+                    self.set_header(
+                        "Content-Disposition",
+                        'attachment; filename="publications.xlsx"',
+                    )
+                    await self.write_workbook(writer, subset)
+                finally:
+                    writer.close()
                 return
             elif format == "TXT":
-                writer = publications.writer.TextWriter(
-                    self.db, self.application, **parameters
-                )
-                writer.write(subset)
-                self.write(writer.get_content())
                 self.set_header("Content-Type", constants.TXT_MIME)
                 self.set_header(
                     "Content-Disposition", 'attachment; filename="publications.txt"'
                 )
+                writer = publications.writer.TextWriter(
+                    self.db, self.application, outfile=self, **parameters
+                )
+                await self.write_publications_file(writer, subset)
                 return
             else:
                 error = f"Unknown format '{format}"
         self.render(
-            "subset.html", expression=expression, publications=subset, error=message
+            "subset.html",
+            expression=expression,
+            explain=explain,
+            publications=subset,
+            plan=plan.explain() if explain and plan else None,
+            error=message,
         )
 
 
@@ -92,7 +106,9 @@ class Subset:
         issn=None,
     ):
         self.db = db
-        self.iuids = set()
+        self.index = publications.index.get_index()
+        self.bits = None  # Bitmap in the index, if used; else set of IUIDs.
+        self._iuids = set()
         if all:
             self.select_all()
         elif year:
@@ -108,8 +124,23 @@ class Subset:
         elif issn:
             self.select_issn(issn)
 
+    @property
+    def iuids(self):
+        "The set of IUIDs for the selected publications."
+        if self.bits is not None:
+            self._iuids = self.index.get_iuids(self.bits)
+            self.bits = None
+        return self._iuids
+
+    @iuids.setter
+    def iuids(self, iuids):
+        self._iuids = iuids
+        self.bits = None
+
     def __len__(self):
-        return len(self.iuids)
+        if self.bits is not None:
+            return publications.index.count(self.bits)
+        return len(self._iuids)
 
     def __str__(self):
         return f"{len(self)} publications"
@@ -124,66 +155,128 @@ class Subset:
         """Return an iterator over all selected publication documents,
         sorted by reverse 'published' order.
         """
-        return iter(self.get_publications())
+        for chunk in self.iter_chunks():
+            yield from chunk
 
     def __or__(self, other):
         "Union of this subset and the other."
-        if not isinstance(other, Subset):
-            raise ValueError(f"'other' is not a Subset: {repr(other)}")
-        if self.db is not other.db:
-            raise ValueError("'other' is connected to a different database.")
-        result = self.copy()
-        result.iuids.update(other.iuids)
-        return result
+        return self._combine(other, int.__or__, set.update)
 
     def __and__(self, other):
         "Intersection of this subset and the other."
-        if not isinstance(other, Subset):
-            raise ValueError(f"'other' is not a Subset: {repr(other)}")
-        if self.db is not other.db:
-            raise ValueError("'other' is connected to a different database.")
-        result = self.copy()
-        result.iuids.intersection_update(other.iuids)
-        return result
+        return self._combine(other, int.__and__, set.intersection_update)
 
     def __sub__(self, other):
         "Difference of this subset and the other."
-        if not isinstance(other, Subset):
-            raise ValueError(f"'other' is not a Subset: {repr(other)}")
-        if self.db is not other.db:
-            raise ValueError("'other' is connected to a different database.")
-        result = self.copy()
-        result.iuids.difference_update(other.iuids)
-        return result
+        return self._combine(other, lambda b1, b2: b1 & ~b2, set.difference_update)
 
     def __xor__(self, other):
         "Symmetric difference of this subset and the other."
+        return self._combine(other, int.__xor__, set.symmetric_difference_update)
+
+    def _combine(self, other, bits_operation, set_operation):
+        """Return the result of the operation on this subset and the other.
+        Use the bitmaps, if possible, otherwise the sets of IUIDs.
+        """
         if not isinstance(other, Subset):
             raise ValueError(f"'other' is not a Subset: {repr(other)}")
         if self.db is not other.db:
             raise ValueError("'other' is connected to a different database.")
+        bits = self.get_bits()
+        if bits is not None:
+            other_bits = other.get_bits(self.index)
+            if other_bits is not None:
+                result = Subset(self.db)
+                result.index = self.index
+                result.bits = bits_operation(bits, other_bits)
+                return result
         result = self.copy()
-        result.iuids.symmetric_difference_update(other.iuids)
+        set_operation(result.iuids, other.iuids)
         return result
 
+    def get_bits(self, index=None):
+        """Return the bitmap for this subset in the given index,
+        or in its own index if none given. Return None if not possible.
+        """
+        if index is None:
+            index = self.index
+        if index is None:
+            return None
+        if self.bits is not None and self.index is index:
+            return self.bits
+        try:
+            return index.get_bits(self.iuids)
+        except KeyError:  # Some publication not yet in the index.
+            return None
+
     def get_publications(self):
         """Return the list of all selected publication documents.
         Sort by reverse order of (published, title), to make order stable.
         """
-        publications = self.db.get_bulk(list(self.iuids))
-        publications = [p for p in publications if p]
-        publications.sort(key=lambda p: (p["published"], p["title"]), reverse=True)
-        return publications
+        result = publications.database.get_bulk(self.db, self.iuids)
+        result.sort(key=lambda p: (p["published"], p["title"]), reverse=True)
+        return result
+
+    def iter_chunks(self, chunk_size=None):
+        """Return an iterator over lists of the selected publication documents,
+        about 'chunk_size' in each, in the same order as 'get_publications'.
+        The order is determined from the 'published' dates, so that only
+        one chunk of documents need be held in memory at a time.
+        """
+        chunk_size = chunk_size or settings["DATABASE_BULK_CHUNK_SIZE"]
+        iuids = self.iuids
+        if len(iuids) <= chunk_size:
+            yield self.get_publications()
+            return
+        published = self.get_published_dates(iuids)
+        iuids = sorted(iuids, key=lambda i: published.get(i) or "", reverse=True)
+        start = 0
+        while start < len(iuids):
+            end = min(start + chunk_size, len(iuids))
+            # Publications with the same date are sorted by title; keep together.
+            last = published.get(iuids[end - 1])
+            while end < len(iuids) and published.get(iuids[end]) == last:
+                end += 1
+            chunk = publications.database.get_bulk(self.db, iuids[start:end])
+            chunk.sort(key=lambda p: (p["published"], p["title"]), reverse=True)
+            yield chunk
+            start = end
+
+    def get_published_dates(self, iuids):
+        """Return a dictionary of the 'published' date for the IUIDs.
+        Use the index, if possible, otherwise fetch the documents in chunks.
+        """
+        if self.index:
+            try:
+                return self.index.get_published_dates(iuids)
+            except KeyError:  # Some publication not yet in the index.
+                pass
+        result = {}
+        iuids = list(iuids)
+        chunk_size = settings["DATABASE_BULK_CHUNK_SIZE"]
+        for pos in range(0, len(iuids), chunk_size):
+            for doc in publications.database.get_bulk(
+                self.db, iuids[pos : pos + chunk_size]
+            ):
+                result[doc["_id"]] = doc.get("published")
+        return result
 
     def copy(self):
         "Return a copy if this subset."
         result = Subset(self.db)
-        result.iuids.update(self.iuids)
+        if self.bits is not None:
+            result.index = self.index
+            result.bits = self.bits
+        else:
+            result.iuids.update(self.iuids)
         return result
 
     def select_all(self):
         "Select all publications."
-        self._select("publication", "published")
+        if self.index:
+            self.bits = self.index.get_all()
+        else:
+            self._select("publication", "published")
 
     def select_recent(self, recent):
         "Select 'recent' number of publications."
@@ -191,7 +284,10 @@ class Subset:
 
     def select_year(self, year):
         "Select the publications by the 'published' year."
-        self._select("publication", "year", key=year)
+        if self.index:
+            self.bits = self.index.get("year", year)
+        else:
+            self._select("publication", "year", key=year)
 
     def select_label(self, label):
         """Select publications by the given label.
@@ -199,7 +295,12 @@ class Subset:
         from that point.
         """
         label = label.lower().strip()
-        if label.endswith("*"):
+        if self.index:
+            if label.endswith("*"):
+                self.bits = self.index.get_prefix("label", label[:-1])
+            else:
+                self.bits = self.index.get("label", label)
+        elif label.endswith("*"):
             label = label[:-1]
             self._select(
                 "publication", "label", key=label, last=label + constants.CEILING
@@ -217,7 +318,12 @@ class Subset:
         from that point.
         """
         name = utils.to_ascii(name).lower().strip()
-        if name.endswith("*"):
+        if self.index:
+            if name.endswith("*"):
+                self.bits = self.index.get_prefix("author", name[:-1])
+            else:
+                self.bits = self.index.get("author", name)
+        elif name.endswith("*"):
             name = name[:-1]
             self._select(
                 "publication", "author", key=name, last=name + constants.CEILING
@@ -234,11 +340,17 @@ class Subset:
             iuid = researcher["_id"]
         except KeyError:
             iuid = "-"
-        self._select("publication", "researcher", key=iuid)
+        if self.index:
+            self.bits = self.index.get("researcher", iuid)
+        else:
+            self._select("publication", "researcher", key=iuid)
 
     def select_issn(self, issn):
         "Select publications by the journal ISSN."
-        self._select("publication", "issn", key=issn)
+        if self.index:
+            self.bits = self.index.get("issn", issn)
+        else:
+            self._select("publication", "issn", key=issn)
 
     def select_no_pmid(self):
         "Select all publications lacking PubMed identifier."
@@ -252,11 +364,17 @@ class Subset:
         "Select all publications having no label"
         self._select("publication", "no_label")
 
-    def select_published(self, date):
+    def select_published(self, date, last=None):
         """Select all publications 'published' after the given date, inclusive.
+        If 'last' is given, only those before or on that date.
         This means the paper journal publication date.
         """
-        self._select("publication", "published", key=date, last=constants.CEILING)
+        if self.index:
+            self.bits = self.index.get_published(date, last=last)
+        else:
+            self._select(
+                "publication", "published", key=date, last=last or constants.CEILING
+            )
 
     def select_first_published(self, date):
         """Select all publications first published after the given date,
@@ -304,10 +422,23 @@ class Subset:
             result = functools.reduce(
                 lambda s, t: s | t, [Subset(self.db, label=l) for l in labels]
             )
-            self.iuids = result.iuids
+            if result.bits is not None:
+                self.index = result.index
+                self.bits = result.bits
+            else:
+                self.iuids = result.iuids
 
     def _select(self, designname, viewname, key=None, last=None, **kwargs):
-        "Select the documents by design, view and key."
+        """Select the documents by design, view and key.
+        Use the result cache, if enabled.
+        """
+        cache_key = _get_cache_key(designname, viewname, key, last, **kwargs)
+        if _result_cache is not None:
+            try:
+                self.iuids = set(_result_cache.get(cache_key))
+                return
+            except KeyError:
+                generation = _result_cache.generation
         kwargs["reduce"] = False
         if key is None:
             pass
@@ -318,6 +449,169 @@ class Subset:
             kwargs["endkey"] = last
         view = self.db.view(designname, viewname, **kwargs)
         self.iuids = set([i.id for i in view])
+        if _result_cache is not None:
+            _result_cache.put(cache_key, frozenset(self.iuids), generation=generation)
+
+
+_result_cache = None
+
+
+def create_result_cache():
+    """Create the process-wide cache of subset selections, and keep it
+    up to date from the changes feed.
+    """
+    global _result_cache
+    _result_cache = ResultCache(settings["SUBSET_RESULT_CACHE_SIZE"])
+    publications.changes.add_listener(_result_cache.update)
+    return _result_cache
+
+
+def _get_cache_key(designname, viewname, key=None, last=None, **kwargs):
+    "Return the result cache key for the view query."
+    return (designname, viewname, key, last, tuple(sorted(kwargs.items())))
+
+
+def _get_count(db, viewname, key, last=None):
+    """Return the number of publications for the key or interval in the view.
+    Use the result cache, if possible, otherwise the reduce of the view.
+    """
+    if _result_cache is not None:
+        try:
+            cache_key = _get_cache_key("publication", viewname, key, last)
+            return len(_result_cache.get(cache_key))
+        except KeyError:
+            pass
+    return publications.database.get_count(
+        db, "publication", viewname, key=key, last=last
+    )
+
+
+def _get_published_count(db, date, last=None):
+    """Return the number of publications 'published' after the given date,
+    inclusive, and before or on the last date, if given. Use the in-memory
+    index, if in use, otherwise the result cache or the reduce of the view.
+    """
+    index = publications.index.get_index()
+    if index is not None:
+        return index.get_published_count(date, last=last)
+    return _get_count(db, "published", date, last=last or constants.CEILING)
+
+
+def get_result_cache_stats():
+    "Return the usage statistics of the subset result cache, if in use."
+    if _result_cache is None:
+        return None
+    return _result_cache.get_stats()
+
+
+class ResultCache(utils.LruCache):
+    """Cache of the sets of IUIDs selected by view queries.
+    The key is the design, view, key range and other view parameters.
+    A change of a publication removes only the entries which contain it,
+    or which would contain it after the change.
+    """
+
+    def __init__(self, size=256):
+        super().__init__(size)
+        self.generation = 0  # Incremented for each change.
+        self.invalidations = 0
+
+    def put(self, key, value, generation=None):
+        """Cache the value for the key, unless a change has happened
+        since the given generation; the value may then be out of date.
+        """
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            super().put(key, value)
+
+    def update(self, doc):
+        "Remove the entries that may be affected by the changed or deleted document."
+        if doc.get(constants.DOCTYPE) != constants.PUBLICATION:
+            if not doc.get("_deleted"):
+                return
+        with self.lock:
+            self.generation += 1
+            for key, iuids in list(self.items.items()):
+                if doc["_id"] in iuids or (
+                    not doc.get("_deleted") and _may_select(key, doc)
+                ):
+                    del self.items[key]
+                    self.invalidations += 1
+
+    def get_stats(self):
+        result = super().get_stats()
+        result["invalidations"] = self.invalidations
+        return result
+
+
+def _may_select(cache_key, doc):
+    "Could the publication be selected by the view query given by the cache key?"
+    designname, viewname, key, last, kwargs = cache_key
+    if designname != "publication" or dict(kwargs).get("limit"):
+        return True
+    keys = _get_view_keys(viewname, doc)
+    if keys is None:
+        return True
+    if key is None:
+        return bool(keys)
+    if last is None:
+        return key in keys
+    low, high = min(key, last), max(key, last)
+    if high == low + constants.CEILING:  # Wildcard at end.
+        return any([k.startswith(low) for k in keys])
+    if high == constants.CEILING:
+        return any([low <= k for k in keys])
+    return any([low <= k <= high for k in keys])
+
+
+def _get_view_keys(viewname, doc):
+    """Return the keys emitted for the publication by the named view
+    in the 'publication' design document, or None if not known.
+    Must be kept consistent with the view definitions in 'database'.
+    """
+    published = doc.get("published")
+    if viewname == "published":
+        return [published] if published else []
+    elif viewname == "year":
+        return [published.split("-")[0]] if published else []
+    elif viewname == "first_published":
+        if not published:
+            return []
+        if doc.get("epublished"):
+            return [min(published, doc["epublished"])]
+        return [published]
+    elif viewname == "epublished":
+        return [doc["epublished"]] if doc.get("epublished") else []
+    elif viewname == "modified":
+        return [doc["modified"]] if doc.get("modified") else []
+    elif viewname == "label":
+        return [label.lower() for label in doc.get("labels") or {}]
+    elif viewname == "no_label":
+        return [] if doc.get("labels") else [doc.get("title") or ""]
+    elif viewname == "no_pmid":
+        return [] if doc.get("pmid") else [published or ""]
+    elif viewname == "no_doi":
+        return [] if doc.get("doi") else [published or ""]
+    elif viewname == "researcher":
+        return [
+            a["researcher"] for a in doc.get("authors") or [] if a.get("researcher")
+        ]
+    elif viewname == "issn":
+        journal = doc.get("journal") or {}
+        return [journal[k] for k in ("issn", "issn-l") if journal.get(k)]
+    elif viewname == "author":
+        result = []
+        for author in doc.get("authors") or []:
+            family = author.get("family_normalized")
+            if not family:
+                continue
+            result.append(family)
+            for part in ("initials_normalized", "given_normalized"):
+                if author.get(part):
+                    result.append(f"{family} {author[part]}")
+        return result
+    return None
 
 
 # Parser for the selection expression mini-language.
@@ -326,6 +620,8 @@ class Subset:
 class _Function:
     "Abstract function; name and value for argument."
 
+    keyword = None
+
     def __init__(self, tokens):
         try:
             self.value = tokens[1]
@@ -335,9 +631,33 @@ class _Function:
     def __repr__(self):
         return f"{self.__class__.__name__} ({self.value})"
 
+    def __str__(self):
+        return f"{self.keyword}({self.value or ''})"
+
     def evaluate(self, db, variables):
         raise NotImplementedError
 
+    def estimate(self, db, variables):
+        """Return the estimated number of publications selected,
+        or None if there is no cheap way to estimate it.
+        The selection itself must not be evaluated.
+        """
+        return None
+
+    def _get_count(self, db, viewname, key, prefix=False):
+        """Return the number of publications for the key in the view, from
+        the in-memory index, if in use, otherwise from the reduce of the view.
+        For a prefix, this is the number of matching keys, an upper bound.
+        """
+        index = publications.index.get_index()
+        if index is not None:
+            if prefix:
+                return index.get_prefix_count(viewname, key)
+            return index.get_count(viewname, key)
+        if prefix:
+            return _get_count(db, viewname, key, last=key + constants.CEILING)
+        return _get_count(db, viewname, key)
+
 
 class _Identifier(_Function):
     "Identifier for variable. Not really a function, but easiest this way."
@@ -345,56 +665,127 @@ class _Identifier(_Function):
     def __init__(self, tokens):
         self.value = tokens[0]
 
+    def __str__(self):
+        return self.value
+
     def evaluate(self, db, variables):
         try:
             return variables[self.value]
         except KeyError as error:
             raise ValueError(f"No such variable '{self.value}'.")
 
+    def estimate(self, db, variables):
+        return len(self.evaluate(db, variables))
+
 
 class _Label(_Function):
     "Publications selected by label."
 
+    keyword = "label"
+
     def evaluate(self, db, variables):
         return Subset(db, label=self.value)
 
+    def estimate(self, db, variables):
+        label = self.value.lower().strip()
+        if label.endswith("*"):
+            return self._get_count(db, "label", label[:-1], prefix=True)
+        return self._get_count(db, "label", label)
+
 
 class _Year(_Function):
     "Publications selected by 'published' year."
 
+    keyword = "year"
+
     def evaluate(self, db, variables):
         return Subset(db, year=self.value)
 
+    def estimate(self, db, variables):
+        return self._get_count(db, "year", self.value)
+
 
 class _Author(_Function):
     "Publications selected by author name, optionally with wildcard at end."
 
+    keyword = "author"
+
     def evaluate(self, db, variables):
         return Subset(db, author=self.value)
 
+    def estimate(self, db, variables):
+        name = utils.to_ascii(self.value).lower().strip()
+        if name.endswith("*"):
+            return self._get_count(db, "author", name[:-1], prefix=True)
+        return self._get_count(db, "author", name)
+
 
 class _Orcid(_Function):
     "Publications selected by researcher ORCID."
 
+    keyword = "orcid"
+
     def evaluate(self, db, variables):
         return Subset(db, orcid=self.value)
 
+    def estimate(self, db, variables):
+        try:
+            researcher = publications.database.get_doc(
+                db, "researcher", "orcid", self.value
+            )
+        except KeyError:
+            return 0
+        return self._get_count(db, "researcher", researcher["_id"])
+
 
 class _Issn(_Function):
     "Publications selected by journal ISSN."
 
+    keyword = "issn"
+
     def evaluate(self, db, variables):
         return Subset(db, issn=self.value)
 
+    def estimate(self, db, variables):
+        return self._get_count(db, "issn", self.value)
+
 
 class _Published(_Function):
     "Publications selected by 'published' after the given date, inclusive."
 
+    keyword = "published"
+
     def evaluate(self, db, variables):
         s = Subset(db)
         s.select_published(self.value)
         return s
 
+    def estimate(self, db, variables):
+        return _get_published_count(db, self.value)
+
+
+class _PublishedRange(_Function):
+    """Publications selected by 'published' within the given dates, inclusive.
+    Not in the grammar; produced by the planner from year and published.
+    """
+
+    keyword = "published"
+
+    def __init__(self, first, last):
+        self.value = first
+        self.last = last
+
+    def __str__(self):
+        return f"{self.keyword}({self.value}..{self.last})"
+
+    def evaluate(self, db, variables):
+        s = Subset(db)
+        s.select_published(self.value, last=self.last)
+        return s
+
+    def estimate(self, db, variables):
+        return _get_published_count(db, self.value, last=self.last)
+
 
 class _First(_Function):
     """Publications selected by first publication date
@@ -402,6 +793,8 @@ class _First(_Function):
     after the given date, inclusive.
     """
 
+    keyword = "first"
+
     def evaluate(self, db, variables):
         s = Subset(db)
         s.select_first_published(self.value)
@@ -411,6 +804,8 @@ class _First(_Function):
 class _Online(_Function):
     "Publications selected by 'epublished' after the given date, inclusive."
 
+    keyword = "online"
+
     def evaluate(self, db, variables):
         s = Subset(db)
         s.select_epublished(self.value)
@@ -420,6 +815,8 @@ class _Online(_Function):
 class _Modified(_Function):
     "Publications selected by modified after the given date, inclusive."
 
+    keyword = "modified"
+
     def evaluate(self, db, variables):
         s = Subset(db)
         s.select_modified(date=self.value)
@@ -429,6 +826,8 @@ class _Modified(_Function):
 class _Active(_Function):
     "Publications having at least on label active in the given year."
 
+    keyword = "active"
+
     def evaluate(self, db, variables):
         s = Subset(db)
         s.select_active_labels(self.value or "current")
@@ -438,6 +837,8 @@ class _Active(_Function):
 class _NoPmid(_Function):
     "Publications lacking PMID."
 
+    keyword = "no_pmid"
+
     def evaluate(self, db, variables):
         s = Subset(db)
         s.select_no_pmid()
@@ -447,6 +848,8 @@ class _NoPmid(_Function):
 class _NoDoi(_Function):
     "Publications lacking DOI."
 
+    keyword = "no_doi"
+
     def evaluate(self, db, variables):
         s = Subset(db)
         s.select_no_doi()
@@ -456,6 +859,8 @@ class _NoDoi(_Function):
 class _NoLabel(_Function):
     "Publications lacking Label."
 
+    keyword = "no_label"
+
     def evaluate(self, db, variables):
         s = Subset(db)
         s.select_no_label()
@@ -478,6 +883,9 @@ class _Union(_Operator):
     def evaluate(self, s1, s2):
         return s1 | s2
 
+    def get_plan(self, left, right):
+        return _PlanUnion(left, right)
+
 
 class _Symdifference(_Operator):
     "Symmetric difference of two subsets."
@@ -485,6 +893,9 @@ class _Symdifference(_Operator):
     def evaluate(self, s1, s2):
         return s1 ^ s2
 
+    def get_plan(self, left, right):
+        return _PlanSymdifference(left, right)
+
 
 class _Intersection(_Operator):
     "Intersection of two subsets."
@@ -492,6 +903,9 @@ class _Intersection(_Operator):
     def evaluate(self, s1, s2):
         return s1 & s2
 
+    def get_plan(self, left, right):
+        return _PlanIntersection(left, right)
+
 
 class _Difference(_Operator):
     "Difference of two subsets."
@@ -499,12 +913,15 @@ class _Difference(_Operator):
     def evaluate(self, s1, s2):
         return s1 - s2
 
+    def get_plan(self, left, right):
+        return _PlanDifference(left, right)
+
 
 class _Expression:
     "Expression; one subset, or two subsets with an operator."
 
     def __init__(self, tokens):
-        self.stack = list(tokens)
+        self.stack = tuple(tokens)
 
     def __repr__(self):
         items = []
@@ -517,45 +934,376 @@ class _Expression:
 
     def evaluate(self, db, variables=None):
         "Evaluate the expression and return the resulting subset."
-        self.stack.reverse()  # Left-to-right evaluation.
         if variables is None:
             variables = {}
-        while len(self.stack) >= 3:
-            s2 = self.stack.pop()
-            op = self.stack.pop()
-            s1 = self.stack.pop()
-            if isinstance(s1, pp.ParseResults):
-                s1 = s1[0].evaluate(db, variables=variables)
-            elif isinstance(s1, _Function):
-                s1 = s1.evaluate(db, variables)
-            if isinstance(s2, pp.ParseResults):
-                s2 = s2[0].evaluate(db, variables=variables)
-            elif isinstance(s2, _Function):
-                s2 = s2.evaluate(db, variables)
-            self.stack.append(op.evaluate(s1, s2))
-        if len(self.stack) != 1:
+        plan = self.get_plan().optimize(db, variables)
+        return plan.evaluate(db, variables)
+
+    def get_plan(self):
+        """Return the unoptimized evaluation plan for the expression.
+        Operators are applied left-to-right. The expression is not modified.
+        """
+        if len(self.stack) % 2 != 1:
             raise ValueError(f"invalid stack {self.stack}")
-        if isinstance(self.stack[0], _Function):
-            return self.stack[0].evaluate(db, variables)
-        elif isinstance(self.stack[0], pp.ParseResults):
-            return self.stack[0][0].evaluate(db, variables=variables)
+        plan = _get_plan(self.stack[0])
+        for pos in range(1, len(self.stack), 2):
+            plan = self.stack[pos].get_plan(plan, _get_plan(self.stack[pos + 1]))
+        return plan
+
+
+def _get_plan(item):
+    "Return the plan for the item in an expression stack."
+    if isinstance(item, pp.ParseResults):
+        return item[0].get_plan()
+    elif isinstance(item, _Function):
+        return _PlanLeaf(item)
+    else:
+        raise ValueError(f"invalid expression item {item!r}")
+
+
+# Planner for the evaluation of selection expressions.
+
+
+class _Plan:
+    "Abstract node in the evaluation plan of a selection expression."
+
+    name = None
+
+    def __init__(self):
+        self.estimated = None  # Estimated number of publications, if known.
+        self.actual = None  # Actual number of publications, when evaluated.
+        self.note = None
+
+    def optimize(self, db, variables, estimate=False):
+        """Return the optimized plan for this node.
+        If 'estimate' is true, then compute the estimated number of
+        publications, if possible.
+        """
+        return self
+
+    def evaluate(self, db, variables):
+        "Evaluate the plan and return the resulting subset."
+        result = self._evaluate(db, variables)
+        self.actual = len(result)
+        return result
+
+    def _evaluate(self, db, variables):
+        raise NotImplementedError
+
+    def explain(self, depth=0):
+        """Return the list of steps in the plan, each a dictionary
+        with the depth, description, estimated and actual number of
+        publications, and a note.
+        """
+        return [
+            dict(
+                depth=depth,
+                step=self.name,
+                estimated=self.estimated,
+                actual=self.actual,
+                note=self.note,
+            )
+        ]
+
+
+class _PlanLeaf(_Plan):
+    "Evaluate a function."
+
+    def __init__(self, function):
+        super().__init__()
+        self.function = function
+
+    @property
+    def name(self):
+        return str(self.function)
+
+    def optimize(self, db, variables, estimate=False):
+        if estimate:
+            self.estimated = self.function.estimate(db, variables)
+        return self
+
+    def _evaluate(self, db, variables):
+        return self.function.evaluate(db, variables)
+
+
+class _PlanEmpty(_Plan):
+    "The empty subset, without any database access."
+
+    name = "empty"
+
+    def __init__(self, note):
+        super().__init__()
+        self.estimated = 0
+        self.note = note
+
+    def _evaluate(self, db, variables):
+        return Subset(db)
+
+
+class _PlanOperation(_Plan):
+    "Abstract operation on the subsets of a sequence of child nodes."
+
+    def __init__(self, left, right):
+        super().__init__()
+        self.children = [left, right]
+
+    def optimize(self, db, variables, estimate=False):
+        self.children = [c.optimize(db, variables, estimate) for c in self.children]
+        return self
+
+    def explain(self, depth=0):
+        result = super().explain(depth)
+        for child in self.children:
+            result.extend(child.explain(depth + 1))
+        return result
+
+    def _skip(self, children):
+        "Mark the child nodes as skipped, since the result is already empty."
+        for child in children:
+            child.note = "skipped; empty intermediate result"
+
+
+class _PlanAssociative(_PlanOperation):
+    """Abstract associative and commutative operation.
+    Nested nodes of the same operation are flattened.
+    """
+
+    def __init__(self, left, right):
+        super().__init__(left, right)
+        self.children = []
+        for child in (left, right):
+            if type(child) is type(self):
+                self.children.extend(child.children)
+            else:
+                self.children.append(child)
+
+    def _sum_estimates(self):
+        "Return the sum of the estimates of the child nodes, if all known."
+        estimates = [c.estimated for c in self.children]
+        if None in estimates:
+            return None
+        return sum(estimates)
+
+
+class _PlanUnion(_PlanAssociative):
+    "Union of the subsets of the child nodes."
+
+    name = "union (+)"
+
+    def optimize(self, db, variables, estimate=False):
+        super().optimize(db, variables, estimate)
+        self.estimated = self._sum_estimates()
+        return self
+
+    def _evaluate(self, db, variables):
+        return functools.reduce(
+            lambda s, t: s | t, [c.evaluate(db, variables) for c in self.children]
+        )
+
+
+class _PlanSymdifference(_PlanAssociative):
+    "Symmetric difference of the subsets of the child nodes."
+
+    name = "symmetric difference (^)"
+
+    def optimize(self, db, variables, estimate=False):
+        super().optimize(db, variables, estimate)
+        self.estimated = self._sum_estimates()
+        return self
+
+    def _evaluate(self, db, variables):
+        return functools.reduce(
+            lambda s, t: s ^ t, [c.evaluate(db, variables) for c in self.children]
+        )
+
+
+class _PlanIntersection(_PlanAssociative):
+    """Intersection of the subsets of the child nodes.
+    The most selective child node is evaluated first, and the evaluation
+    stops as soon as the intermediate result is empty.
+    """
+
+    name = "intersection (#)"
+
+    def optimize(self, db, variables, estimate=False):
+        plan = self._push_down_published()
+        if plan is not self:
+            return plan
+        # The estimates are needed to order the child nodes.
+        super().optimize(db, variables, estimate=True)
+        if len(self.children) == 1:
+            return self.children[0]
+        # Stable sort; unknown estimates go last, in the original order.
+        self.children.sort(key=lambda c: (c.estimated is None, c.estimated or 0))
+        estimates = [c.estimated for c in self.children if c.estimated is not None]
+        if estimates:
+            self.estimated = min(estimates)
+        return self
+
+    def _push_down_published(self):
+        """Merge the year and published functions among the child nodes
+        into one single key range query of the 'published' view.
+        Return an empty plan if the intersection is certain to be empty.
+        The values are used as given, as when evaluating the functions.
+        Only a proper year is the same as a range of 'published' dates.
+        """
+        years = set()
+        dates = []
+        merged = []
+        for child in self.children:
+            if not isinstance(child, _PlanLeaf):
+                continue
+            value = child.function.value
+            if isinstance(child.function, _Year):
+                if not (len(value) == 4 and value.isdigit()):
+                    continue
+                years.add(value)
+            elif isinstance(child.function, _Published):
+                dates.append(value)
+            else:
+                continue
+            merged.append(child)
+        if len(merged) < 2:
+            return self
+        names = ", ".join([c.name for c in merged])
+        if len(years) > 1:
+            return _PlanEmpty(f"different years: {names}")
+        if years:
+            year = years.pop()
+            first = max(dates + [year])
+            last = year + constants.CEILING
         else:
-            return self.stack[0]
+            first = max(dates)
+            last = constants.CEILING
+        if first > last:
+            return _PlanEmpty(f"disjoint dates: {names}")
+        leaf = _PlanLeaf(_PublishedRange(first, last))
+        leaf.note = f"pushed down: {names}"
+        self.children = [c for c in self.children if c not in merged] + [leaf]
+        return self
+
+    def _evaluate(self, db, variables):
+        result = self.children[0].evaluate(db, variables)
+        for pos, child in enumerate(self.children[1:], 1):
+            if len(result) == 0:
+                self._skip(self.children[pos:])
+                break
+            result = result & child.evaluate(db, variables)
+        return result
+
+
+class _PlanDifference(_PlanOperation):
+    """Difference between the subset of the first child node and the others.
+    The evaluation stops as soon as the intermediate result is empty.
+    """
+
+    name = "difference (-)"
+
+    def __init__(self, left, right):
+        super().__init__(left, right)
+        # Left-to-right evaluation: (A - B) - C is A - B - C.
+        if type(left) is type(self):
+            self.children = left.children + [right]
+
+    def optimize(self, db, variables, estimate=False):
+        super().optimize(db, variables, estimate)
+        first = self.children[0]
+        if isinstance(first, _PlanEmpty):
+            return first
+        self.estimated = first.estimated
+        return self
+
+    def _evaluate(self, db, variables):
+        result = self.children[0].evaluate(db, variables)
+        for pos, child in enumerate(self.children[1:], 1):
+            if len(result) == 0:
+                self._skip(self.children[pos:])
+                break
+            result = result - child.evaluate(db, variables)
+        return result
+
+
+def get_plan(db, expression, variables=None, explain=False):
+    """Return the optimized evaluation plan for the selection expression.
+    If 'explain' is true, then estimate the number of publications
+    for all nodes in the plan, not only those where it is needed.
+    Raise ValueError if the expression is invalid.
+    """
+    if variables is None:
+        variables = {}
+    plan = parse_expression(expression).get_plan()
+    return plan.optimize(db, variables, estimate=explain)
 
 
 def get_subset(db, expression, variables=None):
     "Return the subset resulting from the selection expression evaluation."
     if not expression:
         return Subset(db)
-    parser = get_parser()
+    if variables is None:
+        variables = {}
+    return get_plan(db, expression, variables).evaluate(db, variables)
+
+
+_parsers = {}  # Key: value of TEMPORAL_LABELS, value: parser.
+_parser_lock = threading.Lock()
+_expression_cache = None
+
+
+def parse_expression(expression):
+    """Return the parsed selection expression, from the cache if possible.
+    The parsed expression is never modified, so it may be evaluated
+    any number of times.
+    Raise ValueError if the expression is invalid.
+    """
+    expression = normalize_expression(expression)
+    key = (bool(settings["TEMPORAL_LABELS"]), expression)
+    cache = get_expression_cache()
     try:
-        result = parser.parse_string(expression, parse_all=True)
-    except pp.ParseException as error:
-        raise ValueError(str(error))
-    return result[0].evaluate(db, variables=variables)
+        return cache.get(key)
+    except KeyError:
+        pass
+    parser = get_parser()
+    with _parser_lock:
+        try:
+            result = parser.parse_string(expression, parse_all=True)[0]
+        except pp.ParseException as error:
+            raise ValueError(str(error))
+    cache.put(key, result)
+    return result
+
+
+def normalize_expression(expression):
+    "Return the expression with surrounding whitespace and line ends normalized."
+    return "\n".join(expression.strip().splitlines())
+
+
+def get_expression_cache():
+    "Return the cache of parsed expressions, creating it if necessary."
+    global _expression_cache
+    if _expression_cache is None:
+        _expression_cache = utils.LruCache(settings["SUBSET_EXPRESSION_CACHE_SIZE"])
+    return _expression_cache
+
+
+def get_expression_cache_stats():
+    "Return the usage statistics of the cache of parsed expressions."
+    return get_expression_cache().get_stats()
 
 
 def get_parser():
+    """Return the parser for the current TEMPORAL_LABELS setting.
+    It is created only once for each value of the setting.
+    """
+    temporal_labels = bool(settings["TEMPORAL_LABELS"])
+    with _parser_lock:
+        try:
+            return _parsers[temporal_labels]
+        except KeyError:
+            _parsers[temporal_labels] = create_parser(temporal_labels)
+            return _parsers[temporal_labels]
+
+
+def create_parser(temporal_labels):
     "Construct and return the parser."
 
     left = pp.Suppress("(")
@@ -594,7 +1342,7 @@ def get_parser():
         | no_label
     )
 
-    if settings["TEMPORAL_LABELS"]:
+    if temporal_labels:
         current = (pp.Keyword("active") + left + right).set_parse_action(_Active)
         active = (pp.Keyword("active") + left + value + right).set_parse_action(_Active)
         function = function | current | active
@@ -1,10 +1,12 @@
 "Various utility functions."
 
+import collections
 import datetime
 import email.message
 import hashlib
 import smtplib
 import string
+import threading
 import uuid
 import unicodedata
 
@@ -171,6 +173,60 @@ def get_formatted_authors(authors, complete=False):
     return ", ".join(result)
 
 
+class LruCache:
+    "Thread-safe cache of limited size; the least recently used item is evicted."
+
+    def __init__(self, size=256):
+        self.size = size
+        self.lock = threading.RLock()
+        self.items = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        "Return the cached value for the key. Raise KeyError if not cached."
+        with self.lock:
+            try:
+                value = self.items[key]
+            except KeyError:
+                self.misses += 1
+                raise
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        "Cache the value for the key, evicting the least recently used item."
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def pop(self, key):
+        "Remove the item for the key, if cached."
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        "Remove all items."
+        with self.lock:
+            self.items.clear()
+
+    def get_stats(self):
+        "Return the current size and usage counters of the cache."
+        with self.lock:
+            return dict(
+                size=self.size,
+                items=len(self.items),
+                hits=self.hits,
+                misses=self.misses,
+            )
+
+
 class EmailServer:
     "A connection to an email server for sending emails."
 
@@ -0,0 +1,240 @@
+"""Shared keep-alive HTTP sessions for external web services,
+i.e. PubMed and Crossref.
+
+Each service has one session with a connection pool, retries with
+exponential backoff and jitter on timeouts and 429/5xx responses,
+and a circuit breaker that fails fast while the service is degraded.
+The asynchronous requests are not native; the blocking requests are
+performed on a bounded thread pool of each service.
+"""
+
+import concurrent.futures
+import email.utils
+import random
+import threading
+import time
+
+import requests
+import requests.adapters
+import tornado.ioloop
+
+POOL_SIZE = 10  # Max number of keep-alive connections and threads per service.
+MAX_RETRIES = 3  # Number of retries after the first attempt.
+BACKOFF = 0.5  # Base backoff (seconds); doubled for each retry.
+MAX_BACKOFF = 30.0  # Max backoff (seconds); also max honored 'Retry-After'.
+FAILURE_THRESHOLD = 5  # Number of consecutive failures that opens the breaker.
+RESET_TIMEOUT = 60.0  # Time (seconds) the breaker stays open before a trial.
+
+RETRY_STATUS = frozenset([429, 500, 502, 503, 504])
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_service(name):
+    "Get the service of the given name; create it if not already done."
+    with _services_lock:
+        try:
+            return _services[name]
+        except KeyError:
+            _services[name] = service = Service(name)
+            return service
+
+
+def get_services_stats():
+    "Return a dictionary of the current counters for each service."
+    with _services_lock:
+        services = list(_services.values())
+    return dict([(s.name, s.get_stats()) for s in services])
+
+
+class Service:
+    """Thread-safe keep-alive HTTP session for an external web service,
+    with retries, backoff and circuit breaker.
+    """
+
+    def __init__(
+        self,
+        name,
+        pool_size=POOL_SIZE,
+        max_retries=MAX_RETRIES,
+        backoff=BACKOFF,
+        max_backoff=MAX_BACKOFF,
+        failure_threshold=FAILURE_THRESHOLD,
+        reset_timeout=RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Threads for 'get_async'; bounded, so that a slow service cannot
+        # take all threads of the default executor of the IOLoop.
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix=f"{name}-request"
+        )
+        self.limiter = None  # Rate limiter, if any; see 'publications.ratelimit'.
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.opened = None  # Monotonic time when the breaker was opened.
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def get(self, url, timeout=None, headers=None):
+        """Perform a GET request for the URL, retrying on timeouts and
+        429/5xx responses. Each attempt waits for the rate limiter, if any.
+        Return the response, which may have any status.
+        Raise IOError if timeout or no connection after all retries,
+        if the request failed otherwise, or if the circuit breaker is open.
+        """
+        self.check_breaker()
+        try:
+            for attempt in range(self.max_retries + 1):
+                if self.limiter:
+                    self.limiter.acquire()
+                start = time.monotonic()
+                try:
+                    response = self.session.get(url, timeout=timeout, headers=headers)
+                except (
+                    requests.exceptions.Timeout,
+                    requests.exceptions.ConnectionError,
+                ):
+                    response = None
+                except requests.exceptions.RequestException as error:
+                    self.record_latency(time.monotonic() - start)
+                    raise IOError(f"{self.name} request failed: {error}")
+                self.record_latency(time.monotonic() - start)
+                if response is not None and response.status_code not in RETRY_STATUS:
+                    self.record_success()
+                    return response
+                if attempt == self.max_retries:
+                    break
+                wait = self.get_backoff(attempt, response)
+                if wait is None:
+                    break
+                with self.lock:
+                    self.retries += 1
+                time.sleep(wait)
+        except Exception:
+            # Any failure must be recorded, else a half-open breaker stays so.
+            self.record_failure()
+            raise
+        self.record_failure()
+        if response is None:
+            raise IOError("timeout")
+        return response
+
+    async def get_async(self, url, timeout=None, headers=None):
+        """Asynchronous version of 'get', for use within the Tornado IOLoop.
+        This is not a native asynchronous client: the blocking request is
+        performed in a thread of the bounded pool of this service, using
+        the shared session. Requests beyond the pool size wait for a thread.
+        """
+        return await tornado.ioloop.IOLoop.current().run_in_executor(
+            self.executor, self.get, url, timeout, headers
+        )
+
+    def get_backoff(self, attempt, response=None):
+        """Get the time (seconds) to wait before the next attempt.
+        Exponential backoff with full jitter, unless the response gives
+        'Retry-After'. Return None if that is longer than the max backoff.
+        """
+        if response is not None:
+            retry_after = get_retry_after(response.headers)
+            if retry_after is not None:
+                if retry_after > self.max_backoff:
+                    return None
+                return retry_after
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def check_breaker(self):
+        """Raise IOError if the circuit breaker is open.
+        After the reset timeout, let one trial request through.
+        """
+        with self.lock:
+            if self.state == CLOSED:
+                return
+            if (
+                self.state == OPEN
+                and time.monotonic() - self.opened >= self.reset_timeout
+            ):
+                self.state = HALF_OPEN
+                return
+            self.rejected += 1
+        raise IOError(f"{self.name} unavailable; circuit breaker open")
+
+    def record_latency(self, latency):
+        "Record the latency (seconds) of a request."
+        with self.lock:
+            self.requests += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def record_success(self):
+        "Record a successful request; closes the breaker."
+        with self.lock:
+            self.consecutive_failures = 0
+            self.state = CLOSED
+            self.opened = None
+
+    def record_failure(self):
+        "Record a failed request; may open the breaker."
+        with self.lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if (
+                self.state == HALF_OPEN
+                or self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = OPEN
+                self.opened = time.monotonic()
+
+    def get_stats(self):
+        "Return a dictionary of the current counters for the service."
+        limiter = self.limiter.get_stats() if self.limiter else None
+        with self.lock:
+            return dict(
+                limiter=limiter,
+                state=self.state,
+                requests=self.requests,
+                retries=self.retries,
+                failures=self.failures,
+                consecutive_failures=self.consecutive_failures,
+                rejected=self.rejected,
+                mean_latency=round(self.total_latency / (self.requests or 1), 3),
+                max_latency=round(self.max_latency, 3),
+            )
+
+
+def get_retry_after(headers):
+    """Get the 'Retry-After' header value as seconds, if any.
+    It is either a number of seconds or an HTTP date.
+    """
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
@@ -1,7 +1,9 @@
 "Write a set of publications to a file."
 
+import codecs
 import csv
 import io
+import tempfile
 
 import xlsxwriter
 
@@ -9,6 +11,10 @@ from publications import constants
 from publications import settings
 from publications import utils
 
+import publications.database
+
+CONTENT_CHUNK_SIZE = 65536  # Bytes per chunk when streaming file contents.
+
 
 class Writer:
     "Abstract writer of publications to a file."
@@ -20,9 +26,12 @@ class Writer:
         none=csv.QUOTE_NONE,
     )
 
-    def __init__(self, db, app, **kwargs):
+    def __init__(self, db, app, outfile=None, **kwargs):
         self.db = db
         self.app = app
+        # Binary file-like object to stream the output to, if any.
+        # Otherwise the output is kept in memory; see 'get_content'.
+        self.outfile = outfile
         self.parameters = {
             "all_authors": False,
             "issn": False,
@@ -39,6 +48,15 @@ class Writer:
         self.parameters["quoting"] = self._QUOTING.get(
             self.parameters["quoting"].lower(), csv.QUOTE_NONNUMERIC
         )
+        # A single incremental encoder for the streamed output, so that
+        # any byte order mark (e.g. utf-16, utf-8-sig) is written only once.
+        # An unknown encoding is rejected here, before any output is written.
+        try:
+            self.encoder = codecs.getincrementalencoder(self.parameters["encoding"])(
+                "backslashreplace"
+            )
+        except LookupError:
+            raise ValueError(f"Unknown encoding '{self.parameters['encoding']}'.")
 
     def absolute_reverse_url(self, name, *args, **query):
         if name is None:
@@ -47,10 +65,34 @@ class Writer:
             path = self.app.reverse_url(name, *args, **query)
         return settings["BASE_URL"].rstrip("/") + path
 
-    def write(self, publications):
+    def write(self, publs):
         "Write the set of publications given the parameters."
+        self.write_start()
+        for publication in publs:
+            self.write_publication(publication)
+        self.write_end()
+
+    def write_start(self):
+        "Write the start of the file, if anything."
+        pass
+
+    def write_publication(self, publication):
+        "Write the publication."
         raise NotImplementedError
 
+    def write_end(self):
+        "Write the end of the file, if anything."
+        if self.outfile is not None:
+            content = self.encoder.encode("", True)
+            if content:
+                self.outfile.write(content)
+
+    def write_output(self, text):
+        "Encode the text and write it to the output file."
+        content = self.encoder.encode(text)
+        if content:
+            self.outfile.write(content)
+
     def get_content(self):
         "Get the file contents as bytes."
         raise NotImplementedError
@@ -59,18 +101,16 @@ class Writer:
 class TabularWriter(Writer):
     "Abstract writer of publications to a tabular file."
 
-    def write(self, publications):
-        "Write the set of publications given the parameters."
+    def write_start(self):
+        "Write the header row."
         row = ["Title", "Authors", "Journal"]
         if self.parameters["issn"]:
-            self.issn_l_map = dict(
-                [(r.value, r.key) for r in self.db.view("journal", "issn_l")]
-            )
+            self.journal_registry = publications.database.get_journal_registry(self.db)
             row.append("ISSN")
             row.append("ISSN-L")
-            label_pos = 13
+            self.label_pos = 13
         else:
-            label_pos = 11
+            self.label_pos = 11
         row.extend(
             [
                 "Year",
@@ -90,57 +130,61 @@ class TabularWriter(Writer):
             ]
         )
         self.write_header(row)
-        complete = self.parameters["all_authors"]
-        for publication in publications:
-            year = publication.get("published")
-            if year:
-                year = year.split("-")[0]
-            journal = publication.get("journal") or {}
-            pmid = publication.get("pmid")
-            if pmid:
-                pubmed_url = constants.PUBMED_URL % pmid
-            else:
-                pubmed_url = ""
-            doi_url = publication.get("doi")
-            if doi_url:
-                doi_url = constants.DOI_URL % doi_url
-            row = [
-                publication.get("title"),
-                utils.get_formatted_authors(publication["authors"], complete=complete),
-                journal.get("title"),
+
+    def write_publication(self, publication):
+        "Write the row(s) for the publication."
+        label_pos = self.label_pos
+        year = publication.get("published")
+        if year:
+            year = year.split("-")[0]
+        journal = publication.get("journal") or {}
+        pmid = publication.get("pmid")
+        if pmid:
+            pubmed_url = constants.PUBMED_URL % pmid
+        else:
+            pubmed_url = ""
+        doi_url = publication.get("doi")
+        if doi_url:
+            doi_url = constants.DOI_URL % doi_url
+        row = [
+            publication.get("title"),
+            utils.get_formatted_authors(
+                publication["authors"], complete=self.parameters["all_authors"]
+            ),
+            journal.get("title"),
+        ]
+        if self.parameters["issn"]:
+            row.append(journal.get("issn"))
+            row.append(self.journal_registry.get_issn_l(journal.get("issn")))
+        row.extend(
+            [
+                year,
+                publication.get("published"),
+                publication.get("epublished"),
+                journal.get("volume"),
+                journal.get("issue"),
+                journal.get("pages"),
+                publication.get("doi"),
+                publication.get("pmid"),
+                "",  # label_pos, see above; fixed below
+                "",  # label_pos+1, see above; fixed below
+                publication["_id"],
+                self.absolute_reverse_url("publication", publication["_id"]),
+                doi_url,
+                pubmed_url,
             ]
-            if self.parameters["issn"]:
-                row.append(journal.get("issn"))
-                row.append(self.issn_l_map.get(journal.get("issn")))
-            row.extend(
-                [
-                    year,
-                    publication.get("published"),
-                    publication.get("epublished"),
-                    journal.get("volume"),
-                    journal.get("issue"),
-                    journal.get("pages"),
-                    publication.get("doi"),
-                    publication.get("pmid"),
-                    "",  # label_pos, see above; fixed below
-                    "",  # label_pos+1, see above; fixed below
-                    publication["_id"],
-                    self.absolute_reverse_url("publication", publication["_id"]),
-                    doi_url,
-                    pubmed_url,
-                ]
-            )
-            # Labels to output: single per row, or concatenated.
-            labels = sorted(list(publication.get("labels", {}).items()))
-            if self.parameters["single_label"]:
-                for label, qualifier in labels:
-                    row[label_pos] = label
-                    row[label_pos + 1] = qualifier
-                    self.write_row(row)
-            else:
-                row[label_pos] = "|".join([l[0] for l in labels])
-                row[label_pos + 1] = "|".join([l[1] or "" for l in labels])
+        )
+        # Labels to output: single per row, or concatenated.
+        labels = sorted(list(publication.get("labels", {}).items()))
+        if self.parameters["single_label"]:
+            for label, qualifier in labels:
+                row[label_pos] = label
+                row[label_pos + 1] = qualifier
                 self.write_row(row)
+        else:
+            row[label_pos] = "|".join([l[0] for l in labels])
+            row[label_pos + 1] = "|".join([l[1] or "" for l in labels])
+            self.write_row(row)
 
     def write_header(self, row):
         "Write the header row."
@@ -183,6 +227,10 @@ class CsvWriter(TabularWriter):
                     value = value[1:]
                 row[pos] = value
         self.writer.writerow(row)
+        if self.outfile is not None:
+            self.write_output(self.csvbuffer.getvalue())
+            self.csvbuffer.seek(0)
+            self.csvbuffer.truncate()
 
     def get_content(self):
         content = self.csvbuffer.getvalue()
@@ -194,9 +242,35 @@ class XlsxWriter(TabularWriter):
 
     def __init__(self, db, app, **kwargs):
         super().__init__(db, app, **kwargs)
-        self.xlsxbuffer = io.BytesIO()
-        self.workbook = xlsxwriter.Workbook(self.xlsxbuffer, {"in_memory": True})
+        self.constant_memory = False
+        self.xlsxfile = None
+
+    def write(self, publs):
+        """Write the set of publications given the parameters.
+        If there are more than XLSX_CONSTANT_MEMORY_THRESHOLD publications,
+        or the number is not known, the rows are written one by one to
+        a temporary file, instead of keeping the whole workbook in memory.
+        """
+        try:
+            count = len(publs)
+        except TypeError:
+            count = None
+        self.constant_memory = (
+            count is None or count > settings["XLSX_CONSTANT_MEMORY_THRESHOLD"]
+        )
+        super().write(publs)
+
+    def write_start(self):
+        "Create the workbook, and write the header row."
+        if self.constant_memory:
+            self.xlsxfile = tempfile.TemporaryFile()
+            options = {"constant_memory": True}
+        else:
+            self.xlsxfile = io.BytesIO()
+            options = {"in_memory": True}
+        self.workbook = xlsxwriter.Workbook(self.xlsxfile, options)
         self.ws = self.workbook.add_worksheet("Publications")
+        super().write_start()
 
     def write_header(self, row):
         "Write the header row."
@@ -218,6 +292,10 @@ class XlsxWriter(TabularWriter):
         self.x = 0
         self.write_row(row)
 
+    def write_end(self):
+        "Close the workbook, which writes the file contents."
+        self.workbook.close()
+
     def write_row(self, row):
         "Write a row of values."
         for y, item in enumerate(row):
@@ -229,53 +307,80 @@ class XlsxWriter(TabularWriter):
 
     def get_content(self):
         "Get the file contents as bytes."
-        self.workbook.close()
-        self.xlsxbuffer.seek(0)
-        return self.xlsxbuffer.getvalue()
+        return b"".join(self.iter_content())
+
+    def iter_content(self, chunk_size=CONTENT_CHUNK_SIZE):
+        """Return an iterator over the file contents as chunks of bytes.
+        The temporary file, if any, is removed when done.
+        """
+        self.xlsxfile.seek(0)
+        try:
+            while True:
+                chunk = self.xlsxfile.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        """Close the output, removing the temporary file, if any.
+        The file contents are not available after this.
+        """
+        if self.xlsxfile is not None:
+            self.xlsxfile.close()
 
 
 class TextWriter(Writer):
     "Write publications to a text file."
 
-    def write(self, publications):
-        "Write the set of publications given the parameters."
+    def __init__(self, db, app, outfile=None, **kwargs):
+        super().__init__(db, app, outfile=outfile, **kwargs)
         self.text = io.StringIO()
-        for number, publication in enumerate(publications, 1):
-            if self.parameters["numbered"]:
-                self.line = f"{number}."
-                self.parameters["indent"] = " " * (len(self.line) + 1)
-            else:
-                self.line = ""
-                self.parameters["indent"] = ""
-            authors = utils.get_formatted_authors(
-                publication["authors"], complete=self.parameters["all_authors"]
-            )
-            self.write_fragment(authors, comma=False)
-            self.write_fragment(f'"{publication.get("title")}"')
-            journal = publication.get("journal") or {}
-            self.write_fragment(journal.get("title") or "")
-            year = publication.get("published")
-            if year:
-                year = year.split("-")[0]
-            self.write_fragment(year)
-            if journal.get("volume"):
-                self.write_fragment(journal["volume"])
-            if journal.get("issue"):
-                self.write_fragment(f"({journal['issue']})", comma=False)
-            if journal.get("pages"):
-                self.write_fragment(journal["pages"])
-            if self.parameters["doi_url"]:
-                doi_url = publication.get("doi")
-                if doi_url:
-                    self.write_fragment(constants.DOI_URL % doi_url)
-            if self.parameters["pmid_url"]:
-                pmid_url = publication.get("pmid")
-                if pmid_url:
-                    self.write_fragment(constants.PUBMED_URL % pmid_url)
-            if self.line:
-                self.text.write(self.line)
-                self.text.write("\n")
+        self.number = 0
+
+    def write_publication(self, publication):
+        "Write the reference for the publication."
+        self.number += 1
+        if self.parameters["numbered"]:
+            self.line = f"{self.number}."
+            self.parameters["indent"] = " " * (len(self.line) + 1)
+        else:
+            self.line = ""
+            self.parameters["indent"] = ""
+        authors = utils.get_formatted_authors(
+            publication["authors"], complete=self.parameters["all_authors"]
+        )
+        self.write_fragment(authors, comma=False)
+        self.write_fragment(f'"{publication.get("title")}"')
+        journal = publication.get("journal") or {}
+        self.write_fragment(journal.get("title") or "")
+        year = publication.get("published")
+        if year:
+            year = year.split("-")[0]
+        self.write_fragment(year)
+        if journal.get("volume"):
+            self.write_fragment(journal["volume"])
+        if journal.get("issue"):
+            self.write_fragment(f"({journal['issue']})", comma=False)
+        if journal.get("pages"):
+            self.write_fragment(journal["pages"])
+        if self.parameters["doi_url"]:
+            doi_url = publication.get("doi")
+            if doi_url:
+                self.write_fragment(constants.DOI_URL % doi_url)
+        if self.parameters["pmid_url"]:
+            pmid_url = publication.get("pmid")
+            if pmid_url:
+                self.write_fragment(constants.PUBMED_URL % pmid_url)
+        if self.line:
+            self.text.write(self.line)
             self.text.write("\n")
+        self.text.write("\n")
+        if self.outfile is not None:
+            self.write_output(self.text.getvalue())
+            self.text.seek(0)
+            self.text.truncate()
 
     def write_fragment(self, fragment, comma=True):
         "Write the given fragment to the line."
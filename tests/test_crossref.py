@@ -0,0 +1,148 @@
+"""Test the parsing of Crossref works filter query results for many DOIs.
+
+These tests need no network access. Run them from the top directory
+of the repository:
+$ python -m pytest tests/test_crossref.py
+"""
+
+import urllib.parse
+
+import pytest
+
+from publications import crossref
+
+
+def get_item(doi, title=True):
+    "Return the JSON for a work; without a title it cannot be parsed."
+    result = {
+        "DOI": doi,
+        "container-title": ["Journal of Tests"],
+        "ISSN": ["1234-5678"],
+        "volume": "7",
+        "page": "11-19",
+        "type": "journal-article",
+        "published-print": {"date-parts": [[2020, 5, 17]]},
+        "author": [{"family": "Svensson", "given": "Anna B."}],
+    }
+    if title:
+        result["title"] = [f"Work <i>{doi}</i>"]
+    return result
+
+
+def get_works(items, cursor=None):
+    "Return the JSON for a works filter query result page."
+    return {"message": {"items": items, "next-cursor": cursor}}
+
+
+def test_parse_works():
+    "Each item is parsed and keyed by the DOI as given, in any case."
+    result = {}
+    data = get_works([get_item("10.1000/ABC"), get_item("10.1000/def")])
+    cursor = crossref.parse_works(data, ["10.1000/abc", "10.1000/def"], result)
+    assert cursor is None
+    assert sorted(result) == ["10.1000/abc", "10.1000/def"]
+    publication = result["10.1000/def"]
+    assert publication["title"] == "Work 10.1000/def"
+    assert publication["published"] == "2020-05-17"
+    assert publication["journal"]["issn"] == "1234-5678"
+    assert publication["authors"][0]["initials"] == "AB"
+
+
+def test_parse_works_same_as_parse():
+    "The result for an item is the same as when fetched on its own."
+    result = {}
+    crossref.parse_works(get_works([get_item("10.1000/abc")]), ["10.1000/abc"], result)
+    assert result["10.1000/abc"] == crossref.parse({"message": get_item("10.1000/abc")})
+
+
+def test_parse_works_skips_invalid():
+    "Items that cannot be parsed, or were not asked for, are skipped."
+    result = {}
+    items = [
+        get_item("10.1000/abc", title=False),
+        get_item("10.1000/other"),
+        get_item("10.1000/def"),
+    ]
+    dois = ["10.1000/abc", "10.1000/def"]
+    crossref.parse_works(get_works(items, cursor="next"), dois, result)
+    assert list(result) == ["10.1000/def"]
+
+
+def test_parse_works_cursor():
+    "The cursor is given only while DOIs remain and there are items."
+    dois = ["10.1000/abc", "10.1000/def"]
+    result = {}
+    data = get_works([get_item("10.1000/abc")], cursor="next")
+    assert crossref.parse_works(data, dois, result) == "next"
+    data = get_works([get_item("10.1000/def")], cursor="last")
+    assert crossref.parse_works(data, dois, result) is None
+    assert crossref.parse_works(get_works([], cursor="x"), ["10.1000/x"], {}) is None
+
+
+def test_parse_works_file_cache(tmp_path):
+    "Each item is stored separately, and can then be read on its own."
+    result = {}
+    data = get_works([get_item("10.1000/abc")])
+    crossref.parse_works(data, ["10.1000/abc"], result, dirname=str(tmp_path))
+    assert crossref.read_many(str(tmp_path), ["10.1000/abc", "10.1000/x"]) == (
+        result,
+        ["10.1000/x"],
+    )
+
+
+class Response:
+    "Replacement for the HTTP response of a works filter query."
+
+    def __init__(self, data):
+        self.data = data
+        self.headers = {}
+
+    def json(self):
+        return self.data
+
+
+@pytest.fixture
+def works(monkeypatch):
+    """Replace the HTTP request by a lookup of the items for the DOIs in
+    the filter of the URL, one item per page. Return the list of requests,
+    each a tuple of the requested DOIs and the cursor.
+    """
+    items = dict([(d, get_item(d)) for d in ("10.1/a", "10.1/b", "10.1/c")])
+    items["10.1/bad"] = get_item("10.1/bad", title=False)
+    requests = []
+
+    def get_response(url, timeout=None, debug=False):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+        dois = [f[len("doi:") :] for f in query["filter"][0].split(",")]
+        cursor = query["cursor"][0]
+        requests.append((dois, cursor))
+        found = [items[d] for d in dois if d in items]
+        pos = 0 if cursor == "*" else int(cursor)
+        if pos >= len(found):
+            return Response(get_works([]))
+        return Response(get_works(found[pos : pos + 1], cursor=str(pos + 1)))
+
+    monkeypatch.setattr(crossref, "get_response", get_response)
+    return requests
+
+
+def test_fetch_many_chunks(works):
+    "Requests are made per chunk of DOIs, paging with the cursor."
+    dois = ["10.1/a", "10.1/b", "10.1/a", "10.1/c"]
+    result, missing = crossref.fetch_many(dois, chunk_size=2, delay=0)
+    assert works == [
+        (["10.1/a", "10.1/b"], "*"),
+        (["10.1/a", "10.1/b"], "1"),
+        (["10.1/c"], "*"),
+    ]
+    assert sorted(result) == ["10.1/a", "10.1/b", "10.1/c"]
+    assert missing == []
+
+
+def test_fetch_many_missing(works):
+    "DOIs without an item, with an invalid one, or with a comma are missing."
+    dois = ["10.1/a", "10.1/x", "10.1/bad", "10.1/a,b"]
+    result, missing = crossref.fetch_many(dois, delay=0)
+    assert list(result) == ["10.1/a"]
+    assert missing == ["10.1/x", "10.1/bad", "10.1/a,b"]
+    assert all(["10.1/a,b" not in dois for dois, cursor in works])
@@ -0,0 +1,124 @@
+"""Test the bulk resolution of researcher ORCIDs for publications.
+
+These tests need neither a database nor a web server. Run them from
+the top directory of the repository:
+$ python -m pytest tests/test_database.py
+"""
+
+import pytest
+
+from publications import constants
+from publications import settings
+
+import publications.admin
+import publications.changes
+import publications.database
+import publications.requesthandler
+
+
+class Database:
+    "In-memory database emulating bulk gets."
+
+    def __init__(self, docs):
+        self.docs = dict([(d["_id"], d) for d in docs])
+        self.requests = []  # List of lists of IUIDs for each bulk get.
+
+    def get_bulk(self, iuids):
+        self.requests.append(list(iuids))
+        return [self.docs.get(iuid) for iuid in iuids]
+
+
+class Handler:
+    "Minimal request handler, for resolving ORCIDs."
+
+    get_orcids = publications.requesthandler.RequestHandler.get_orcids
+
+    def __init__(self, db):
+        self.db = db
+
+
+def get_researcher(iuid, orcid=None):
+    "Return a researcher document."
+    doc = {"_id": iuid, constants.DOCTYPE: constants.RESEARCHER}
+    if orcid:
+        doc["orcid"] = orcid
+    return doc
+
+
+def get_publication(iuid, *researchers):
+    "Return a publication document having authors linked to the researchers."
+    authors = [{"family": "Svensson", "researcher": r} for r in researchers]
+    authors.append({"family": "Andersson"})
+    return {"_id": iuid, constants.DOCTYPE: constants.PUBLICATION, "authors": authors}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    "The in-memory database, without the ORCID cache."
+    settings.update(publications.admin.DEFAULT_SETTINGS)
+    monkeypatch.setattr(publications.database, "_orcid_cache", None)
+    return Database(
+        [
+            get_researcher("r1", "0000-0001-0000-0001"),
+            get_researcher("r2", "0000-0001-0000-0002"),
+            get_researcher("r3"),
+            get_publication("p1"),
+        ]
+    )
+
+
+@pytest.fixture
+def cache(db, monkeypatch):
+    "The process-wide ORCID cache, updated by direct notification."
+    monkeypatch.setattr(publications.changes, "_listeners", [])
+    return publications.database.create_orcid_cache()
+
+
+def test_get_orcids(db, monkeypatch):
+    "ORCIDs are fetched in chunks; None for those lacking or not researchers."
+    monkeypatch.setitem(settings, "DATABASE_BULK_CHUNK_SIZE", 2)
+    iuids = ["r1", "r2", "r3", "r9", "p1"]
+    orcids = publications.database.get_orcids(db, iuids)
+    assert orcids == {
+        "r1": "0000-0001-0000-0001",
+        "r2": "0000-0001-0000-0002",
+        "r3": None,
+        "r9": None,
+        "p1": None,
+    }
+    assert db.requests == [["r1", "r2"], ["r3", "r9"], ["p1"]]
+
+
+def test_get_orcids_cache(db, cache):
+    "Cached ORCIDs, also lacking ones, are not fetched again."
+    publications.database.get_orcids(db, ["r1", "r3"])
+    orcids = publications.database.get_orcids(db, ["r1", "r2", "r3"])
+    assert orcids["r1"] == "0000-0001-0000-0001"
+    assert orcids["r3"] is None
+    assert db.requests == [["r1", "r3"], ["r2"]]
+    assert cache.get_stats()["hits"] == 2
+
+
+def test_get_orcids_cache_update(db, cache):
+    "A changed or deleted researcher is removed from the cache."
+    publications.database.get_orcids(db, ["r1", "r2", "r3"])
+    db.docs["r3"]["orcid"] = "0000-0001-0000-0003"
+    publications.changes.notify(db.docs["r3"])
+    publications.changes.notify({"_id": "r1", "_deleted": True})
+    publications.changes.notify(get_publication("r2"))
+    orcids = publications.database.get_orcids(db, ["r1", "r2", "r3"])
+    assert orcids["r3"] == "0000-0001-0000-0003"
+    assert db.requests[-1] == ["r1", "r3"]
+
+
+def test_handler_get_orcids(db):
+    "The ORCIDs for all authors are fetched at once, and kept for the request."
+    handler = Handler(db)
+    docs = [get_publication("p2", "r1", "r3"), get_publication("p3", "r1", "r2")]
+    orcids = handler.get_orcids(docs)
+    assert orcids["r2"] == "0000-0001-0000-0002"
+    assert len(db.requests) == 1
+    assert sorted(db.requests[0]) == ["r1", "r2", "r3"]
+    handler.get_orcids(docs)
+    handler.get_orcids([get_publication("p4", "r1", "r9")])
+    assert db.requests[1:] == [["r9"]]
@@ -0,0 +1,137 @@
+"""Test the parsing of PubMed efetch results for many PMIDs.
+
+These tests need no network access. Run them from the top directory
+of the repository:
+$ python -m pytest tests/test_pubmed.py
+"""
+
+import os.path
+
+import pytest
+
+from publications import pubmed
+
+ARTICLE = """<PubmedArticle>
+<MedlineCitation>
+<PMID>{pmid}</PMID>
+<Article>
+<Journal>
+<ISSN>1234-5678</ISSN>
+<JournalIssue><Volume>12</Volume><Issue>3</Issue>
+<PubDate><Year>2021</Year><Month>Mar</Month><Day>4</Day></PubDate>
+</JournalIssue>
+<ISOAbbreviation>J Test</ISOAbbreviation>
+</Journal>
+{title}
+<Pagination><MedlinePgn>101-9</MedlinePgn></Pagination>
+<AuthorList>
+<Author><LastName>Svensson</LastName><ForeName>Anna</ForeName>
+<Initials>A</Initials></Author>
+</AuthorList>
+<PublicationTypeList><PublicationType>Journal Article</PublicationType>
+</PublicationTypeList>
+</Article>
+</MedlineCitation>
+<PubmedData>
+<ArticleIdList>
+<ArticleId IdType="pubmed">{pmid}</ArticleId>
+<ArticleId IdType="doi">10.1000/test.{pmid}</ArticleId>
+</ArticleIdList>
+</PubmedData>
+</PubmedArticle>"""
+
+
+def get_article(pmid, title=True):
+    "Return the XML for an article; without a title it cannot be parsed."
+    if title:
+        title = f"<ArticleTitle>Article {pmid}.</ArticleTitle>"
+    else:
+        title = ""
+    return ARTICLE.format(pmid=pmid, title=title)
+
+
+def get_articleset(*articles):
+    "Return the XML for an efetch result of the articles."
+    return "<PubmedArticleSet>" + "".join(articles) + "</PubmedArticleSet>"
+
+
+def test_parse_many():
+    "Each article in an efetch result is parsed and keyed by its PMID."
+    data = get_articleset(get_article("101"), get_article("102"))
+    result = pubmed.parse_many(data)
+    assert sorted(result) == ["101", "102"]
+    publication = result["102"]
+    assert publication["pmid"] == "102"
+    assert publication["title"] == "Article 102."
+    assert publication["doi"] == "10.1000/test.102"
+    assert publication["published"] == "2021-03-04"
+    assert publication["journal"]["pages"] == "101-109"
+    assert publication["authors"][0]["family"] == "Svensson"
+
+
+def test_parse_many_same_as_parse():
+    "The result for an article is the same as when fetched on its own."
+    single = pubmed.parse(get_articleset(get_article("101")))
+    many = pubmed.parse_many(get_articleset(get_article("101"), get_article("102")))
+    assert many["101"] == single
+
+
+def test_parse_many_skips_invalid():
+    "Articles that cannot be parsed are skipped, not failing the others."
+    data = get_articleset(get_article("101", title=False), get_article("102"))
+    assert list(pubmed.parse_many(data)) == ["102"]
+    assert pubmed.parse_many(get_articleset()) == {}
+
+
+def test_parse_many_file_cache(tmp_path):
+    "Each article is stored separately, and can then be read on its own."
+    data = get_articleset(get_article("101"), get_article("102"))
+    result = pubmed.parse_many(data, dirname=str(tmp_path))
+    assert os.path.exists(tmp_path / "101.xml")
+    assert pubmed.parse(pubmed.read_file(str(tmp_path), "102")) == result["102"]
+
+
+@pytest.fixture
+def efetch(monkeypatch):
+    """Replace the HTTP request by a lookup of the articles for the PMIDs
+    in the URL. Return the list of requested chunks of PMIDs.
+    """
+    articles = dict([(p, get_article(p)) for p in ("101", "102", "103", "104")])
+    articles["105"] = get_article("105", title=False)
+    requests = []
+
+    def get_content(url, timeout=None, delay=None, debug=False, key=None):
+        pmids = url.split("&id=")[1].split("&")[0].split(",")
+        requests.append(pmids)
+        return get_articleset(*[articles[p] for p in pmids if p in articles])
+
+    monkeypatch.setattr(pubmed, "get_content", get_content)
+    return requests
+
+
+def test_fetch_many_chunks(efetch):
+    "One request is made per chunk of PMIDs; duplicates are fetched once."
+    pmids = ["101", "102", "103", "101", "104"]
+    result, missing = pubmed.fetch_many(pmids, chunk_size=2, delay=0)
+    assert efetch == [["101", "102"], ["103", "104"]]
+    assert sorted(result) == ["101", "102", "103", "104"]
+    assert missing == []
+
+
+def test_fetch_many_missing(efetch):
+    "PMIDs without an article, or with an invalid one, are reported as missing."
+    result, missing = pubmed.fetch_many(["101", "999", "105", "102"], delay=0)
+    assert len(efetch) == 1
+    assert sorted(result) == ["101", "102"]
+    assert missing == ["999", "105"]
+
+
+def test_fetch_many_file_cache(efetch, tmp_path):
+    "PMIDs in the file cache are not requested again."
+    pubmed.fetch_many(["101", "102"], dirname=str(tmp_path), delay=0)
+    result, missing = pubmed.fetch_many(
+        ["101", "102", "103"], dirname=str(tmp_path), delay=0
+    )
+    assert efetch == [["101", "102"], ["103"]]
+    assert sorted(result) == ["101", "102", "103"]
+    assert missing == []
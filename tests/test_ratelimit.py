@@ -0,0 +1,95 @@
+"""Test the token-bucket rate limiter shared between processes.
+
+These tests need neither a database nor network access. Run them from
+the top directory of the repository:
+$ python -m pytest tests/test_ratelimit.py
+"""
+
+import sqlite3
+
+import pytest
+
+from publications import ratelimit
+
+
+class Clock:
+    "Replacement for the time functions; sleeping advances the time."
+
+    def __init__(self):
+        self.now = 1000000.0
+        self.slept = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    "The replaced clock used by the rate limiter."
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "time", clock.time)
+    monkeypatch.setattr(ratelimit.time, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def filepath(tmp_path):
+    "The path of the SQLite file for the bucket state."
+    return str(tmp_path / "ratelimit.sqlite3")
+
+
+def test_take(clock, filepath):
+    "Tokens are taken up to the capacity; then the wait is given."
+    bucket = ratelimit.TokenBucket("Test", 4.0, filepath, capacity=2)
+    assert bucket.take() == 0.0
+    assert bucket.take() == 0.0
+    assert bucket.take() == pytest.approx(0.25)
+
+
+def test_refill(clock, filepath):
+    "Tokens are refilled at the rate, but not beyond the capacity."
+    bucket = ratelimit.TokenBucket("Test", 4.0, filepath, capacity=2)
+    bucket.take()
+    bucket.take()
+    clock.now += 0.25
+    assert bucket.take() == 0.0
+    assert bucket.take() == pytest.approx(0.25)
+    clock.now += 100.0
+    assert [bucket.take() for i in range(3)][-1] == pytest.approx(0.25)
+
+
+def test_shared(clock, filepath):
+    "Buckets of the same name share the state in the file, as for processes."
+    first = ratelimit.TokenBucket("Test", 2.0, filepath)
+    second = ratelimit.TokenBucket("Test", 2.0, filepath)
+    other = ratelimit.TokenBucket("Other", 2.0, filepath)
+    assert first.take() == 0.0
+    assert second.take() == pytest.approx(0.5)
+    assert other.take() == 0.0
+
+
+def test_acquire(clock, filepath):
+    "Acquiring waits until a token is available; the average rate holds."
+    bucket = ratelimit.TokenBucket("Test", 4.0, filepath, capacity=1)
+    for i in range(9):
+        bucket.acquire()
+    assert clock.slept == pytest.approx(2.0)
+    stats = bucket.get_stats()
+    assert stats["acquired"] == 9
+    assert stats["waited"] == pytest.approx(2.0)
+    assert stats["errors"] == 0
+
+
+def test_acquire_error(clock, filepath):
+    "If the shared state is unusable, the wait is for one token at the rate."
+    bucket = ratelimit.TokenBucket("Test", 2.0, filepath)
+    cnx = sqlite3.connect(filepath)
+    cnx.execute("DROP TABLE buckets")
+    cnx.close()
+    bucket.acquire()
+    assert clock.slept == pytest.approx(0.5)
+    assert bucket.get_stats()["errors"] == 1
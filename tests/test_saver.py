@@ -0,0 +1,154 @@
+"""Test the bulk saving of documents with log entries.
+
+These tests need neither a database nor a web server. Run them from
+the top directory of the repository:
+$ python -m pytest tests/test_saver.py
+
+The database is replaced by an in-memory one, which emulates the
+revision checks of the '_bulk_docs' and '_bulk_get' requests.
+"""
+
+import copy
+
+import pytest
+
+from publications import constants
+from publications import settings
+
+import publications.admin
+import publications.changes
+import publications.saver
+
+
+class Database:
+    "In-memory database emulating bulk updates and gets."
+
+    def __init__(self, docs):
+        self.docs = dict([(d["_id"], copy.deepcopy(d)) for d in docs])
+        self.updates = []  # List of lists of IUIDs for each bulk update.
+        self.logs = []
+        self.conflicts = {}  # Key: IUID, value: number of conflicts to give.
+        self.errors = {}  # Key: IUID, value: reason.
+
+    def update(self, docs):
+        self.updates.append([d["_id"] for d in docs])
+        result = []
+        for doc in docs:
+            iuid = doc["_id"]
+            if doc[constants.DOCTYPE] == constants.LOG:
+                self.logs.append(doc)
+                result.append((True, iuid, "1-log"))
+            elif iuid in self.errors:
+                result.append((False, iuid, "forbidden", self.errors[iuid]))
+            elif self.conflicts.get(iuid):
+                # Emulate a save by another process in between.
+                self.conflicts[iuid] -= 1
+                stored = self.docs[iuid]
+                stored["_rev"] = self.get_rev(stored["_rev"])
+                stored["other"] = True
+                result.append((False, iuid, "conflict", "Document update conflict."))
+            elif doc.get("_rev") != self.docs[iuid].get("_rev"):
+                result.append((False, iuid, "conflict", "Document update conflict."))
+            else:
+                self.docs[iuid] = copy.deepcopy(doc)
+                self.docs[iuid]["_rev"] = self.get_rev(doc["_rev"])
+                result.append((True, iuid, self.docs[iuid]["_rev"]))
+        return result
+
+    def get_bulk(self, iuids):
+        return [copy.deepcopy(self.docs.get(iuid)) for iuid in iuids]
+
+    def get_rev(self, rev):
+        return f"{int(rev.split('-')[0]) + 1}-x"
+
+
+class Saver(publications.saver.Saver):
+    doctype = constants.PUBLICATION
+
+
+def get_docs(count):
+    "Return the given number of saved publication documents."
+    return [
+        {
+            "_id": f"p{number}",
+            "_rev": "1-x",
+            constants.DOCTYPE: constants.PUBLICATION,
+            "title": f"Title {number}",
+            "labels": {},
+        }
+        for number in range(count)
+    ]
+
+
+def add_label(saver):
+    labels = saver["labels"].copy()
+    labels["Genomics"] = None
+    saver["labels"] = labels
+
+
+@pytest.fixture
+def notified(monkeypatch):
+    "The list of documents notified as changed."
+    settings.update(publications.admin.DEFAULT_SETTINGS)
+    result = []
+    monkeypatch.setattr(publications.changes, "notify", result.append)
+    return result
+
+
+def test_save(notified):
+    "Changed documents are saved in chunks, each followed by its log entries."
+    db = Database(get_docs(5))
+    bulk = publications.saver.BulkSaver(Saver, db=db, chunk_size=2)
+    saved = bulk.save([copy.deepcopy(d) for d in get_docs(5)], add_label)
+    assert [d["_id"] for d in saved] == ["p0", "p1", "p2", "p3", "p4"]
+    assert [len(iuids) for iuids in db.updates] == [2, 2, 2, 2, 1, 1]
+    assert all([d["labels"] == {"Genomics": None} for d in db.docs.values()])
+    assert all([d["_rev"] == "2-x" for d in saved])
+    assert [log["doc"] for log in db.logs] == ["p0", "p1", "p2", "p3", "p4"]
+    assert db.logs[0]["changed"] == {"labels": {"Genomics": None}}
+    assert notified == saved
+    assert not bulk.failed
+    assert bulk.get_failed_message() is None
+
+
+def test_save_unchanged(notified):
+    "Documents not changed by the modification are not saved."
+    docs = get_docs(3)
+    docs[1]["labels"] = {"Genomics": None}
+    db = Database(docs)
+    bulk = publications.saver.BulkSaver(Saver, db=db)
+    saved = bulk.save(docs, add_label)
+    assert [d["_id"] for d in saved] == ["p0", "p2"]
+    assert db.updates == [["p0", "p2"], [db.logs[0]["_id"], db.logs[1]["_id"]]]
+    db.updates = []
+    assert bulk.save(docs, add_label) == saved
+    assert db.updates == []
+
+
+def test_save_conflict(notified):
+    "A document having a conflict is read again and modified anew."
+    db = Database(get_docs(3))
+    db.conflicts["p1"] = 2
+    bulk = publications.saver.BulkSaver(Saver, db=db)
+    saved = bulk.save(get_docs(3), add_label)
+    assert sorted([d["_id"] for d in saved]) == ["p0", "p1", "p2"]
+    assert db.docs["p1"]["other"]
+    assert db.docs["p1"]["labels"] == {"Genomics": None}
+    assert db.docs["p1"]["_rev"] == "4-x"
+    assert len(db.logs) == 3
+    assert not bulk.failed
+
+
+def test_save_failed(notified):
+    "Documents still having a conflict after retries, or an error, fail."
+    db = Database(get_docs(3))
+    db.conflicts["p0"] = 2
+    db.errors["p2"] = "Not allowed."
+    bulk = publications.saver.BulkSaver(Saver, db=db, max_retries=1)
+    saved = bulk.save(get_docs(3), add_label)
+    assert [d["_id"] for d in saved] == ["p1"]
+    assert [log["doc"] for log in db.logs] == ["p1"]
+    assert bulk.failed == {"p0": "conflict", "p2": "Not allowed."}
+    assert bulk.get_failed_message() == (
+        "2 document(s) could not be saved: p2 (Not allowed.), p0 (conflict)"
+    )
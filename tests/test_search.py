@@ -0,0 +1,105 @@
+"""Test the ranking of search results in the in-memory search index.
+
+These tests need neither a database nor a web server. Run them from
+the top directory of the repository:
+$ python -m pytest tests/test_search.py
+"""
+
+import pytest
+
+from publications import constants
+from publications import settings
+
+import publications.admin
+import publications.search
+
+
+def get_doc(iuid, title, published="2020-01-01", **fields):
+    "Return a minimal publication document."
+    doc = {
+        "_id": iuid,
+        constants.DOCTYPE: constants.PUBLICATION,
+        "title": title,
+        "published": published,
+        "authors": [],
+        "labels": {},
+    }
+    doc.update(fields)
+    return doc
+
+
+@pytest.fixture
+def index(monkeypatch):
+    "An empty search index, with default settings."
+    settings.update(publications.admin.DEFAULT_SETTINGS)
+    monkeypatch.setitem(settings, "SEARCH_FIELD_WEIGHTS", {})
+    return publications.search.SearchIndex()
+
+
+def test_term_frequency(index):
+    "More occurrences of the term in the same field length rank higher."
+    index.update(get_doc("once", "kinase signalling in yeast cells"))
+    index.update(get_doc("twice", "kinase kinase signalling in yeast"))
+    index.update(get_doc("none", "unrelated title of some length"))
+    total, ranked = index.rank(["kinase"], False, 10)
+    assert total == 2
+    assert ranked == ["twice", "once"]
+
+
+def test_field_length(index):
+    "The same number of occurrences in a shorter field ranks higher."
+    index.update(get_doc("long", "kinase in a very long title with many words"))
+    index.update(get_doc("short", "kinase structure"))
+    total, ranked = index.rank(["kinase"], False, 10)
+    assert ranked == ["short", "long"]
+
+
+def test_rare_term(index):
+    "A match of a rare term ranks above a match of a common term."
+    for number in range(5):
+        index.update(get_doc(f"common{number}", f"protein number {number}"))
+    index.update(get_doc("rare", "ribozyme catalysis"))
+    total, ranked = index.rank(["protein", "ribozyme"], False, 10)
+    assert total == 6
+    assert ranked[0] == "rare"
+
+
+def test_field_weight(index, monkeypatch):
+    "The score in a field is weighted by its setting."
+    index.update(get_doc("title", "cancer genomics"))
+    index.update(get_doc("notes", "other", notes="cancer genomics"))
+    total, ranked = index.rank(["cancer"], False, 10)
+    assert set(ranked) == {"title", "notes"}
+    monkeypatch.setitem(settings, "SEARCH_FIELD_WEIGHTS", {"title": 2.0})
+    assert index.rank(["cancer"], False, 10)[1] == ["title", "notes"]
+    monkeypatch.setitem(settings, "SEARCH_FIELD_WEIGHTS", {"notes": 2.0})
+    assert index.rank(["cancer"], False, 10)[1] == ["notes", "title"]
+
+
+def test_ties_and_limit(index):
+    "Equal scores are ordered by reverse published date; the total is complete."
+    for number, published in enumerate(["2018-05-01", "2021-01-01", "2019-07-01"]):
+        index.update(get_doc(f"p{number}", "lipid rafts", published=published))
+    total, ranked = index.rank(["lipid"], False, 2)
+    assert total == 3
+    assert ranked == ["p1", "p2"]
+
+
+def test_exact_and_prefix(index):
+    "A term matches keys beginning with it, unless exact."
+    index.update(get_doc("prefix", "kinases"))
+    index.update(get_doc("exact", "kinase"))
+    assert index.rank(["kinase"], True, 10) == (1, ["exact"])
+    assert index.rank(["kinase"], False, 10)[0] == 2
+
+
+def test_update_and_delete(index):
+    "Changed and deleted publications are reflected in the ranking."
+    index.update(get_doc("a", "membrane transport"))
+    index.update(get_doc("b", "membrane membrane transport"))
+    assert index.rank(["membrane"], False, 10)[1] == ["b", "a"]
+    index.update(get_doc("b", "transport"))
+    assert index.rank(["membrane"], False, 10) == (1, ["a"])
+    index.update({"_id": "a", "_deleted": True})
+    assert index.rank(["membrane"], False, 10) == (0, [])
+    assert index.search(["transport"], False) == {"b"}
@@ -0,0 +1,385 @@
+"""Test the planner for subset selection expressions.
+
+These tests need neither a database nor a web server. Run them from
+the top directory of the repository:
+$ python -m pytest tests/test_subset.py
+
+The database is replaced by an in-memory one, which emulates the views
+used by the subset functions. The result of every planned evaluation
+must be the same as a naive left-to-right evaluation of the expression,
+with and without the in-memory index.
+"""
+
+import pyparsing as pp
+import pytest
+
+from publications import constants
+from publications import settings
+
+import publications.admin
+import publications.index
+import publications.subset
+
+
+class Row:
+    "A row in a view result."
+
+    def __init__(self, id, key, value=None, doc=None):
+        self.id = id
+        self.key = key
+        self.value = value
+        self.doc = doc
+
+
+def get_author_keys(doc):
+    result = []
+    for author in doc["authors"]:
+        family = author.get("family_normalized")
+        if not family:
+            continue
+        result.append(family)
+        if author.get("initials_normalized"):
+            result.append(f"{family} {author['initials_normalized']}")
+        if author.get("given_normalized"):
+            result.append(f"{family} {author['given_normalized']}")
+    return result
+
+
+def get_first_published(doc):
+    if not doc.get("published"):
+        return []
+    if doc.get("epublished"):
+        return [min(doc["published"], doc["epublished"])]
+    return [doc["published"]]
+
+
+# Emulation of the map functions of the 'publication' design document.
+PUBLICATION_VIEWS = {
+    "year": lambda d: [d["published"].split("-")[0]] if d.get("published") else [],
+    "published": lambda d: [d["published"]] if d.get("published") else [],
+    "epublished": lambda d: [d["epublished"]] if d.get("epublished") else [],
+    "first_published": get_first_published,
+    "label": lambda d: [label.lower() for label in d["labels"]],
+    "author": get_author_keys,
+    "issn": lambda d: [
+        d["journal"][k] for k in ("issn", "issn-l") if d["journal"].get(k)
+    ],
+    "researcher": lambda d: [
+        a["researcher"] for a in d["authors"] if a.get("researcher")
+    ],
+    "no_pmid": lambda d: [] if d.get("pmid") else [d.get("published")],
+    "no_doi": lambda d: [] if d.get("doi") else [d.get("published")],
+    "no_label": lambda d: [] if d["labels"] else [d["title"]],
+}
+
+
+class Database:
+    "In-memory database emulating the CouchDB views used by subset selection."
+
+    def __init__(self, docs, researchers):
+        self.docs = docs
+        self.researchers = researchers
+
+    def view(
+        self,
+        designname,
+        viewname,
+        key=None,
+        startkey=None,
+        endkey=None,
+        skip=None,
+        limit=None,
+        descending=False,
+        reduce=None,
+        include_docs=False,
+    ):
+        if designname == "publication":
+            function = PUBLICATION_VIEWS[viewname]
+            rows = [Row(d["_id"], k) for d in self.docs for k in function(d)]
+        elif (designname, viewname) == ("researcher", "orcid"):
+            rows = [Row(d["_id"], d["orcid"], doc=d) for d in self.researchers]
+        else:
+            raise NotImplementedError(f"{designname}/{viewname}")
+        rows.sort(key=lambda r: (r.key or "", r.id), reverse=descending)
+        if key is not None:
+            rows = [r for r in rows if r.key == key]
+        if startkey is not None:
+            if descending:
+                rows = [r for r in rows if r.key <= startkey]
+            else:
+                rows = [r for r in rows if r.key >= startkey]
+        if endkey is not None:
+            if descending:
+                rows = [r for r in rows if r.key >= endkey]
+            else:
+                rows = [r for r in rows if r.key <= endkey]
+        if reduce:
+            return [Row(None, None, value=len(rows))] if rows else []
+        rows = rows[skip or 0 :]
+        if limit:
+            rows = rows[:limit]
+        return rows
+
+
+def get_docs():
+    "Return a deterministic set of varied publication documents."
+    result = []
+    for number in range(60):
+        year = str(2015 + number % 6)
+        published = f"{year}-{1 + number % 12:02d}-{1 + number % 28:02d}"
+        doc = {
+            "_id": f"p{number:02d}",
+            constants.DOCTYPE: constants.PUBLICATION,
+            "title": f"Title {number}",
+            "published": published,
+            "labels": {},
+            "authors": [
+                {
+                    "family_normalized": ("smith", "jones", "smythe")[number % 3],
+                    "initials_normalized": ("a", "ab", "b", "c")[number % 4],
+                }
+            ],
+            "journal": {"issn": ("1111-1111", "2222-2222")[number % 2]},
+        }
+        if number % 5 == 0:
+            doc["authors"][0]["researcher"] = "r1"
+        if number % 3:
+            doc["labels"]["Genomics"] = None
+        if number % 4 == 1:
+            doc["labels"]["Proteomics"] = "Service"
+        if number % 7 == 0:
+            doc["labels"]["Genomics Lund"] = None
+        if number % 2:
+            doc["pmid"] = str(1000 + number)
+        if number % 3 == 1:
+            doc["doi"] = f"10.1000/{number}"
+        if number % 4 == 2:
+            doc["epublished"] = f"{int(year) - 1}-12-15"
+        if number == 59:
+            del doc["published"]
+        result.append(doc)
+    return result
+
+
+EXPRESSIONS = [
+    "year(2016)",
+    "year(2016) + year(2017)",
+    "label(Genomics) # year(2018)",
+    "year(2018) # label(Genomics)",
+    "label(Genomics*) # author(smith*)",
+    "author(smith a*) + author(jones)",
+    "issn(1111-1111) # label(proteomics) # year(2019)",
+    "year(2017) # published(2017-06-01)",
+    "published(2017-06-01) # year(2017) # label(Genomics)",
+    "published(2016-03-01) # published(2018-01-01)",
+    "year(2016) # year(2017)",
+    "year(2016) # published(2017-01-01)",
+    "year(201) # published(2010)",
+    "year( 2016 ) # published(2016)",
+    "year(2016) # published(2016-05-01) # year(2016)",
+    "label(Genomics) - year(2016) - label(Proteomics)",
+    "(label(Genomics) - year(2016)) - label(Proteomics)",
+    "label(Genomics) - (year(2016) - label(Proteomics))",
+    "year(2015) - label(Genomics) # issn(2222-2222)",
+    "year(2015) + year(2016) # label(Genomics)",
+    "year(2015) + (year(2016) # label(Genomics))",
+    "label(Genomics) ^ label(Proteomics) ^ year(2020)",
+    "label(Genomics) # (year(2016) + year(2017)) # issn(1111-1111)",
+    "(year(2016) # label(Genomics)) # (published(2016-06-01) # author(smith))",
+    "orcid(0000-0001-2345-6789) # year(2015)",
+    "orcid(0000-0009-9999-9999) + year(2015)",
+    "no_pmid() # no_doi()",
+    "no_label() - year(2020)",
+    "first(2018) # online(2018) # label(Genomics)",
+    "year(2019) # published(2019) - no_pmid()",
+    "label(none) # year(2016) # label(Genomics)",
+]
+
+
+@pytest.fixture(scope="module")
+def db():
+    "The in-memory database, with default settings."
+    settings.update(publications.admin.DEFAULT_SETTINGS)
+    settings["TEMPORAL_LABELS"] = False
+    researchers = [{"_id": "r1", "orcid": "0000-0001-2345-6789"}]
+    return Database(get_docs(), researchers)
+
+
+@pytest.fixture(params=["views", "cache", "index"])
+def index(request, db, monkeypatch):
+    "Evaluate using the views, the views with result cache, or the in-memory index."
+    if request.param == "index":
+        index = publications.index.Index()
+        for doc in db.docs:
+            index.update(doc)
+    else:
+        index = None
+    if request.param == "cache":
+        cache = publications.subset.ResultCache(1000)
+    else:
+        cache = None
+    monkeypatch.setattr(publications.index, "_index", index)
+    monkeypatch.setattr(publications.subset, "_result_cache", cache)
+    return index
+
+
+def evaluate_naive(db, item, variables):
+    "Evaluate the parsed expression item strictly left-to-right, as written."
+    if isinstance(item, pp.ParseResults):
+        item = item[0]
+    if isinstance(item, publications.subset._Expression):
+        result = evaluate_naive(db, item.stack[0], variables)
+        for pos in range(1, len(item.stack), 2):
+            other = evaluate_naive(db, item.stack[pos + 1], variables)
+            result = item.stack[pos].evaluate(result, other)
+        return result
+    return item.evaluate(db, variables)
+
+
+@pytest.mark.parametrize("expression", EXPRESSIONS)
+def test_plan_equivalence(db, index, expression):
+    "The optimized plan must give the same result as naive evaluation."
+    expected = evaluate_naive(db, publications.subset.parse_expression(expression), {})
+    # Evaluate repeatedly, so that any result cache is used.
+    for explain in (False, True, False):
+        plan = publications.subset.get_plan(db, expression, explain=explain)
+        result = plan.evaluate(db, {})
+        assert result.iuids == expected.iuids, plan.explain()
+
+
+def test_plan_variables(db, index):
+    "Variables are evaluated as given, also when reordered by the planner."
+    variables = {"blah": publications.subset.Subset(db, year="2016")}
+    expression = "label(Genomics) # blah # author(smith*)"
+    expected = evaluate_naive(
+        db, publications.subset.parse_expression(expression), variables
+    )
+    result = publications.subset.get_subset(db, expression, variables)
+    assert result.iuids == expected.iuids
+
+
+def test_plan_order(db, index):
+    "The most selective operand of an intersection is evaluated first."
+    plan = publications.subset.get_plan(
+        db, "label(Genomics) # issn(1111-1111) # label(Genomics Lund)"
+    )
+    names = [c.name for c in plan.children]
+    assert names[0] == "label(Genomics Lund)"
+    estimates = [c.estimated for c in plan.children]
+    assert estimates == sorted(estimates)
+
+
+def test_plan_empty(db, index):
+    "Intersections certain to be empty are not evaluated at all."
+    for expression in [
+        "year(2016) # year(2017) # label(Genomics)",
+        "year(2016) # published(2017-01-01)",
+    ]:
+        plan = publications.subset.get_plan(db, expression)
+        assert isinstance(plan, publications.subset._PlanEmpty)
+        assert len(plan.evaluate(db, {})) == 0
+
+
+def test_plan_skip(db, index):
+    "The evaluation of an intersection stops at an empty intermediate result."
+    plan = publications.subset.get_plan(db, "label(none) # year(2016)")
+    assert len(plan.evaluate(db, {})) == 0
+    steps = plan.explain()
+    assert steps[-1]["actual"] is None
+    assert steps[-1]["note"].startswith("skipped")
+
+
+def test_normalize_expression():
+    "Surrounding whitespace and line ends do not change the expression."
+    normalize = publications.subset.normalize_expression
+    assert normalize("  year(2016)\r\n") == "year(2016)"
+    assert normalize("year(2016) +\r\nyear(2017)\n") == "year(2016) +\nyear(2017)"
+    assert normalize("year(2016) +\ryear(2017)") == normalize(
+        "year(2016) +\nyear(2017)"
+    )
+
+
+def test_view_keys(db):
+    """The view keys for a publication are those emitted by the views.
+    A missing date is given as an empty string rather than null.
+    """
+    for doc in db.docs:
+        for viewname, function in PUBLICATION_VIEWS.items():
+            keys = publications.subset._get_view_keys(viewname, doc)
+            expected = [k or "" for k in function(doc)]
+            assert sorted(keys) == sorted(expected), viewname
+
+
+def test_may_select():
+    "A changed publication may be selected by a query for a key or range."
+    may_select = publications.subset._may_select
+    key = publications.subset._get_cache_key
+    ceiling = constants.CEILING
+    doc = {
+        "_id": "p1",
+        constants.DOCTYPE: constants.PUBLICATION,
+        "title": "Title",
+        "published": "2016-05-01",
+        "labels": {"Genomics": None},
+        "authors": [{"family_normalized": "smith", "initials_normalized": "a"}],
+        "journal": {},
+    }
+    assert may_select(key("publication", "year", "2016"), doc)
+    assert not may_select(key("publication", "year", "2017"), doc)
+    assert may_select(key("publication", "label", "genomics"), doc)
+    assert not may_select(key("publication", "label", "Genomics"), doc)
+    # Wildcard at end of the key.
+    assert may_select(key("publication", "label", "gen", "gen" + ceiling), doc)
+    assert may_select(key("publication", "author", "smith a", "smith a" + ceiling), doc)
+    assert not may_select(key("publication", "author", "smy", "smy" + ceiling), doc)
+    # Open and closed intervals, in any order.
+    assert may_select(key("publication", "published", "2016", ceiling), doc)
+    assert not may_select(key("publication", "published", "2017", ceiling), doc)
+    assert may_select(key("publication", "published", "2016-06", "2016-01"), doc)
+    assert not may_select(key("publication", "published", "2016-06", "2016-12"), doc)
+    # No key: any publication emitting a key.
+    assert may_select(key("publication", "no_pmid"), doc)
+    assert not may_select(key("publication", "no_label"), doc)
+    assert not may_select(key("publication", "issn"), doc)
+    # Unknown views, other designs and limited queries may always select.
+    assert may_select(key("publication", "unknown", "x"), doc)
+    assert may_select(key("researcher", "orcid", "x"), doc)
+    assert may_select(key("publication", "year", "2017", limit=10), doc)
+
+
+def test_result_cache_update():
+    "A change removes only the cache entries that may be affected."
+    cache = publications.subset.ResultCache(10)
+    key = publications.subset._get_cache_key
+    cache.put(key("publication", "year", "2016"), frozenset(["p1", "p2"]))
+    cache.put(key("publication", "year", "2017"), frozenset(["p3"]))
+    cache.put(key("publication", "year", "2018"), frozenset(["p4"]))
+    # Moved from 2016 to 2017.
+    doc = {
+        "_id": "p1",
+        constants.DOCTYPE: constants.PUBLICATION,
+        "published": "2017-01-01",
+    }
+    cache.update(doc)
+    assert len(cache) == 1
+    assert cache.get(key("publication", "year", "2018")) == {"p4"}
+    assert cache.get_stats()["invalidations"] == 2
+    # Deleted document; the doctype is not given.
+    cache.update({"_id": "p4", "_deleted": True})
+    assert len(cache) == 0
+    # Documents other than publications do not affect the cache.
+    cache.put(key("publication", "year", "2018"), frozenset(["p4"]))
+    cache.update({"_id": "r1", constants.DOCTYPE: constants.RESEARCHER})
+    assert len(cache) == 1
+
+
+def test_result_cache_generation():
+    "A value computed before a change is not cached; it may be out of date."
+    cache = publications.subset.ResultCache(10)
+    key = publications.subset._get_cache_key("publication", "year", "2016")
+    generation = cache.generation
+    cache.update({"_id": "p1", constants.DOCTYPE: constants.PUBLICATION})
+    cache.put(key, frozenset(["p1"]), generation=generation)
+    assert len(cache) == 0
+    cache.put(key, frozenset(["p1"]), generation=cache.generation)
+    assert cache.get(key) == {"p1"}
@@ -0,0 +1,65 @@
+"""Test the least-recently-used cache.
+
+These tests need neither a database nor a web server. Run them from
+the top directory of the repository:
+$ python -m pytest tests/test_utils.py
+"""
+
+import pytest
+
+from publications import utils
+
+
+def test_get_put():
+    "A cached value is returned; a missing key raises KeyError."
+    cache = utils.LruCache(size=2)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    with pytest.raises(KeyError):
+        cache.get("b")
+    cache.put("a", 2)
+    assert cache.get("a") == 2
+    assert len(cache) == 1
+
+
+def test_eviction():
+    "The least recently used item is evicted, where get counts as a use."
+    cache = utils.LruCache(size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+    assert len(cache) == 2
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    with pytest.raises(KeyError):
+        cache.get("b")
+    cache.put("a", 4)
+    cache.put("d", 5)
+    with pytest.raises(KeyError):
+        cache.get("c")
+
+
+def test_pop_clear():
+    "Items are removed by pop, also if not cached, and by clear."
+    cache = utils.LruCache(size=4)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.pop("a")
+    cache.pop("x")
+    assert len(cache) == 1
+    with pytest.raises(KeyError):
+        cache.get("a")
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_stats():
+    "Hits and misses are counted by get."
+    cache = utils.LruCache(size=4)
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("a")
+    with pytest.raises(KeyError):
+        cache.get("b")
+    assert cache.get_stats() == dict(size=4, items=1, hits=2, misses=1)